@@ -0,0 +1,219 @@
+import argparse
+import csv
+import json
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+
+import getStats
+
+def generate_session(json_filepath, csv_filepath, hands, players, table_size, seed=0, big_blind=20,
+                     game_id='benchmark', started_at=None):
+    # Write a synthetic pokernow hand log and matching ledger. Each player gets a random style
+    # (how often they fold and raise) and hands are played street by street until the bets are matched.
+    rng = random.Random(seed)
+    if started_at is None:
+        started_at = datetime(2023, 8, 1, 20, tzinfo=timezone.utc)
+    names = [f'Player{i}' for i in range(players)]
+    styles = {name: (rng.uniform(0.2, 0.6), rng.uniform(0.05, 0.3)) for name in names}  # (fold, raise)
+    net = dict.fromkeys(names, 0)
+
+    hand_logs = []
+    for hand_number in range(1, hands + 1):
+        hand_started_at = started_at + timedelta(seconds=45 * hand_number)
+        timestamp = int(hand_started_at.timestamp() * 1000)
+        seated = rng.sample(names, min(players, rng.randint(2, table_size)))
+        seats = sorted(rng.sample(range(1, table_size + 1), len(seated)))
+        seat_to_name = dict(zip(seats, seated))
+        deck = [rank + suit for rank in getStats.CARD_RANKS for suit in getStats.CARD_SUITS]
+        rng.shuffle(deck)
+        cards = {seat: [deck.pop(), deck.pop()] for seat in seats}
+
+        dealer_seat = rng.choice(seats)
+        order = seats[seats.index(dealer_seat) + 1:] + seats[:seats.index(dealer_seat) + 1]
+        if len(order) == 2:
+            order.reverse()  # Heads up the dealer posts the small blind
+        events = []
+
+        def add_event(payload):
+            events.append({'at': timestamp + len(events) * 1000, 'payload': payload})
+
+        contributed = dict.fromkeys(seats, 0)
+        add_event({'type': getStats.SMALL_BLIND, 'seat': order[0], 'value': big_blind // 2})
+        add_event({'type': getStats.BIG_BLIND, 'seat': order[1], 'value': big_blind})
+        contributed[order[0]] = big_blind // 2
+        contributed[order[1]] = big_blind
+        live = list(order)
+
+        for street in range(4):
+            if street:
+                if len(live) < 2:
+                    break
+                board = [deck.pop() for _ in range(3 if street == 1 else 1)]
+                add_event({'type': getStats.BOARD, 'turn': street, 'run': 1, 'cards': board})
+                street_bets = dict.fromkeys(live, 0)
+                to_call = 0
+                acting = list(live)
+            else:
+                street_bets = {seat: contributed[seat] for seat in live}
+                to_call = big_blind
+                acting = live[2:] + live[:2]
+
+            raises = 0
+            pending = list(acting)
+            while pending and len(live) > 1:
+                seat = pending.pop(0)
+                if seat not in live:
+                    continue
+                fold_rate, raise_rate = styles[seat_to_name[seat]]
+                owed = to_call - street_bets[seat]
+                roll = rng.random()
+                if raises < 4 and roll < raise_rate:
+                    to_call = max(to_call * 3, big_blind)
+                    add_event({'type': getStats.RAISE, 'seat': seat, 'value': to_call})
+                    contributed[seat] += to_call - street_bets[seat]
+                    street_bets[seat] = to_call
+                    raises += 1
+                    # Everyone else still in the hand has to act again
+                    pending = [other for other in acting[acting.index(seat) + 1:] + acting[:acting.index(seat)]
+                               if other in live]
+                elif owed > 0 and roll < raise_rate + fold_rate:
+                    add_event({'type': getStats.FOLD, 'seat': seat})
+                    live.remove(seat)
+                elif owed > 0:
+                    add_event({'type': getStats.CALL, 'seat': seat, 'value': to_call})
+                    contributed[seat] += owed
+                    street_bets[seat] = to_call
+                else:
+                    add_event({'type': getStats.CHECK, 'seat': seat})
+
+        pot = sum(contributed.values())
+        winner = rng.choice(live)
+        if len(live) > 1:
+            # Everyone left goes to showdown and shows, and the winner takes it with their cards
+            for seat in live:
+                add_event({'type': getStats.SHOWDOWN, 'seat': seat, 'cards': cards[seat]})
+            add_event({'type': getStats.WIN, 'seat': winner, 'cards': cards[winner]})
+        add_event({'type': getStats.POT_WINNER, 'seat': winner, 'value': pot, 'pot': 1, 'position': 1})
+
+        for seat, name in seat_to_name.items():
+            net[name] += (pot if seat == winner else 0) - contributed[seat]
+
+        hand_logs.append({
+            'id': f'{game_id}-{hand_number}', 'number': str(hand_number), 'gameType': 'th', 'cents': False,
+            'smallBlind': big_blind // 2, 'bigBlind': big_blind, 'ante': 0, 'dealerSeat': dealer_seat,
+            'startedAt': timestamp, 'seats': seats,
+            'players': [{'id': f'id-{name}', 'seat': seat, 'name': name, 'stack': 100 * big_blind,
+                         'hand': cards[seat]} for seat, name in seat_to_name.items()],
+            'events': events,
+        })
+
+    with open(json_filepath, 'w') as file:
+        json.dump({'generatedAt': started_at.isoformat(), 'playerId': 'id-Player0', 'gameId': game_id,
+                   'hands': hand_logs}, file)
+
+    session_start = started_at.isoformat().replace('+00:00', 'Z')
+    with open(csv_filepath, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['player_nickname', 'player_id', 'session_start_at', 'session_end_at',
+                         'buy_in', 'buy_out', 'stack', 'net'])
+        for name in names:
+            writer.writerow([name, f'id-{name}', session_start, '', 100 * big_blind,
+                             100 * big_blind + net[name], 0, net[name]])
+
+
+def generate_archive(directory, sessions, hands, players, table_size, seed=0):
+    # Lay out an archive like the one getStats reads, with one game per session on consecutive days
+    for subdirectory in ('CSV Data', 'JSON Data', 'CSV Output'):
+        os.makedirs(os.path.join(directory, 'Poker Hands', subdirectory), exist_ok=True)
+    for session in range(sessions):
+        game_id = f'bench{session:04d}'
+        generate_session(os.path.join(directory, 'Poker Hands', 'JSON Data', f'poker_now_log_{game_id}.json'),
+                         os.path.join(directory, 'Poker Hands', 'CSV Data', f'ledger_{game_id}.csv'),
+                         hands, players, table_size, seed=seed + session, game_id=game_id,
+                         started_at=datetime(2023, 1, 1, 20, tzinfo=timezone.utc) + timedelta(days=session))
+
+
+def measure(function, repeat):
+    # Best wall time over repeat runs, then peak traced memory from one extra run
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak
+
+
+def run_benchmarks(directory, workers, repeat):
+    json_directory = os.path.join('Poker Hands', 'JSON Data')
+    csv_directory = os.path.join('Poker Hands', 'CSV Data')
+    previous_directory = os.getcwd()
+    os.chdir(directory)  # calculate_overall_stats writes its CSV relative to the working directory
+    try:
+        sessions = getStats.list_sessions(csv_directory, json_directory)
+        json_filepath, csv_filepath = sessions[0]
+        session_hands = list(getStats.iter_hands(json_filepath))
+        total_hands = len(session_hands) * len(sessions)
+
+        benchmarks = []
+        for accumulator in getStats.default_accumulators():
+            benchmarks.append((type(accumulator).__name__, len(session_hands), lambda accumulator=accumulator:
+                               getStats.run_stats(session_hands, [accumulator], getStats.PlayerRegistry())))
+        benchmarks += [
+            ('run_stats (all stats)', len(session_hands),
+             lambda: getStats.run_stats(session_hands, getStats.default_accumulators(), getStats.PlayerRegistry())),
+            ('vectorized (all stats)', len(session_hands),
+             lambda: getStats.calculate_counters_vectorized(getStats.load_event_table(session_hands))),
+            ('iter_hands', len(session_hands), lambda: sum(1 for _ in getStats.iter_hands(json_filepath))),
+            ('validate_hand', len(session_hands),
+             lambda: [getStats.validate_hand(hand) for hand in session_hands]),
+            ('main()', len(session_hands), lambda: getStats.main(json_filepath, csv_filepath)),
+            (f'calculate_overall_stats (workers={workers})', total_hands,
+             lambda: getStats.calculate_overall_stats(csv_directory, json_directory, workers=workers)),
+        ]
+
+        results = []
+        for name, hands, function in benchmarks:
+            seconds, peak = measure(function, repeat)
+            results.append({'benchmark': name, 'hands': hands, 'seconds': round(seconds, 4),
+                            'hands_per_second': round(hands / seconds) if seconds else None,
+                            'peak_mib': round(peak / 2 ** 20, 2)})
+        return results
+    finally:
+        os.chdir(previous_directory)
+
+
+def print_results(results):
+    print(f"{'benchmark':<40} {'hands':>8} {'seconds':>9} {'hands/sec':>11} {'peak MiB':>9}")
+    for result in results:
+        print(f"{result['benchmark']:<40} {result['hands']:>8} {result['seconds']:>9.4f} "
+              f"{result['hands_per_second'] or 0:>11} {result['peak_mib']:>9.2f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time getStats on a synthetic pokernow archive')
+    parser.add_argument('--hands', type=int, default=2000, help='hands per session')
+    parser.add_argument('--sessions', type=int, default=4)
+    parser.add_argument('--players', type=int, default=12, help='size of the player pool')
+    parser.add_argument('--table-size', type=int, default=9, help='maximum players seated per hand')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=3, help='runs per benchmark, the fastest is reported')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', metavar='FILE', help='also write the results to FILE as JSON')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        generate_archive(directory, args.sessions, args.hands, args.players, args.table_size, args.seed)
+        results = run_benchmarks(directory, args.workers, args.repeat)
+
+    print_results(results)
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(results, file, indent=2)
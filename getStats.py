@@ -1,35 +1,88 @@
 import json
-import pandas as pd
 import os
+import sys
+import time
+import csv
+import hashlib
+import io
+import struct
+import sqlite3
+import cProfile
+import re
+import random
+import threading
+import tracemalloc
+import argparse
+import importlib
+from bisect import bisect_right
+from collections import deque, namedtuple
+from functools import partial
+from itertools import combinations
+from math import comb, sqrt
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timezone
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+
+class LazyModule:
+    # Stands in for a heavy module and imports it the first time one of its attributes is used,
+    # so commands that never build a DataFrame or an event table don't pay for loading it
+    def __init__(self, name):
+        self.name = name
+        self.module = None
+
+    def __getattr__(self, attribute):
+        if self.module is None:
+            self.module = importlib.import_module(self.name)
+        return getattr(self.module, attribute)
+
+
+np = LazyModule('numpy')
+pd = LazyModule('pandas')
 
 def calculate_pnl(csv_filepath):
-    # Read the CSV file
-    df = pd.read_csv(csv_filepath)
-
-    # Convert the player_nickname to lowercase
-    df['player_nickname'] = df['player_nickname'].str.lower()
-
-    # Convert the net for each player to the correct format
-    df['net'] = df['net'] / 100  # Divide by 100 to move the decimal point
-
-    # Group by player_nickname and sum the net
-    pnl = df.groupby('player_nickname')['net'].sum()
-
-    return pnl.to_dict()
-
-def calculate_bb_per_100_hands(pnl_stats, hands_played_stats, big_blind):
+    # Sum the net of each player in a ledger, streamed row by row with the csv module
+    with open(csv_filepath, 'r', newline='') as file:
+        return read_pnl(file)
+
+def read_pnl(file):
+    # calculate_pnl over a ledger already open, or its text in a StringIO
+    pnl = {}
+    for row in csv.DictReader(file):
+        # Convert the player_nickname to lowercase
+        player_name = row.get('player_nickname')
+        if not player_name:
+            continue
+        player_name = player_name.lower()
+
+        # Convert the net for each player to the correct format
+        net = row.get('net')
+        net = float(net) / 100 if net else 0.0  # Divide by 100 to move the decimal point
+        pnl[player_name] = pnl.get(player_name, 0.0) + net
+
+    # Same order as the grouped-by-nickname result this used to come from
+    return dict(sorted(pnl.items()))
+
+def calculate_pnl_batch(csv_filepaths):
+    # PnL of many ledgers in one call, keyed by ledger path
+    return {csv_filepath: calculate_pnl(csv_filepath) for csv_filepath in csv_filepaths}
+
+def calculate_bb_per_100_hands(pnl_bb_stats, hands_played_stats):
+    # pnl_bb_stats holds each player's PnL already in big blinds of the stakes it was won at
     bb_per_100_hands_stats = {}
 
-    for player_name in pnl_stats.keys():
-        pnl = pnl_stats[player_name]
-        hands_played = hands_played_stats.get(player_name, 1)  # Avoid division by zero
+    for player_name in pnl_bb_stats.keys():
+        pnl_bb = pnl_bb_stats[player_name]
+        hands_played = hands_played_stats.get(player_name) or 1  # Avoid division by zero
 
-        # Calculate the number of big blinds won
-        loss_per_hand = pnl / hands_played
+        # Calculate the number of big blinds won per hand
+        bb_per_hand = pnl_bb / hands_played
 
         # Calculate the number of big blinds won per 100 hands
-        bb_per_100_hands = (loss_per_hand * 100 ) * big_blind
-        
+        bb_per_100_hands = bb_per_hand * 100
+
 
         # Round to the nearest second decimal point
         bb_per_100_hands = round(bb_per_100_hands, 2)
@@ -39,437 +92,2488 @@ def calculate_bb_per_100_hands(pnl_stats, hands_played_stats, big_blind):
     return bb_per_100_hands_stats
 
 
-def calculate_vpip(data):
-    player_stats = {}
-
-    for hand in data['hands']:
-        flop_seen = False
-        vpip_players = set()  # Players who've voluntarily put money in pot in this hand
-        players_in_hand = set()  # Players who've played in this hand
-
-        # Create a mapping of seat numbers to player names for this hand
-        # Create a mapping of seat numbers to player names for this hand
-        seat_to_name = {player['seat']: player['name'].lower() for player in hand['players']}
-
-        for event in hand['events']:
-            payload = event['payload']
-            action_type = payload['type']
-            player_seat = payload.get('seat', None)
-            
-            # Mark the flop event
-            if 'turn' in payload and payload['turn'] == 1:  # Flop
-                flop_seen = True
-
-            # Initialize player stats if player_seat exists
-            if player_seat:
-                player_name = seat_to_name[player_seat]
-
-                if player_name not in player_stats:
-                    player_stats[player_name] = {
-                        'VPIP_count': 0, 'hands_played': 0
-                    }
-
-                # Track VPIP
-                if not flop_seen and action_type in [7, 8]:  # Raise or Call before flop
-                    vpip_players.add(player_name)
-
-                players_in_hand.add(player_name)
-
-        # Increment the VPIP for the players involved
-        for player in vpip_players:
-            player_stats[player]['VPIP_count'] += 1
+class HandLogReader:
+    # Incremental reader over a pokernow JSON export. Only the current chunk and the
+    # value being decoded are kept in memory, so hands can be streamed one at a time.
+    def __init__(self, file, chunk_size=1 << 16):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def read_more(self):
+        # Drop what has already been consumed before growing the buffer
+        if self.pos:
+            self.buffer = self.buffer[self.pos:]
+            self.pos = 0
+        chunk = self.file.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+        self.buffer += chunk
+
+    def peek(self):
+        # Return the next non-whitespace character without consuming it ('' at end of file)
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in ' \t\n\r':
+                self.pos += 1
+            if self.pos < len(self.buffer) or self.eof:
+                return self.buffer[self.pos:self.pos + 1]
+            self.read_more()
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"Expected {char!r} at offset {self.pos} of the hand log")
+        self.pos += 1
+
+    def decode(self):
+        # Decode one complete JSON value, reading more of the file until it fits in the buffer
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+                self.read_more()
+                continue
+            # A number or literal that ends exactly at the buffer edge may be cut short
+            if end == len(self.buffer) and not self.eof:
+                self.read_more()
+                continue
+            self.pos = end
+            return value
+
+    def iter_array(self):
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.decode()
+            if self.peek() == ',':
+                self.pos += 1
+            else:
+                self.expect(']')
+                return
+
+    def iter_key(self, key):
+        # Yield the items of the array stored under key in the top-level object
+        self.expect('{')
+        while self.peek() != '}':
+            name = self.decode()
+            self.expect(':')
+            if name == key:
+                yield from self.iter_array()
+                return
+            self.decode()  # Skip values we don't need, such as gameId
+            if self.peek() == ',':
+                self.pos += 1
+
+
+def iter_hands(json_filepath, validate=True):
+    # Yield the hands of a pokernow JSON export one at a time. Unless validate is off, hands that
+    # fail validate_hand, and the rest of a hand log that is cut short, are set aside in its
+    # Quarantine instead of raising halfway through a batch.
+    with open(json_filepath, 'r') as file:
+        hands = HandLogReader(file).iter_key('hands')
+        if not validate:
+            yield from hands
+            return
+        quarantine = Quarantine(json_filepath)
+        index = -1
+        try:
+            for index, hand in enumerate(hands):
+                problem = validate_hand(hand)
+                if problem is None:
+                    yield hand
+                else:
+                    quarantine.add(index, hand, problem)
+        except ValueError as error:  # Includes JSONDecodeError
+            quarantine.add(index + 1, None, f'hand log cut short: {error}')
+        quarantine.save()
+
+
+# Event payload type codes used by the pokernow hand log
+CHECK = 0
+BIG_BLIND = 2
+SMALL_BLIND = 3
+CALL = 7
+RAISE = 8
+BOARD = 9
+POT_WINNER = 10
+FOLD = 11
+WIN = 12  # Won at showdown, can carry the winner's cards
+SHOWDOWN = 15  # Reached showdown, can carry the cards the player showed
+
+# Payload type codes a hand log may hold; a code outside them means the export format changed.
+# The stats only read the named ones above, the others (straddles, returned bets, ...) pass through.
+EVENT_TYPES = frozenset(range(17))
+SEATED_EVENT_TYPES = frozenset((BIG_BLIND, SMALL_BLIND, CALL, RAISE, POT_WINNER, FOLD))  # Must name a seat
+VALUE_EVENT_TYPES = frozenset((BIG_BLIND, SMALL_BLIND, CALL, RAISE, POT_WINNER))  # Must carry a chip value
+QUARANTINE_EXTENSION = '.quarantine'
+
+
+def validate_cards(cards):
+    return isinstance(cards, list) and all(isinstance(card, str) and len(card) == 2 and card[0].upper() in CARD_RANKS
+                                           and card[1].lower() in CARD_SUITS for card in cards)
+
+
+def validate_hand(hand):
+    # Check that a hand has the structure the stats rely on: seated players with names, events
+    # with a known payload type, and every seat an event names taken by one of the players.
+    # Returns what is wrong with the hand, or None. Only a few dict lookups per event, as every
+    # hand streamed from a hand log goes through it.
+    if not isinstance(hand, dict):
+        return 'hand is not an object'
+    players = hand.get('players')
+    events = hand.get('events')
+    if not isinstance(players, list) or not isinstance(events, list):
+        return 'no players or events'
+    seats = set()
+    for player in players:
+        if not isinstance(player, dict) or not isinstance(player.get('name'), str):
+            return 'player without a name'
+        if type(player.get('seat')) is not int:
+            return f'player {player["name"]!r} has no seat'
+        if player['seat'] in seats:
+            return f'seat {player["seat"]} taken twice'
+        seats.add(player['seat'])
+    if type(hand.get('dealerSeat', 0)) is not int:
+        return f'dealer seat {hand["dealerSeat"]!r} is not a number'
+    if type(hand.get('bigBlind', 0)) not in (int, float):
+        return f'big blind {hand["bigBlind"]!r} is not a number'
+
+    for number, event in enumerate(events):
+        payload = event.get('payload') if isinstance(event, dict) else None
+        if not isinstance(payload, dict):
+            return f'event {number} has no payload'
+        action_type = payload.get('type')
+        # Checked to be numbers first, as a list or object can't be looked up in a set
+        if type(action_type) is not int or action_type not in EVENT_TYPES:
+            return f'event {number} has unknown type {action_type!r}'
+        seat = payload.get('seat')
+        if seat:
+            if type(seat) is not int or seat not in seats:
+                return f'event {number} is for seat {seat!r}, which nobody sits in'
+        elif action_type in SEATED_EVENT_TYPES:
+            return f'event {number} of type {action_type} has no seat'
+        if action_type in VALUE_EVENT_TYPES and type(payload.get('value')) not in (int, float):
+            return f'event {number} of type {action_type} has no chip value'
+        if 'turn' in payload and payload['turn'] not in (1, 2, 3):
+            return f'event {number} deals unknown street {payload["turn"]!r}'
+        if 'cards' in payload and not validate_cards(payload['cards']):
+            return f'event {number} has unreadable cards {payload["cards"]!r}'
+    return None
+
+
+class Quarantine:
+    # Hands of one hand log that failed validate_hand, or the point where the hand log was cut
+    # short, with the reason for each. Saved as JSON lines next to the hand log (see
+    # QUARANTINE_EXTENSION) so they can be looked at without stopping a batch run. The file is
+    # rewritten each time the hand log is read through, and removed once it reads cleanly.
+    def __init__(self, json_filepath):
+        self.json_filepath = json_filepath
+        self.filepath = os.path.splitext(json_filepath)[0] + QUARANTINE_EXTENSION
+        self.entries = []
+
+    def add(self, index, hand, reason):
+        hand_id = hand.get('id', hand.get('number')) if isinstance(hand, dict) else None
+        self.entries.append({'index': index, 'id': hand_id, 'reason': reason, 'hand': hand})
+
+    def save(self):
+        if not self.entries:
+            if os.path.exists(self.filepath):
+                os.remove(self.filepath)
+            return
+        print(f'Quarantined {len(self.entries)} hands of {self.json_filepath}, see {self.filepath}', file=sys.stderr)
+        tmp_filepath = self.filepath + '.tmp'
+        with open(tmp_filepath, 'w') as file:
+            for entry in self.entries:
+                file.write(json.dumps(entry) + '\n')
+        os.replace(tmp_filepath, self.filepath)
+
+
+def quarantine_report(json_directory):
+    # One row per quarantined hand across the hand logs in json_directory
+    rows = []
+    for entry in sorted(os.scandir(json_directory), key=lambda entry: entry.name):
+        if not entry.name.endswith(QUARANTINE_EXTENSION):
+            continue
+        with open(entry.path, 'r') as file:
+            for line in file:
+                quarantined = json.loads(line)
+                rows.append({'file': entry.name, 'index': quarantined['index'], 'id': quarantined['id'],
+                             'reason': quarantined['reason']})
+    return rows
+
+
+# Raw per-player counters. Sessions return these and they add up exactly across sessions;
+# percentages are only derived from them when results are displayed. pnl_bb is the PnL in
+# big blinds of each session's own stakes, so archives with mixed stakes add up too, and
+# pnl_bb_sq sums the square of each session's pnl_bb for the spread of BB/100.
+COUNTER_FIELDS = ('hands_played', 'vpip', 'pfr', 'agg', 'c_bet', 'c_bet_chance', 'three_bet', 'three_bet_chance',
+                  'four_bet', 'four_bet_chance', 'fold_to_3bet', 'faced_3bet', 'fold_to_c_bet', 'faced_c_bet',
+                  'saw_flop', 'saw_turn', 'saw_river', 'turn_agg', 'river_agg', 'showdown_count', 'showdown_wins',
+                  'pnl', 'pnl_bb', 'pnl_bb_sq')
+
+# How each reported column is derived from the counters: (column, numerator, denominator).
+# Rates are percentages of the denominator, a denominator of None reports the counter as is.
+STAT_COLUMNS = [
+    ('hands_played', 'hands_played', None),
+    ('VPIP', 'vpip', 'hands_played'),
+    ('PFR', 'pfr', 'hands_played'),
+    ('Agg', 'agg', 'hands_played'),
+    ('C_bet', 'c_bet', 'c_bet_chance'),
+    ('3bet', 'three_bet', 'three_bet_chance'),
+    ('4bet', 'four_bet', 'four_bet_chance'),
+    ('Fold_to_3bet', 'fold_to_3bet', 'faced_3bet'),
+    ('Fold_to_C_bet', 'fold_to_c_bet', 'faced_c_bet'),
+    ('Flop_seen', 'saw_flop', 'hands_played'),
+    ('Turn_seen', 'saw_turn', 'hands_played'),
+    ('River_seen', 'saw_river', 'hands_played'),
+    ('Turn_Agg', 'turn_agg', 'saw_turn'),
+    ('River_Agg', 'river_agg', 'saw_river'),
+    ('PnL', 'pnl', None),
+    ('showdown_count', 'showdown_count', None),
+    ('Showdown Wins', 'showdown_wins', 'showdown_count'),
+]
+STAT_COLUMN_FIELDS = {column: (numerator, denominator) for column, numerator, denominator in STAT_COLUMNS}
+
+
+class PlayerCounters:
+    __slots__ = COUNTER_FIELDS
+
+    def __init__(self, values=None):
+        if values is None:
+            values = [0] * len(COUNTER_FIELDS)
+        for field, value in zip(COUNTER_FIELDS, values):
+            setattr(self, field, value)
+
+    def __iadd__(self, other):
+        for field in COUNTER_FIELDS:
+            setattr(self, field, getattr(self, field) + getattr(other, field))
+        return self
+
+    def __isub__(self, other):
+        for field in COUNTER_FIELDS:
+            setattr(self, field, getattr(self, field) - getattr(other, field))
+        return self
+
+    def __eq__(self, other):
+        return isinstance(other, PlayerCounters) and self.as_list() == other.as_list()
+
+    def __repr__(self):
+        return f'PlayerCounters({self.as_list()})'
+
+    def as_list(self):
+        return [getattr(self, field) for field in COUNTER_FIELDS]
+
+    def stat(self, column):
+        numerator, denominator = STAT_COLUMN_FIELDS[column]
+        value = getattr(self, numerator)
+        if denominator is None:
+            return value
+        total = getattr(self, denominator)
+        if total == 0:  # Avoid division by zero
+            return 0.0
+        return round(value / total * 100, 2)
+
+
+def load_aliases(filepath):
+    # Read an alias file mapping each player to the other names they play under,
+    # e.g. {"levels": ["norm"]}, into a lowercased alias -> player lookup
+    if not filepath or not os.path.exists(filepath):
+        return {}
+    with open(filepath, 'r') as file:
+        players = json.load(file)
+    return {alias.lower(): player_name.lower() for player_name, aliases in players.items() for alias in aliases}
+
+
+# Table positions, counted from the button. A hand's position table maps each seat to an index
+# into POSITIONS; the labels used for a table of n players are SEAT_POSITIONS[n], button first.
+POSITIONS = ('BTN', 'SB', 'BB', 'UTG', 'UTG+1', 'UTG+2', 'MP', 'MP+1', 'HJ', 'CO', 'unknown')
+N_POSITIONS = len(POSITIONS)
+UNKNOWN_POSITION = POSITIONS.index('unknown')
+SEAT_POSITIONS = {n: tuple(POSITIONS.index(label) for label in labels) for n, labels in {
+    2: ('BTN', 'BB'),  # Heads up the button posts the small blind
+    3: ('BTN', 'SB', 'BB'),
+    4: ('BTN', 'SB', 'BB', 'CO'),
+    5: ('BTN', 'SB', 'BB', 'UTG', 'CO'),
+    6: ('BTN', 'SB', 'BB', 'UTG', 'HJ', 'CO'),
+    7: ('BTN', 'SB', 'BB', 'UTG', 'MP', 'HJ', 'CO'),
+    8: ('BTN', 'SB', 'BB', 'UTG', 'UTG+1', 'MP', 'HJ', 'CO'),
+    9: ('BTN', 'SB', 'BB', 'UTG', 'UTG+1', 'MP', 'MP+1', 'HJ', 'CO'),
+    10: ('BTN', 'SB', 'BB', 'UTG', 'UTG+1', 'UTG+2', 'MP', 'MP+1', 'HJ', 'CO'),
+}.items()}
+
+
+def hand_positions(hand):
+    # Seat -> position index for the players of a hand, from its dealerSeat. If the button seat
+    # is empty the closest occupied seat before it plays as the button. Empty if unknown.
+    seats = sorted(player['seat'] for player in hand['players'])
+    dealer_seat = hand.get('dealerSeat')
+    labels = SEAT_POSITIONS.get(len(seats))
+    if dealer_seat is None or labels is None:
+        return {}
+    button = bisect_right(seats, dealer_seat) - 1
+    return dict(zip(seats[button:] + seats[:button], labels))
+
+
+def positional_key(player_id, position):
+    # Counters broken down by position are keyed by one int per (player, position) pair
+    return player_id * N_POSITIONS + position
+
+
+class PlayerRegistry:
+    # Interns player names to small integer ids, so the hot loops work on ints and each name
+    # is lowercased and resolved through the alias map only the first time it is seen
+    def __init__(self, aliases=None):
+        self.aliases = aliases or {}
+        self.names = []  # Player id -> player name
+        self.ids = {}  # Player name -> player id
+        self.raw_ids = {}  # Name as written in the hand log or ledger -> player id
+
+    def intern(self, raw_name):
+        player_id = self.raw_ids.get(raw_name)
+        if player_id is None:
+            player_name = raw_name.lower()
+            player_name = self.aliases.get(player_name, player_name)
+            player_id = self.ids.get(player_name)
+            if player_id is None:
+                player_id = self.ids[player_name] = len(self.names)
+                self.names.append(player_name)
+            self.raw_ids[raw_name] = player_id
+        return player_id
+
+    def named(self, player_counters):
+        # Re-key counters from player ids to player names
+        return {self.names[player_id]: counters for player_id, counters in player_counters.items()}
+
+    def named_positions(self, player_counters):
+        # Re-key counters from positional keys (see positional_key) to (player name, position) pairs
+        return {(self.names[key // N_POSITIONS], POSITIONS[key % N_POSITIONS]): counters
+                for key, counters in player_counters.items()}
+
+
+class HandState:
+    # Per-hand state shared by every stat accumulator during the single event walk. run_stats
+    # moves it along as events come in, and accumulators see it as it was before each event:
+    # street is 0 pre-flop, then 1/2/3 once the flop/turn/river has been dealt; raise_level
+    # counts the bets on the current street, pre-flop starting at 1 for the big blind so an
+    # open raise takes it to 2 and a 3-bet to 3; aggressor made the last of them.
+    __slots__ = ('hand', 'seat_to_player', 'player_counters', 'street', 'raise_level', 'aggressor',
+                 'pre_flop_aggressor', 'players_in_hand', 'players_folded', 'live_players')
+
+    def __init__(self, hand, seat_to_player, player_counters):
+        self.hand = hand
+        self.seat_to_player = seat_to_player
+        self.player_counters = player_counters  # Session counters, keyed by player id
+        self.street = 0
+        self.raise_level = 1
+        self.aggressor = None
+        self.pre_flop_aggressor = None  # Last player to raise before the flop
+        self.players_in_hand = set()  # Players who've acted in this hand so far
+        self.players_folded = set()
+        self.live_players = set()  # Players who've acted and haven't folded
+
+    @property
+    def flop_seen(self):
+        return self.street >= 1
+
+    def next_street(self, street):
+        self.street = street
+        self.raise_level = 0
+        self.aggressor = None
+
+    def apply(self, player_id, action_type):
+        # Move past a seated event once the accumulators have seen it
+        self.players_in_hand.add(player_id)
+        if action_type == FOLD:
+            self.players_folded.add(player_id)
+            self.live_players.discard(player_id)
+        elif player_id not in self.players_folded:
+            self.live_players.add(player_id)
+        if action_type == RAISE:
+            self.raise_level += 1
+            self.aggressor = player_id
+            if self.street == 0:
+                self.pre_flop_aggressor = player_id
+
+
+class StatAccumulator:
+    # Base class for a stat fed by run_stats. Subclasses list the payload types they
+    # care about in action_types and only get on_event calls for those events, and get
+    # on_street calls whenever a new street is dealt. They count into the PlayerCounters
+    # in state.player_counters and report the STAT_COLUMNS named in columns.
+    action_types = ()
+    columns = ()
+
+    def start_hand(self, state):
+        pass
+
+    def on_street(self, state):
+        pass
+
+    def on_event(self, player_id, action_type, payload, state):
+        pass
+
+    def end_hand(self, state):
+        pass
+
+    def results(self, player_counters):
+        player_stats = {}
+        for player_name, counters in player_counters.items():
+            stats = player_stats[player_name] = {'hands_played': counters.hands_played}
+            for column in self.columns:
+                stats[column] = counters.stat(column)
+        return player_stats
+
+
+class VPIPStat(StatAccumulator):
+    action_types = (CALL, RAISE)
+    columns = ('VPIP',)
+
+    def start_hand(self, state):
+        self.vpip_players = set()  # Players who've voluntarily put money in pot in this hand
+
+    def on_event(self, player_id, action_type, payload, state):
+        if state.street == 0:  # Raise or Call before flop
+            self.vpip_players.add(player_id)
+
+    def end_hand(self, state):
+        for player in self.vpip_players:
+            state.player_counters[player].vpip += 1
+
+
+class PFRStat(StatAccumulator):
+    action_types = (RAISE,)
+    columns = ('PFR',)
+
+    def start_hand(self, state):
+        self.pfr_players = set()  # Players who've raised before the flop in this hand
+
+    def on_event(self, player_id, action_type, payload, state):
+        if state.street == 0:
+            self.pfr_players.add(player_id)
+
+    def end_hand(self, state):
+        for player in self.pfr_players:
+            state.player_counters[player].pfr += 1
+
+
+class AggStat(StatAccumulator):
+    # Bets and raises only, like Turn_Agg and River_Agg; calling isn't aggression
+    action_types = (RAISE,)
+    columns = ('Agg',)
+
+    def start_hand(self, state):
+        self.agg_players = set()  # Players who've bet or raised after the flop in this hand
+
+    def on_event(self, player_id, action_type, payload, state):
+        if state.street >= 1:
+            self.agg_players.add(player_id)
+
+    def end_hand(self, state):
+        for player in self.agg_players:
+            state.player_counters[player].agg += 1
+
+
+class CBetStat(StatAccumulator):
+    # The pre-flop aggressor makes the first bet on the flop, out of the hands where they saw the flop
+    action_types = (RAISE,)
+    columns = ('C_bet',)
+
+    def on_street(self, state):
+        if state.street == 1 and state.pre_flop_aggressor in state.live_players:
+            state.player_counters[state.pre_flop_aggressor].c_bet_chance += 1
+
+    def on_event(self, player_id, action_type, payload, state):
+        if state.street == 1 and state.raise_level == 0 and player_id == state.pre_flop_aggressor:
+            state.player_counters[player_id].c_bet += 1
+
+
+class StreetStat(StatAccumulator):
+    # How often each player is still in the hand when the flop, turn and river are dealt,
+    # and how often they bet or raise on the turn and river once there
+    action_types = (RAISE,)
+    columns = ('Flop_seen', 'Turn_seen', 'River_seen', 'Turn_Agg', 'River_Agg')
+    seen_fields = {1: 'saw_flop', 2: 'saw_turn', 3: 'saw_river'}
+    agg_fields = {2: 'turn_agg', 3: 'river_agg'}
+
+    def start_hand(self, state):
+        self.agg_players = {street: set() for street in self.agg_fields}
+
+    def on_street(self, state):
+        field = self.seen_fields.get(state.street)
+        if field:
+            for player in state.live_players:
+                counters = state.player_counters[player]
+                setattr(counters, field, getattr(counters, field) + 1)
+
+    def on_event(self, player_id, action_type, payload, state):
+        if state.street in self.agg_players:
+            self.agg_players[state.street].add(player_id)
+
+    def end_hand(self, state):
+        for street, players in self.agg_players.items():
+            field = self.agg_fields[street]
+            for player in players:
+                counters = state.player_counters[player]
+                setattr(counters, field, getattr(counters, field) + 1)
+
+
+class ShowdownStat(StatAccumulator):
+    action_types = (WIN, SHOWDOWN)
+    columns = ('showdown_count', 'Showdown Wins')
 
-        # Increment the hands played for the players involved
-        for player in players_in_hand:
-            player_stats[player]['hands_played'] += 1
-    
-    # Calculating final VPIP percentage
-   # Calculating final VPIP percentage
-    for player_name, stats in player_stats.items():
-        stats['VPIP'] = round(stats['VPIP_count'] / stats['hands_played'] * 100, 2)
-        del stats['VPIP_count']  # Remove the count after calculating the percentage
+    def on_event(self, player_id, action_type, payload, state):
+        if action_type == SHOWDOWN:
+            if state.street >= 1 and len(state.live_players) > 1:
+                state.player_counters[player_id].showdown_count += 1
+        else:  # Win
+            state.player_counters[player_id].showdown_wins += 1
 
-    return player_stats
 
-def calculate_pfr(data):
-    player_stats = {}
+class FoldToThreeBetStat(StatAccumulator):
+    # The open raiser folds to a 3-bet, out of the hands where they had to act on one
+    action_types = (CALL, RAISE, FOLD)
+    columns = ('Fold_to_3bet',)
+
+    def start_hand(self, state):
+        self.open_raiser = None
+        self.faced = False
+        self.folded = False
 
-    for hand in data['hands']:
-        flop_seen = False
-        pfr_players = set()  # Players who've raised before the flop in this hand
-        players_in_hand = set()  # Players who've played in this hand
+    def on_event(self, player_id, action_type, payload, state):
+        if state.street != 0:
+            return
+
+        if action_type == RAISE and state.raise_level == 1:  # First raise before flop
+            self.open_raiser = player_id
+        elif player_id == self.open_raiser and state.raise_level == 3:  # Facing a 3-bet
+            self.faced = True
+            if action_type == FOLD:
+                self.folded = True
+
+    def end_hand(self, state):
+        if self.faced:
+            counters = state.player_counters[self.open_raiser]
+            counters.faced_3bet += 1
+            if self.folded:
+                counters.fold_to_3bet += 1
+
+
+class FoldToCBetStat(StatAccumulator):
+    # Players who fold to a c-bet, out of the hands where they had to act on one before any raise
+    action_types = (CALL, RAISE, FOLD)
+    columns = ('Fold_to_C_bet',)
+
+    def start_hand(self, state):
+        self.c_bettor = None
+        self.faced_players = set()
+        self.folded_players = set()
+
+    def on_event(self, player_id, action_type, payload, state):
+        if state.street != 1:
+            return
+
+        if action_type == RAISE and state.raise_level == 0 and player_id == state.pre_flop_aggressor:
+            self.c_bettor = player_id
+        elif self.c_bettor is not None and state.raise_level == 1 and player_id != self.c_bettor:
+            self.faced_players.add(player_id)
+            if action_type == FOLD:  # Fold after C-bet
+                self.folded_players.add(player_id)
+
+    def end_hand(self, state):
+        for player in self.faced_players:
+            state.player_counters[player].faced_c_bet += 1
+        for player in self.folded_players:
+            state.player_counters[player].fold_to_c_bet += 1
+
+
+class RaiseLevelStat(StatAccumulator):
+    # Counts the pre-flop raises taking the raise level to raise_level into field, out of the
+    # hands where the player had to act at the level below (chance_field)
+    action_types = (CALL, RAISE, FOLD)
+    field = None
+    chance_field = None
+    raise_level = None
+
+    def start_hand(self, state):
+        self.chance_players = set()
+
+    def on_event(self, player_id, action_type, payload, state):
+        if state.street != 0 or state.raise_level != self.raise_level - 1 or player_id == state.aggressor:
+            return
+
+        self.chance_players.add(player_id)
+        if action_type == RAISE:
+            counters = state.player_counters[player_id]
+            setattr(counters, self.field, getattr(counters, self.field) + 1)
+
+    def end_hand(self, state):
+        for player in self.chance_players:
+            counters = state.player_counters[player]
+            setattr(counters, self.chance_field, getattr(counters, self.chance_field) + 1)
+
+
+class ThreeBetStat(RaiseLevelStat):
+    columns = ('3bet',)
+    field = 'three_bet'
+    chance_field = 'three_bet_chance'
+    raise_level = 3  # Re-raising an open raise
+
+
+class FourBetStat(RaiseLevelStat):
+    columns = ('4bet',)
+    field = 'four_bet'
+    chance_field = 'four_bet_chance'
+    raise_level = 4  # Re-raising a 3-bet
+
+
+# Head-to-head counters of a player against one opponent: the hands they both played, the chips
+# the player took off the opponent (negative when the opponent came out ahead), in the ledger's
+# PnL units and in big blinds, and the player's 3-bets over the opponent's open raises out of
+# the hands where the player faced one
+PAIR_FIELDS = ('hands_together', 'won', 'won_bb', 'three_bet', 'three_bet_chance')
+
+
+class OpponentMatrix:
+    # Sparse player x opponent matrix of PAIR_FIELDS counters, as a dict of dicts holding only
+    # the pairs that have played a hand together. Adds up across sessions like PlayerCounters.
+    def __init__(self, pairs=None):
+        self.pairs = pairs if pairs is not None else {}  # Player -> opponent -> counter values
+
+    def add(self, player, opponent, field, amount):
+        opponents = self.pairs.get(player)
+        if opponents is None:
+            opponents = self.pairs[player] = {}
+        values = opponents.get(opponent)
+        if values is None:
+            values = opponents[opponent] = [0] * len(PAIR_FIELDS)
+        values[field] += amount
+
+    def __iadd__(self, other):
+        for player, opponents in other.pairs.items():
+            for opponent, values in opponents.items():
+                for field, value in enumerate(values):
+                    self.add(player, opponent, field, value)
+        return self
+
+    def __eq__(self, other):
+        return isinstance(other, OpponentMatrix) and self.pairs == other.pairs
+
+    def __len__(self):
+        return sum(len(opponents) for opponents in self.pairs.values())
+
+    def named(self, registry):
+        # Re-key from player ids to player names
+        return OpponentMatrix({registry.names[player]: {registry.names[opponent]: values
+                                                        for opponent, values in opponents.items()}
+                               for player, opponents in self.pairs.items()})
+
+    def opponents(self, player):
+        return self.pairs.get(player, {})
+
+    def as_list(self):
+        return [[player, opponent, values] for player, opponents in self.pairs.items()
+                for opponent, values in opponents.items()]
+
+    @classmethod
+    def from_list(cls, entries):
+        matrix = cls()
+        for player, opponent, values in entries:
+            matrix.pairs.setdefault(player, {})[opponent] = list(values)
+        return matrix
+
+
+class OpponentMatrixStat(StatAccumulator):
+    # Fills an OpponentMatrix during the run_stats walk. What each loser put in past what they got
+    # back goes to the hand's winners in proportion to what they came out ahead, and bets nobody
+    # matched are returned first (see matched_contributions). Counts by player id, so run_stats
+    # has to be called without positional.
+    action_types = (SMALL_BLIND, BIG_BLIND, CALL, RAISE, FOLD, POT_WINNER)
+
+    def __init__(self, matrix):
+        self.matrix = matrix
+
+    def start_hand(self, state):
+        self.street_bets = {}
+        self.contributions = {}
+        self.won = {}
+        self.three_bet_chances = set()
+
+    def on_street(self, state):
+        for player, amount in self.street_bets.items():
+            self.contributions[player] = self.contributions.get(player, 0) + amount
+        self.street_bets = {}
+
+    def on_event(self, player_id, action_type, payload, state):
+        if action_type == POT_WINNER:
+            self.won[player_id] = self.won.get(player_id, 0) + payload['value']
+            return
+        if action_type != FOLD:
+            # Bets and blinds carry the player's total for the street
+            self.street_bets[player_id] = max(self.street_bets.get(player_id, 0), payload['value'])
+        # Same chances as ThreeBetStat, against the open raiser
+        if state.street == 0 and state.raise_level == 2 and state.aggressor not in (None, player_id):
+            self.three_bet_chances.add((player_id, state.aggressor))
+            if action_type == RAISE:
+                self.matrix.add(player_id, state.aggressor, 3, 1)
+
+    def end_hand(self, state):
+        matrix = self.matrix
+        for player, opponent in self.three_bet_chances:
+            matrix.add(player, opponent, 4, 1)
+        for player in state.players_in_hand:
+            for opponent in state.players_in_hand:
+                if opponent != player:
+                    matrix.add(player, opponent, 0, 1)
+
+        self.on_street(state)
+        contributions = matched_contributions(self.contributions)
+        net = {player: self.won.get(player, 0) - contributions.get(player, 0)
+               for player in set(contributions) | set(self.won)}
+        total_won = sum(amount for amount in net.values() if amount > 0)
+        if not total_won:
+            return
+        big_blind = state.hand.get('bigBlind')
+        for loser, lost in net.items():
+            if lost >= 0:
+                continue
+            for winner, amount in net.items():
+                if amount <= 0:
+                    continue
+                chips = -lost * amount / total_won
+                # Same scale as calculate_pnl, which divides the ledger by 100
+                matrix.add(winner, loser, 1, chips / 100)
+                matrix.add(loser, winner, 1, -chips / 100)
+                if big_blind:
+                    matrix.add(winner, loser, 2, chips / big_blind)
+                    matrix.add(loser, winner, 2, -chips / big_blind)
+
+
+def run_stats(hands, accumulators, registry, player_counters=None, positional=False):
+    # Walk every hand and event once, dispatching each seated event to the accumulators
+    # that listen for its payload type. Returns the PlayerCounters of every player seen,
+    # keyed by their id in registry, or by positional_key when positional is set so every
+    # stat is split by the position the player had in each hand.
+    handlers = {}
+    for accumulator in accumulators:
+        for action_type in accumulator.action_types:
+            handlers.setdefault(action_type, []).append(accumulator.on_event)
+    street_handlers = [accumulator.on_street for accumulator in accumulators
+                       if type(accumulator).on_street is not StatAccumulator.on_street]
+
+    if player_counters is None:
+        player_counters = {}
+    intern = registry.intern
+
+    for hand in hands:
+        # Create a mapping of seat numbers to player ids for this hand
+        if positional:
+            positions = hand_positions(hand)
+            seat_to_player = {player['seat']: positional_key(intern(player['name']),
+                                                             positions.get(player['seat'], UNKNOWN_POSITION))
+                              for player in hand['players']}
+        else:
+            seat_to_player = {player['seat']: intern(player['name']) for player in hand['players']}
+        state = HandState(hand, seat_to_player, player_counters)
 
-        # Create a mapping of seat numbers to player names for this hand
-        seat_to_name = {player['seat']: player['name'].lower() for player in hand['players']}
+        for accumulator in accumulators:
+            accumulator.start_hand(state)
 
         for event in hand['events']:
             payload = event['payload']
-            action_type = payload['type']
-            player_seat = payload.get('seat', None)
-            
-            # Mark the flop event
-            if 'turn' in payload and payload['turn'] == 1:  # Flop
-                flop_seen = True
-
-            # Initialize player stats if player_seat exists
-            if player_seat:
-                player_name = seat_to_name[player_seat]
-
-                if player_name not in player_stats:
-                    player_stats[player_name] = {
-                        'PFR_count': 0, 'hands_played': 0
-                    }
-
-                # Track PFR
-                if not flop_seen and action_type == 8:  # Raise before flop
-                    pfr_players.add(player_name)
-
-                players_in_hand.add(player_name)
-
-        # Increment the PFR for the players involved
-        for player in pfr_players:
-            player_stats[player]['PFR_count'] += 1
 
-        # Increment the hands played for the players involved
-        for player in players_in_hand:
-            player_stats[player]['hands_played'] += 1
-    
-    # Calculating final PFR percentage
-    for player_name, stats in player_stats.items():
-        stats['PFR'] = round(stats['PFR_count'] / stats['hands_played'] * 100, 2)
-        del stats['PFR_count']  # Remove the count after calculating the percentage
-
-    return player_stats
-
-def calculate_agg(data):
-    player_stats = {}
-
-    for hand in data['hands']:
-        flop_seen = False
-        agg_players = set()  # Players who've bet or raised after the flop in this hand
-        players_in_hand = set()  # Players who've played in this hand
+            # Board cards start the next street
+            if 'turn' in payload and payload['turn'] > state.street:
+                state.next_street(payload['turn'])
+                for handler in street_handlers:
+                    handler(state)
 
-        # Create a mapping of seat numbers to player names for this hand
-        seat_to_name = {player['seat']: player['name'].lower() for player in hand['players']}
-
-        for event in hand['events']:
-            payload = event['payload']
-            action_type = payload['type']
             player_seat = payload.get('seat', None)
-            
-            # Mark the flop event
-            if 'turn' in payload and payload['turn'] == 1:  # Flop
-                flop_seen = True
-
-            # Initialize player stats if player_seat exists
             if player_seat:
-                player_name = seat_to_name[player_seat]
+                player_id = seat_to_player[player_seat]
 
-                if player_name not in player_stats:
-                    player_stats[player_name] = {
-                        'Agg_count': 0, 'hands_played': 0
-                    }
+                if player_id not in player_counters:
+                    player_counters[player_id] = PlayerCounters()
 
-                # Track Agg
-                if flop_seen and action_type in [7, 8]:  # Bet or Raise after flop
-                    agg_players.add(player_name)
+                action_type = payload['type']
+                for handler in handlers.get(action_type, ()):
+                    handler(player_id, action_type, payload, state)
 
-                players_in_hand.add(player_name)
+                state.apply(player_id, action_type)
 
-        # Increment the Agg for the players involved
-        for player in agg_players:
-            player_stats[player]['Agg_count'] += 1
+        for accumulator in accumulators:
+            accumulator.end_hand(state)
 
         # Increment the hands played for the players involved
-        for player in players_in_hand:
-            player_stats[player]['hands_played'] += 1
-    
-    # Calculating final Agg percentage
-    for player_name, stats in player_stats.items():
-        stats['Agg'] = round(stats['Agg_count'] / stats['hands_played'] * 100, 2)
-        del stats['Agg_count']  # Remove the count after calculating the percentage
-
-    return player_stats
-
-def calculate_c_bet(data):
-    player_stats = {}
-
-    for hand in data['hands']:
-        flop_seen = False
-        pre_flop_raiser = None
-        c_bet_made = False  # Flag to track if a C-bet has been made in this hand
-        players_in_hand = set()  # Players who've played in this hand
-
-        # Create a mapping of seat numbers to player names for this hand
-        seat_to_name = {player['seat']: player['name'].lower() for player in hand['players']}
-
-        for event in hand['events']:
+        for player in state.players_in_hand:
+            player_counters[player].hands_played += 1
+
+    return player_counters
+
+
+def default_accumulators():
+    return [VPIPStat(), PFRStat(), AggStat(), CBetStat(), ThreeBetStat(), FourBetStat(),
+            FoldToThreeBetStat(), FoldToCBetStat(), StreetStat(), ShowdownStat()]
+
+
+def calculate_stat(data, accumulator):
+    registry = PlayerRegistry()
+    return accumulator.results(registry.named(run_stats(data['hands'], [accumulator], registry)))
+
+
+class EventTable:
+    # Columnar view of a session: one row per event, stored as typed NumPy arrays.
+    # Events without a seat (board cards, end of hand) have seat 0 and player -1.
+    # street is 0 pre-flop, then 1/2/3 once the flop/turn/river has been dealt. position is
+    # the index in POSITIONS of the seat in that hand, UNKNOWN_POSITION for unseated events.
+    __slots__ = ('hand', 'event', 'seat', 'player', 'action', 'street', 'position', 'amount', 'player_names',
+                 'hand_ids')
+
+    def __init__(self, hand, event, seat, player, action, street, position, amount, player_names, hand_ids):
+        self.hand = hand
+        self.event = event
+        self.seat = seat
+        self.player = player
+        self.action = action
+        self.street = street
+        self.position = position
+        self.amount = amount
+        self.player_names = player_names  # Player id -> player name, see PlayerRegistry
+        self.hand_ids = hand_ids  # Hand index -> pokernow hand id
+
+    def __len__(self):
+        return len(self.hand)
+
+    def to_dataframe(self):
+        # Event table as a DataFrame with player names resolved, for ad-hoc queries
+        names = np.array(self.player_names + [None], dtype=object)
+        return pd.DataFrame({
+            'hand_id': np.array(self.hand_ids, dtype=object)[self.hand], 'event': self.event, 'seat': self.seat,
+            'player': names[self.player], 'action': self.action, 'street': self.street,
+            'position': np.array(POSITIONS, dtype=object)[self.position], 'amount': self.amount,
+        })
+
+
+def load_event_table(hands, registry=None):
+    # Flatten hands, e.g. from iter_hands, into an EventTable whose player ids come from registry
+    if registry is None:
+        registry = PlayerRegistry()
+    hand_column, event_column, seat_column, player_column = [], [], [], []
+    action_column, street_column, position_column, amount_column = [], [], [], []
+    hand_ids = []
+
+    for hand_index, hand in enumerate(hands):
+        hand_ids.append(hand.get('id'))
+        seat_to_player = {player['seat']: registry.intern(player['name']) for player in hand['players']}
+        positions = hand_positions(hand)
+
+        street = 0
+        for event_index, event in enumerate(hand['events']):
             payload = event['payload']
-            action_type = payload['type']
-            player_seat = payload.get('seat', None)
-
-            # Mark the flop event
-            if 'turn' in payload and payload['turn'] == 1:  # Flop
-                flop_seen = True
-
-            # Initialize player stats if player_seat exists
-            if player_seat:
-                player_name = seat_to_name[player_seat]
+            if 'turn' in payload and payload['turn'] > street:
+                street = payload['turn']
+            seat = payload.get('seat', None) or 0
+
+            hand_column.append(hand_index)
+            event_column.append(event_index)
+            seat_column.append(seat)
+            player_column.append(seat_to_player[seat] if seat else -1)
+            action_column.append(payload['type'])
+            street_column.append(street)
+            position_column.append(positions.get(seat, UNKNOWN_POSITION))
+            amount_column.append(payload.get('value', 0) or 0)
+
+    return EventTable(
+        np.array(hand_column, dtype=np.int32), np.array(event_column, dtype=np.int32),
+        np.array(seat_column, dtype=np.int16), np.array(player_column, dtype=np.int32),
+        np.array(action_column, dtype=np.int16), np.array(street_column, dtype=np.int8),
+        np.array(position_column, dtype=np.int8), np.array(amount_column, dtype=np.float64), registry.names, hand_ids,
+    )
+
+
+def group_bounds(keys):
+    # Row index of the first and last row of each run of equal keys in a sorted array
+    if not len(keys):
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    ends = np.r_[starts[1:], len(keys)] - 1
+    return starts, ends
+
+
+def per_hand_first(table, rows, n_hands):
+    # Per hand, the first of the given (sorted) rows, or -1 when the hand has none
+    first_rows = np.full(n_hands, -1, dtype=np.int64)
+    starts, _ = group_bounds(table.hand[rows])
+    first_rows[table.hand[rows[starts]]] = rows[starts]
+    return first_rows
+
+
+def calculate_counters_vectorized(table, positional=False):
+    # Same PlayerCounters, keyed by player id (or positional_key), as run_stats with default_accumulators,
+    # computed with grouped array operations over an EventTable instead of a per-event Python loop
+    n_players = len(table.player_names)
+    n_hands = len(table.hand_ids)
+    hand, player, action, street, row = table.hand, table.player, table.action, table.street, np.arange(len(table))
+    if positional:
+        player = np.where(player >= 0, player * N_POSITIONS + table.position, -1)
+        n_players *= N_POSITIONS
+    seated = player >= 0
+    pre_flop = seated & (street == 0)
+    flop = seated & (street == 1)
+    post_flop = seated & (street >= 1)
+    calls = action == CALL
+    raises = action == RAISE
+    folds = action == FOLD
+    acts = calls | raises | folds
+    hand_start = np.searchsorted(hand, hand)
+
+    def count(rows):
+        return np.bincount(player[rows], minlength=n_players)
+
+    def count_hands(mask):
+        # Number of distinct hands in which each player has a row matching mask
+        keys = np.unique(hand[mask].astype(np.int64) * n_players + player[mask])
+        return np.bincount(keys % n_players, minlength=n_players)
+
+    def count_before(mask):
+        # Number of rows matching mask earlier in the same hand
+        seen = np.r_[0, np.cumsum(mask)]
+        return seen[row] - seen[hand_start]
+
+    counters = {
+        'hands_played': count_hands(seated),
+        'vpip': count_hands(pre_flop & (calls | raises)),
+        'pfr': count_hands(pre_flop & raises),
+        'agg': count_hands(post_flop & raises),
+        'turn_agg': count_hands(seated & (street == 2) & raises),
+        'river_agg': count_hands(seated & (street == 3) & raises),
+        'showdown_wins': count(seated & (action == WIN)),
+    }
+
+    # Pre-flop raise level and aggressor as each row is played, the big blind counting as the first bet
+    pre_flop_raises = pre_flop & raises
+    raise_rows = np.flatnonzero(pre_flop_raises)
+    raises_before = count_before(pre_flop_raises)
+    raise_level = 1 + raises_before
+    last_raise = np.where(raises_before > 0, np.r_[0, np.cumsum(pre_flop_raises)][row] - 1, -1)
+    aggressor = np.r_[player[raise_rows], -1][last_raise]
+
+    # 3-bets and 4-bets: re-raising at level 2 and 3, out of the hands the player acted at that level
+    for field, chance_field, level in (('three_bet', 'three_bet_chance', 2), ('four_bet', 'four_bet_chance', 3)):
+        chance = pre_flop & acts & (raise_level == level) & (player != aggressor)
+        counters[chance_field] = count_hands(chance)
+        counters[field] = count(chance & raises)
+
+    # The open raiser and the last pre-flop raiser of each hand
+    starts, ends = group_bounds(hand[raise_rows])
+    open_raiser = np.full(n_hands, -1, dtype=np.int64)
+    open_raiser[hand[raise_rows[starts]]] = player[raise_rows[starts]]
+    last_raiser = np.full(n_hands, -1, dtype=np.int64)
+    last_raiser[hand[raise_rows[ends]]] = player[raise_rows[ends]]
+
+    # Fold to 3-bet: the open raiser acting, and folding, facing a 3-bet
+    faced_3bet = pre_flop & acts & (player == open_raiser[hand]) & (raise_level == 3)
+    counters['faced_3bet'] = count_hands(faced_3bet)
+    counters['fold_to_3bet'] = count_hands(faced_3bet & folds)
+
+    # C-bet: the first bet on the flop, made by the last pre-flop raiser
+    flop_level = count_before(flop & raises)
+    c_bet_rows = np.flatnonzero(flop & raises & (flop_level == 0) & (player == last_raiser[hand]))
+    counters['c_bet'] = count(c_bet_rows)
+    c_bettor = np.full(n_hands, -1, dtype=np.int64)
+    c_bettor[hand[c_bet_rows]] = player[c_bet_rows]
+    faced_c_bet = flop & acts & (c_bettor[hand] >= 0) & (flop_level == 1) & (player != c_bettor[hand])
+    counters['faced_c_bet'] = count_hands(faced_c_bet)
+    counters['fold_to_c_bet'] = count_hands(faced_c_bet & folds)
+
+    # Players still in the hand as each street is dealt: seen earlier in the hand and not folded yet
+    keys = hand.astype(np.int64) * n_players + player
+    seated_rows = np.flatnonzero(seated)
+    pair_keys, first_rows = np.unique(keys[seated_rows], return_index=True)
+    first_seen = seated_rows[first_rows]
+    fold_rows = np.flatnonzero(seated & folds)
+    fold_keys, first_fold_rows = np.unique(keys[fold_rows], return_index=True)
+    first_fold = np.full(len(pair_keys), len(table), dtype=np.int64)
+    first_fold[np.searchsorted(pair_keys, fold_keys)] = fold_rows[first_fold_rows]
+    pair_hand, pair_player = pair_keys // n_players, pair_keys % n_players
+    for field, dealt_street in (('saw_flop', 1), ('saw_turn', 2), ('saw_river', 3)):
+        dealt_row = per_hand_first(table, np.flatnonzero(street == dealt_street), n_hands)[pair_hand]
+        live = (dealt_row >= 0) & (first_seen < dealt_row) & (first_fold > dealt_row)
+        counters[field] = np.bincount(pair_player[live], minlength=n_players)
+        if dealt_street == 1:
+            counters['c_bet_chance'] = np.bincount(pair_player[live & (pair_player == last_raiser[pair_hand])],
+                                                   minlength=n_players)
+
+    # Showdown: more than one player seen earlier in the hand who hasn't folded before this event
+    def distinct_before(mask):
+        first = np.zeros(len(table) + 1, dtype=np.int64)
+        _, first_rows = np.unique(keys[mask], return_index=True)
+        first[np.flatnonzero(mask)[first_rows] + 1] = 1
+        seen = np.cumsum(first)
+        return seen[row] - seen[hand_start]
+
+    showdowns = post_flop & (action == SHOWDOWN)
+    live_before = distinct_before(seated) - distinct_before(seated & folds)
+    counters['showdown_count'] = count(showdowns & (live_before > 1))
+
+    hands_played = counters['hands_played']
+    columns = [counters.get(field, np.zeros(n_players, dtype=np.int64)) for field in COUNTER_FIELDS]
+    return {int(player_id): PlayerCounters([int(column[player_id]) for column in columns])
+            for player_id in np.flatnonzero(hands_played)}
+
+
+# Binary session store: a fixed header, a JSON string table with the player names and hand ids,
+# then one fixed-width record per event. The records can be memory-mapped straight into an EventTable.
+STORE_MAGIC = b'PNSTATS\0'
+STORE_VERSION = 2
+STORE_EXTENSION = '.events'
+STORE_HEADER = struct.Struct('<8sIIQQqQ')  # magic, version, unused, events, source size, source mtime, strings size
+# Fields of the record dtype, as a list so NumPy is only imported once a store is used
+STORE_RECORD = [('hand', '<i4'), ('event', '<i4'), ('seat', '<i2'), ('player', '<i4'), ('action', '<i2'),
+                ('street', '<i1'), ('position', '<i1'), ('amount', '<f8')]
+
+
+def session_store_path(json_filepath):
+    return os.path.splitext(json_filepath)[0] + STORE_EXTENSION
+
+
+def write_session_store(json_filepath, store_filepath=None):
+    # Convert a hand log into the binary store. Names are kept as written (lowercased) so
+    # aliases can still be applied when the store is loaded.
+    store_filepath = store_filepath or session_store_path(json_filepath)
+    stat = os.stat(json_filepath)
+    table = load_event_table(iter_hands(json_filepath))
+
+    records = np.empty(len(table), dtype=STORE_RECORD)
+    for field, _ in STORE_RECORD:
+        records[field] = getattr(table, field)
+    strings = json.dumps({'players': table.player_names, 'hands': table.hand_ids}).encode()
+    padding = -(STORE_HEADER.size + len(strings)) % 8
+
+    tmp_filepath = store_filepath + '.tmp'
+    with open(tmp_filepath, 'wb') as file:
+        file.write(STORE_HEADER.pack(STORE_MAGIC, STORE_VERSION, 0, len(table), stat.st_size, stat.st_mtime_ns,
+                                     len(strings)))
+        file.write(strings)
+        file.write(b'\0' * padding)
+        file.write(records.tobytes())
+    os.replace(tmp_filepath, store_filepath)
+    return store_filepath
+
+
+def load_session_store(json_filepath, registry=None, store_filepath=None):
+    # Memory-map the binary store of a hand log into an EventTable, or return None if there is
+    # no store or it was written from a different version of the hand log
+    store_filepath = store_filepath or session_store_path(json_filepath)
+    try:
+        with open(store_filepath, 'rb') as file:
+            header = file.read(STORE_HEADER.size)
+            magic, version, _, n_events, source_size, source_mtime, strings_size = STORE_HEADER.unpack(header)
+            strings = json.loads(file.read(strings_size))
+        stat = os.stat(json_filepath)
+    except (OSError, struct.error, ValueError):
+        return None
+    if (magic, version, source_size, source_mtime) != (STORE_MAGIC, STORE_VERSION, stat.st_size, stat.st_mtime_ns):
+        return None
+
+    offset = STORE_HEADER.size + strings_size
+    offset += -offset % 8
+    if n_events:
+        records = np.memmap(store_filepath, dtype=STORE_RECORD, mode='r', offset=offset, shape=(n_events,))
+    else:
+        records = np.zeros(0, dtype=STORE_RECORD)
+
+    # Resolve the stored names through the registry, which only copies the player column
+    if registry is None:
+        registry = PlayerRegistry()
+    player_ids = np.array([registry.intern(name) for name in strings['players']] + [-1], dtype=np.int32)
+    return EventTable(records['hand'], records['event'], records['seat'], player_ids[records['player']],
+                      records['action'], records['street'], records['position'], records['amount'], registry.names,
+                      strings['hands'])
+
+
+# Bump whenever a stat definition changes so cached session stats are recomputed
+STATS_VERSION = 7
+
+# Columns of the displayed stats tables, in the order main() reports them
+SESSION_COLUMNS = ['hands_played', 'VPIP', 'PFR', 'Agg', 'C_bet', '3bet', '4bet', 'Fold_to_3bet', 'Fold_to_C_bet',
+                   'PnL', 'BB/100 Hands', 'showdown_count', 'Showdown Wins', 'Flop_seen', 'Turn_seen', 'River_seen',
+                   'Turn_Agg', 'River_Agg']
 
-                if player_name not in player_stats:
-                    player_stats[player_name] = {
-                        'C_bet_count': 0, 'hands_played': 0
-                    }
 
-                # Track the pre-flop raiser
-                if not flop_seen and action_type == 8:  # Raise before flop
-                    pre_flop_raiser = player_name
-
-                # Track C-bet
-                if flop_seen and action_type == 8 and player_name == pre_flop_raiser and not c_bet_made:  # Bet after flop by pre-flop raiser
-                    player_stats[player_name]['C_bet_count'] += 1
-                    c_bet_made = True  # Mark that a C-bet has been made in this hand
-
-                players_in_hand.add(player_name)
+def calculate_vpip(data):
+    return calculate_stat(data, VPIPStat())
 
-        # Increment the hands played for the players involved
-        for player in players_in_hand:
-            player_stats[player]['hands_played'] += 1
+def calculate_pfr(data):
+    return calculate_stat(data, PFRStat())
 
-    # Calculating final C-bet percentage
-    for player_name, stats in player_stats.items():
-        stats['C_bet'] = round(stats['C_bet_count'] / stats['hands_played'] * 100, 2)
-        del stats['C_bet_count']  # Remove the count after calculating the percentage
+def calculate_agg(data):
+    return calculate_stat(data, AggStat())
 
-    return player_stats
+def calculate_c_bet(data):
+    return calculate_stat(data, CBetStat())
 
 def calculate_showdown_stats(data):
-    player_stats = {}
-
-    for hand in data['hands']:
-        flop_seen = False
-        players_in_hand = set()  # Players who've played in this hand
-        players_folded = set()  # Players who've folded in this hand
-        players_at_showdown = set()  # Players who've reached showdown in this hand
-
-        # Create a mapping of seat numbers to player names for this hand
-        seat_to_name = {player['seat']: player['name'].lower() for player in hand['players']}
-
-        for event in hand['events']:
-            payload = event['payload']
-            action_type = payload['type']
-            player_seat = payload.get('seat', None)
-
-            # Mark the flop event
-            if 'turn' in payload and payload['turn'] == 1:  # Flop
-                flop_seen = True
-
-            # Initialize player stats if player_seat exists
-            if player_seat:
-                player_name = seat_to_name[player_seat]
-
-                if player_name not in player_stats:
-                    player_stats[player_name] = {
-                        'showdown_count': 0, 'showdown_wins': 0, 'hands_played': 0
-                    }
-
-                # Track players who've folded
-                if action_type == 11:  # Fold
-                    players_folded.add(player_name)
-
-                # Track showdowns
-                if action_type == 15 and flop_seen and len(players_in_hand - players_folded) > 1:
-                    player_stats[player_name]['showdown_count'] += 1
-                    players_at_showdown.add(player_name)
-
-                # Track showdown wins
-                if action_type == 12 and player_name == seat_to_name[player_seat]:  # Win
-                    player_stats[player_name]['showdown_wins'] += 1
-
-                players_in_hand.add(player_name)
-            
-            for player in players_in_hand:
-                player_stats[player]['hands_played'] += 1
-
-        # Increment the hands played for the players involved
-        for player in players_in_hand:
-            player_stats[player]['hands_played'] += 1
-
-    # Calculating final showdown percentages
-    for player_name, stats in player_stats.items():
-        if stats['showdown_count'] > 0:  # Avoid division by zero
-            stats['Showdown Wins'] = round(stats['showdown_wins'] / stats['showdown_count'] * 100, 2)
+    return calculate_stat(data, ShowdownStat())
+
+
+# Prefixes pokernow puts in front of the game id in downloaded file names
+FILE_PREFIXES = ('poker_now_log_', 'poker_now_hands_', 'ledger_')
+
+# Hand logs and ledgers without a common game id are paired if they start within this many seconds
+SESSION_MATCH_WINDOW = 12 * 60 * 60
+
+Session = namedtuple('Session', ['game_id', 'json_filepath', 'csv_filepath'])
+
+
+def game_id_from_filename(filename):
+    stem = os.path.splitext(filename)[0]
+    for prefix in FILE_PREFIXES:
+        if stem.startswith(prefix):
+            return stem[len(prefix):]
+    return stem
+
+
+def parse_timestamp(value):
+    # pokernow writes epoch milliseconds in hand logs and ISO 8601 strings in ledgers
+    if value in (None, ''):
+        return None
+    if isinstance(value, (int, float)):
+        return value / 1000
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+    except ValueError:
+        return None
+
+
+def file_digest(filepath):
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class SessionCatalog:
+    # Index of the hand logs and ledgers on disk. Each file's size/mtime, game id, start time and
+    # content digest are recorded (and saved to catalog_filepath if given), so unchanged files are
+    # never reopened just to pair or hash them.
+    def __init__(self, catalog_filepath=None):
+        self.catalog_filepath = catalog_filepath
+        self.files = {}
+        if catalog_filepath and os.path.exists(catalog_filepath):
+            try:
+                with open(catalog_filepath, 'r') as file:
+                    self.files = json.load(file)
+            except ValueError:
+                self.files = {}  # A corrupt catalog is rebuilt from the files
+
+    def file_info(self, entry):
+        stat = entry.stat()
+        stamp = [stat.st_size, stat.st_mtime_ns]
+        info = self.files.get(entry.path)
+        # Entries saved before hands were validated here may hold a big blind that isn't a number
+        if info is None or info['stamp'] != stamp or type(info.get('big_blind', '')) not in (int, float, type(None)):
+            if entry.name.endswith('.json'):
+                game_id, started_at, big_blind = self.read_hand_log_info(entry.path)
+            else:
+                game_id, started_at, big_blind = None, self.read_ledger_start(entry.path), None
+            info = self.files[entry.path] = {'stamp': stamp, 'game_id': game_id, 'started_at': started_at,
+                                             'big_blind': big_blind}
+        return info
+
+    def read_hand_log_info(self, json_filepath):
+        # The gameId stored in the export and the start time and big blind of its first hand that
+        # passes validate_hand, as iter_hands quarantines the others
+        try:
+            with open(json_filepath, 'r') as file:
+                reader = HandLogReader(file)
+                reader.expect('{')
+                game_id = None
+                while reader.peek() != '}':
+                    name = reader.decode()
+                    reader.expect(':')
+                    if name == 'hands':
+                        first_hand = next((hand for hand in reader.iter_array() if validate_hand(hand) is None), {})
+                        big_blind = first_hand.get('bigBlind')
+                        return (game_id, parse_timestamp(first_hand.get('startedAt')),
+                                big_blind if type(big_blind) in (int, float) and big_blind > 0 else None)
+                    value = reader.decode()
+                    if name == 'gameId':
+                        game_id = value
+                    if reader.peek() == ',':
+                        reader.pos += 1
+        except ValueError:
+            pass
+        return None, None, None
+
+    def read_ledger_start(self, csv_filepath):
+        with open(csv_filepath, 'r', newline='') as file:
+            starts = [parse_timestamp(row.get('session_start_at')) for row in csv.DictReader(file)]
+        starts = [start for start in starts if start is not None]
+        return min(starts) if starts else None
+
+    def digest(self, filepath):
+        # Content digest of a file already seen by scan, only computed when the file changed
+        info = self.files[filepath]
+        if 'digest' not in info:
+            info['digest'] = file_digest(filepath)
+        return info['digest']
+
+    def scan(self, csv_directory, json_directory):
+        # Pair every ledger with its hand log, by game id first and start time second.
+        # Returns the matched sessions and the paths of files that couldn't be paired.
+        json_files, csv_files = {}, {}
+        for directory, extension, files in ((json_directory, '.json', json_files), (csv_directory, '.csv', csv_files)):
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.name.endswith(extension) and entry.is_file():
+                        files[entry.path] = (game_id_from_filename(entry.name), self.file_info(entry))
+
+        csv_by_game_id = {game_id: csv_filepath for csv_filepath, (game_id, _) in csv_files.items()}
+        sessions = []
+        unmatched_json = []
+        for json_filepath, (filename_game_id, info) in sorted(json_files.items()):
+            for game_id in (info['game_id'], filename_game_id):
+                if game_id in csv_by_game_id:
+                    sessions.append(Session(game_id, json_filepath, csv_by_game_id.pop(game_id)))
+                    break
+            else:
+                unmatched_json.append(json_filepath)
+
+        # Pair the rest by the closest start times
+        unmatched_csv = sorted(csv_by_game_id.values())
+        candidates = sorted(
+            (abs(json_files[json_filepath][1]['started_at'] - csv_files[csv_filepath][1]['started_at']),
+             json_filepath, csv_filepath)
+            for json_filepath in unmatched_json if json_files[json_filepath][1]['started_at'] is not None
+            for csv_filepath in unmatched_csv if csv_files[csv_filepath][1]['started_at'] is not None
+        )
+        for difference, json_filepath, csv_filepath in candidates:
+            if difference > SESSION_MATCH_WINDOW:
+                break
+            if json_filepath in unmatched_json and csv_filepath in unmatched_csv:
+                game_id = json_files[json_filepath][1]['game_id'] or json_files[json_filepath][0]
+                sessions.append(Session(game_id, json_filepath, csv_filepath))
+                unmatched_json.remove(json_filepath)
+                unmatched_csv.remove(csv_filepath)
+
+        # Forget files that no longer exist
+        for filepath in set(self.files) - set(json_files) - set(csv_files):
+            del self.files[filepath]
+
+        sessions.sort(key=lambda session: session.json_filepath)
+        return sessions, unmatched_json + unmatched_csv
+
+    def save(self):
+        if not self.catalog_filepath:
+            return
+        tmp_filepath = self.catalog_filepath + '.tmp'
+        with open(tmp_filepath, 'w') as file:
+            json.dump(self.files, file)
+        os.replace(tmp_filepath, self.catalog_filepath)
+
+
+STATS_CACHE_EXTENSION = '.stats'
+
+
+class StatsCache:
+    # On-disk cache of per-session PlayerCounters, one JSON file per session. Entries are keyed by the
+    # content hash of the hand log and ledger plus STATS_VERSION, so changing a file or the stat
+    # definitions makes the old entry unreachable. The least recently used entries are evicted
+    # once the cache holds more than max_entries sessions. Entries have their own extension, so
+    # the other state kept in the directory (rolling.json, hand_sample.json, ...) is left alone.
+    def __init__(self, cache_directory, max_entries=5000):
+        self.cache_directory = cache_directory
+        self.max_entries = max_entries
+        os.makedirs(cache_directory, exist_ok=True)
+
+    def session_key(self, json_digest, csv_digest, aliases_digest='', positional=False, big_blind=None,
+                    opponents=False):
+        # Combine the content digests of a session's files, see SessionCatalog.digest, with the
+        # digest of the alias map and the big blind the session was ingested with. Entries made
+        # with opponents set also hold the session's OpponentMatrix.
+        key = f'stats-v{STATS_VERSION}:{json_digest}:{csv_digest}:{aliases_digest}:{big_blind}'
+        if positional:
+            key += ':positional'
+        if opponents:
+            key += ':opponents'
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.cache_directory, key + STATS_CACHE_EXTENSION)
+
+    def read(self, key):
+        path = self.entry_path(key)
+        try:
+            with open(path, 'r') as file:
+                entry = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if entry.get('version') != STATS_VERSION:
+            return None
+        os.utime(path)  # Mark the entry as recently used
+        return entry
+
+    def get(self, key):
+        entry = self.read(key)
+        if entry is None:
+            return None
+        # Keys are player names, or [player name, position] pairs for positional stats
+        return {tuple(player_key) if isinstance(player_key, list) else player_key: PlayerCounters(values)
+                for player_key, values in entry['stats']}
+
+    def get_opponents(self, key):
+        # (session stats, OpponentMatrix) of an entry put with a matrix, or None
+        entry = self.read(key)
+        if entry is None or 'matrix' not in entry:
+            return None
+        return self.get(key), OpponentMatrix.from_list(entry['matrix'])
+
+    def put(self, key, session_stats, matrix=None):
+        path = self.entry_path(key)
+        tmp_path = path + '.tmp'
+        entry = {'version': STATS_VERSION,
+                 'stats': [[player_key, counters.as_list()] for player_key, counters in session_stats.items()]}
+        if matrix is not None:
+            entry['matrix'] = matrix.as_list()
+        with open(tmp_path, 'w') as file:
+            json.dump(entry, file)
+        os.replace(tmp_path, path)
+
+    def entries(self):
+        return [entry for entry in os.scandir(self.cache_directory) if entry.name.endswith(STATS_CACHE_EXTENSION)]
+
+    def evict(self):
+        entries = self.entries()
+        if len(entries) <= self.max_entries:
+            return 0
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        evicted = entries[:len(entries) - self.max_entries]
+        for entry in evicted:
+            os.remove(entry.path)
+        return len(evicted)
+
+    def invalidate(self):
+        # Remove every cached session so the next run recomputes everything
+        entries = self.entries()
+        for entry in entries:
+            os.remove(entry.path)
+        return len(entries)
+
+
+class TimedHands:
+    # Wraps a hand iterator to count the hands and events it yields and the time spent producing them
+    def __init__(self, hands):
+        self.hands_iter = iter(hands)
+        self.seconds = 0.0
+        self.hands = 0
+        self.events = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            hand = next(self.hands_iter)
+        finally:
+            self.seconds += time.perf_counter() - start
+        self.hands += 1
+        self.events += len(hand['events'])
+        return hand
+
+
+class RunReport:
+    # Opt-in instrumentation for calculate_overall_stats. Records one row per stage, overall and
+    # per session, with its wall time and hand/event counts. With trace_memory set it also records
+    # peak_mib, the most memory the stage had allocated at once on top of what was allocated when
+    # it started, traced with tracemalloc. Tracing slows allocation-heavy stages several times
+    # over, so the times of such a run don't compare with those of a timing-only one.
+    FIELDS = ['session', 'stage', 'seconds', 'hands', 'events', 'peak_mib']
+    # [memory allocated at the start, highest allocated since] of every stage open in this
+    # process, innermost last, shared by all reports as tracemalloc keeps a single peak
+    open_stages = []
+
+    def __init__(self, trace_memory=False):
+        self.rows = []
+        self.trace_memory = trace_memory
+        self.started_tracing = trace_memory and not tracemalloc.is_tracing()
+        if self.started_tracing:
+            tracemalloc.start()
+
+    def close(self):
+        # Stop tracing if this report started it, so the rest of the process runs at full speed
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+
+    @contextmanager
+    def stage(self, name, session=''):
+        row = {'session': session, 'stage': name, 'seconds': 0.0, 'hands': None, 'events': None, 'peak_mib': None}
+        if self.trace_memory:
+            self.start_memory_stage()
+        start = time.perf_counter()
+        try:
+            yield row
+        finally:
+            row['seconds'] = round(row['seconds'] + time.perf_counter() - start, 6)
+            if self.trace_memory:
+                self.end_memory_stage(row)
+            self.rows.append(row)
+
+    def start_memory_stage(self):
+        # Hand the peak so far to the enclosing stage before resetting it for this one
+        current, peak = tracemalloc.get_traced_memory()
+        if self.open_stages:
+            self.open_stages[-1][1] = max(self.open_stages[-1][1], peak)
+        self.open_stages.append([current, current])
+        tracemalloc.reset_peak()
+
+    def end_memory_stage(self, row):
+        started_with, highest = self.open_stages.pop()
+        highest = max(highest, tracemalloc.get_traced_memory()[1])
+        if self.open_stages:
+            self.open_stages[-1][1] = max(self.open_stages[-1][1], highest)
+        row['peak_mib'] = round((highest - started_with) / 2 ** 20, 2)
+
+    def add_parse_stage(self, timed_hands, stats_row):
+        # Split the time of a streamed stats pass between decoding the hand log and the stats
+        # themselves. Memory can't be split that way, the stats row's peak covers both.
+        stats_row['seconds'] = round(stats_row['seconds'] - timed_hands.seconds, 6)
+        stats_row['hands'] = timed_hands.hands
+        stats_row['events'] = timed_hands.events
+        self.rows.append({'session': stats_row['session'], 'stage': 'parse', 'seconds': round(timed_hands.seconds, 6),
+                          'hands': timed_hands.hands, 'events': timed_hands.events,
+                          'peak_mib': None})
+
+    def write(self, filepath):
+        # Export as JSON or CSV depending on the file extension
+        if filepath.endswith('.json'):
+            with open(filepath, 'w') as file:
+                json.dump(self.rows, file, indent=2)
         else:
-            stats['Showdown Wins'] = 0.0
-        del stats['showdown_wins']  # Remove the count after calculating the percentage
-
-    return player_stats
-
-
-def calculate_overall_stats(csv_directory, json_directory, big_blind):
-    # Get a list of all CSV and JSON files
-    csv_files = [f for f in os.listdir(csv_directory) if f.endswith('.csv')]
-    json_files = [f for f in os.listdir(json_directory) if f.endswith('.json')]
-
-    # Initialize an empty DataFrame to store the overall stats
-    overall_stats_df = pd.DataFrame()
-
-    # Loop over all files
-    for csv_file, json_file in zip(csv_files, json_files):
-        csv_filepath = os.path.join(csv_directory, csv_file)
-        json_filepath = os.path.join(json_directory, json_file)
-
-        # Calculate the stats for this file
-        stats_df = main(json_filepath, csv_filepath)
-
-        # Add the stats to the overall stats DataFrame
-        overall_stats_df = pd.concat([overall_stats_df, stats_df])
-
-    # Calculate the overall stats
-    overall_stats_df = overall_stats_df.groupby(overall_stats_df.index).sum()
+            with open(filepath, 'w', newline='') as file:
+                writer = csv.DictWriter(file, fieldnames=self.FIELDS)
+                writer.writeheader()
+                writer.writerows(self.rows)
+
+
+def report_stage(report, name, session=''):
+    # report.stage(), or a no-op when instrumentation is off
+    return report.stage(name, session) if report is not None else nullcontext({})
+
+
+def merge_session_stats(session_stats_list):
+    # Add up the PlayerCounters of every session in a single reduction
+    merged = {}
+    for session_stats in session_stats_list:
+        for player_name, counters in session_stats.items():
+            if player_name in merged:
+                merged[player_name] += counters
+            else:
+                merged[player_name] = PlayerCounters(counters.as_list())
+    return merged
+
+
+def counters_to_rows(player_counters):
+    # Derive the displayed stats of each player from their raw counters, one dict per player
+    hands_played_stats = {player_name: counters.hands_played for player_name, counters in player_counters.items()}
+    pnl_bb_stats = {player_name: counters.pnl_bb for player_name, counters in player_counters.items()}
+    bb_per_100_hands_stats = calculate_bb_per_100_hands(pnl_bb_stats, hands_played_stats)
+
+    rows = {}
+    for player_name, counters in player_counters.items():
+        row = rows[player_name] = {column: counters.stat(column) for column, _, _ in STAT_COLUMNS}
+        row['BB/100 Hands'] = bb_per_100_hands_stats[player_name]
+    return rows
+
+
+def counters_to_dataframe(player_counters):
+    # The displayed stats as a table. Counters keyed by (player name, position) give a table
+    # indexed by player and position.
+    df = pd.DataFrame.from_dict(counters_to_rows(player_counters), orient='index', columns=SESSION_COLUMNS)
+    if isinstance(df.index, pd.MultiIndex):
+        df.index.names = ['player', 'position']
+    return df
 
-    # Calculate the percentages and BB/100 Hands for the overall stats
-    overall_stats_df['VPIP'] = round(overall_stats_df['VPIP'] / overall_stats_df['hands_played'] * 100, 2)
-    overall_stats_df['PFR'] = round(overall_stats_df['PFR'] / overall_stats_df['hands_played'] * 100, 2)
-    overall_stats_df['Agg'] = round(overall_stats_df['Agg'] / overall_stats_df['hands_played'] * 100, 2)
-    overall_stats_df['3bet'] = round(overall_stats_df['3bet'] / overall_stats_df['hands_played'] * 100, 2)
-    overall_stats_df['4bet'] = round(overall_stats_df['4bet'] / overall_stats_df['hands_played'] * 100, 2)
-    overall_stats_df['Fold_to_3bet'] = round(overall_stats_df['Fold_to_3bet'] / overall_stats_df['hands_played'] * 100, 2)
-    overall_stats_df['C_bet'] = round(overall_stats_df['C_bet'] / overall_stats_df['hands_played'] * 100, 2)
-    overall_stats_df['Fold_to_C_bet'] = round(overall_stats_df['Fold_to_C_bet'] / overall_stats_df['hands_played'] * 100, 2)
-    overall_stats_df['BB/100 Hands'] = round((overall_stats_df['PnL'] / overall_stats_df['hands_played'] * 100 ) * big_blind, 2)
 
-    # Export the DataFrame to a CSV file
-    overall_stats_df.reset_index().to_csv('Poker Hands/CSV Output/overall_player_stats.csv', index=False)
+CONFIDENCE_Z = 1.96  # Two-sided 95% intervals
+INTERVAL_COLUMNS = ['value', 'n', 'low', 'high']
+
+
+def wilson_interval(successes, trials, z=CONFIDENCE_Z):
+    # Score interval of a rate, in percent. Unlike value +- z standard errors it stays within
+    # 0-100 and holds up for small samples and rates close to 0 or 100%.
+    if not trials:
+        return 0.0, 100.0
+    rate = min(max(successes / trials, 0.0), 1.0)
+    scale = 1 + z * z / trials
+    center = (rate + z * z / (2 * trials)) / scale
+    half_width = z * sqrt(rate * (1 - rate) / trials + z * z / (4 * trials * trials)) / scale
+    return round(max(center - half_width, 0.0) * 100, 2), round(min(center + half_width, 1.0) * 100, 2)
+
+
+def counters_to_intervals(counters, z=CONFIDENCE_Z):
+    # Every rate of STAT_COLUMNS, and BB/100, as {column: (value, sample size, low, high)}. For
+    # BB/100 hands are taken as independent with a mean that is small next to their spread, so a
+    # session's squared result estimates the variance of its hands and pnl_bb_sq that of them all.
+    intervals = {}
+    for column, numerator, denominator in STAT_COLUMNS:
+        if denominator is not None:
+            trials = getattr(counters, denominator)
+            intervals[column] = (counters.stat(column), trials) + wilson_interval(getattr(counters, numerator),
+                                                                                  trials, z)
+    hands_played = counters.hands_played
+    if hands_played:
+        bb_per_100_hands = counters.pnl_bb / hands_played * 100
+        half_width = z * 100 * sqrt(counters.pnl_bb_sq) / hands_played
+        intervals['BB/100 Hands'] = (round(bb_per_100_hands, 2), hands_played,
+                                     round(bb_per_100_hands - half_width, 2), round(bb_per_100_hands + half_width, 2))
+    else:
+        intervals['BB/100 Hands'] = (0.0, 0, 0.0, 0.0)
+    return intervals
+
+
+def intervals_dataframe(player_intervals):
+    # Long table of {player key: counters_to_intervals(...)}, indexed by player (and position) and stat
+    rows = {}
+    for player_key, intervals in player_intervals.items():
+        for column, values in intervals.items():
+            rows[(player_key if isinstance(player_key, tuple) else (player_key,)) + (column,)] = values
+    if not rows:
+        return pd.DataFrame(columns=INTERVAL_COLUMNS)
+    names = ['player', 'stat'] if len(next(iter(rows))) == 2 else ['player', 'position', 'stat']
+    df = pd.DataFrame(list(rows.values()), columns=INTERVAL_COLUMNS,
+                      index=pd.MultiIndex.from_tuples(list(rows), names=names))
+    return df.sort_index()
+
+
+def list_sessions(csv_directory, json_directory, catalog=None):
+    # Get the matched (hand log, ledger) pairs, reporting any file that has no partner
+    sessions, unmatched = (catalog or SessionCatalog()).scan(csv_directory, json_directory)
+    for filepath in unmatched:
+        print(f'Skipping {filepath}: no matching hand log or ledger', file=sys.stderr)
+    return [(session.json_filepath, session.csv_filepath) for session in sessions]
+
+
+def file_stamp(filepath):
+    # (size, mtime) of a file, or None if it doesn't exist
+    try:
+        stat = os.stat(filepath)
+    except OSError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+class ReportWriter:
+    # Writes a stats table, indexed by player (and position), in one file format. Every write goes
+    # to a temporary file next to the target that is then renamed over it, so readers never see a
+    # partial file. Incremental writers can also replace the rows of some players in an existing
+    # file, given a table holding only those players' rows, instead of being handed the full table.
+    extension = None
+    incremental = False
+
+    def write(self, df, filepath):
+        tmp_filepath = filepath + '.tmp'
+        self.write_file(df, tmp_filepath)
+        os.replace(tmp_filepath, filepath)
+
+    def update(self, df, filepath, players):
+        # Replace the rows of players with their rows in df; players that df has no rows for are dropped
+        tmp_filepath = filepath + '.tmp'
+        self.update_file(df, filepath, tmp_filepath, players)
+        os.replace(tmp_filepath, filepath)
+
+    def write_file(self, df, filepath):
+        raise NotImplementedError
+
+    def update_file(self, df, filepath, tmp_filepath, players):
+        raise NotImplementedError
+
+
+class CSVWriter(ReportWriter):
+    extension = '.csv'
+    incremental = True
+
+    def write_file(self, df, filepath):
+        df.reset_index().to_csv(filepath, index=False)
+
+    def update_file(self, df, filepath, tmp_filepath, players):
+        # The new rows are formatted by pandas, so the file reads the same as after a full write,
+        # and the other rows are copied over as they are without being parsed into a table
+        new_rows = list(csv.reader(io.StringIO(df.reset_index().to_csv(index=False))))[1:]
+        with open(filepath, newline='') as file:
+            reader = csv.reader(file)
+            header = next(reader)
+            rows = [row for row in reader if row[0] not in players] + new_rows
+        rows.sort(key=lambda row: row[:df.index.nlevels])
+        with open(tmp_filepath, 'w', newline='') as file:
+            writer = csv.writer(file, lineterminator=os.linesep)
+            writer.writerow(header)
+            writer.writerows(rows)
+
+
+class JSONLinesWriter(ReportWriter):
+    # One JSON object per row, with the player (and position) as fields
+    extension = '.jsonl'
+    incremental = True
+
+    def write_file(self, df, filepath):
+        with open(filepath, 'w') as file:
+            file.writelines(self.lines(df))
+
+    def lines(self, df):
+        records = df.reset_index().to_json(orient='records', lines=True)
+        return [line + '\n' for line in records.splitlines() if line]
+
+    def update_file(self, df, filepath, tmp_filepath, players):
+        # Each record starts with the player (and position) fields
+        rows = []
+        with open(filepath) as file:
+            for line in file:
+                key = list(json.loads(line).values())[:df.index.nlevels]
+                if key[0] not in players:
+                    rows.append((key, line))
+        rows += [(list(json.loads(line).values())[:df.index.nlevels], line) for line in self.lines(df)]
+        rows.sort(key=lambda row: row[0])
+        with open(tmp_filepath, 'w') as file:
+            file.writelines(line for _, line in rows)
+
+
+class ParquetWriter(ReportWriter):
+    # Needs pyarrow or fastparquet, which pandas picks up if installed
+    extension = '.parquet'
+    incremental = True
+
+    def write_file(self, df, filepath):
+        df.to_parquet(filepath)
+
+    def update_file(self, df, filepath, tmp_filepath, players):
+        old_df = pd.read_parquet(filepath)
+        new_df = old_df[~old_df.index.get_level_values(0).isin(players)]
+        if len(df):
+            new_df = pd.concat([new_df, df])
+        self.write_file(new_df.sort_index(), tmp_filepath)
+
+
+class HTMLWriter(ReportWriter):
+    # A standalone page with the whole table, always rewritten in full
+    extension = '.html'
+
+    def write_file(self, df, filepath):
+        with open(filepath, 'w') as file:
+            file.write('<!DOCTYPE html>\n<html>\n<head><meta charset="utf-8"><title>Player stats</title></head>\n'
+                       '<body>\n<h1>Player stats</h1>\n')
+            file.write(f'<p>{len(df)} rows, updated {time.strftime("%Y-%m-%d %H:%M:%S")}</p>\n')
+            df.to_html(file)
+            file.write('\n</body>\n</html>\n')
+
+
+WRITERS = {'csv': CSVWriter, 'jsonl': JSONLinesWriter, 'parquet': ParquetWriter, 'html': HTMLWriter}
+
+
+class ReportSnapshot:
+    # The counters the last write_report wrote from and the (size, mtime) of each file it wrote, so
+    # the next one only rewrites the rows of players whose counters changed. Files changed or
+    # removed since, or left out of the last write, are written in full. Kept in memory, or in
+    # snapshot_filepath between runs.
+    def __init__(self, snapshot_filepath=None):
+        self.snapshot_filepath = snapshot_filepath
+        self.player_counters = {}  # Player key -> counter values
+        self.file_stamps = {}
+        if snapshot_filepath:
+            try:
+                with open(snapshot_filepath, 'r') as file:
+                    snapshot = json.load(file)
+            except (OSError, ValueError):
+                return
+            if snapshot.get('version') == STATS_VERSION:
+                self.player_counters = {tuple(player_key) if isinstance(player_key, list) else player_key: values
+                                        for player_key, values in snapshot['stats']}
+                self.file_stamps = snapshot['file_stamps']
+
+    def changed_players(self, player_counters):
+        # Names of the players whose counters differ from the snapshot, including players who are gone
+        player_keys = set(self.player_counters) | set(player_counters)
+        return {player_key[0] if isinstance(player_key, tuple) else player_key for player_key in player_keys
+                if self.player_counters.get(player_key) != (player_counters[player_key].as_list()
+                                                            if player_key in player_counters else None)}
+
+    def save(self):
+        if not self.snapshot_filepath:
+            return
+        tmp_filepath = self.snapshot_filepath + '.tmp'
+        with open(tmp_filepath, 'w') as file:
+            json.dump({'version': STATS_VERSION, 'stats': [[player_key, values] for player_key, values
+                                                           in self.player_counters.items()],
+                       'file_stamps': self.file_stamps}, file)
+        os.replace(tmp_filepath, self.snapshot_filepath)
+
+
+def write_report(player_counters, basepath, formats=('csv',), snapshot=None, df=None):
+    # Write the stats of player_counters to basepath plus the extension of each format (see
+    # WRITERS), returning the paths written. Given a ReportSnapshot, incremental writers only
+    # replace the rows of players whose counters changed since. df is the full table, if
+    # already built; it is only built here when some file has to be written in full.
+    players = snapshot.changed_players(player_counters) if snapshot is not None else None
+    changed_df = None
+    filepaths = []
+    file_stamps = {}  # Only the files written now match the snapshot's counters afterwards
+    for report_format in formats:
+        writer = WRITERS[report_format]()
+        filepath = basepath + writer.extension
+        if (players is not None and writer.incremental
+                and snapshot.file_stamps.get(filepath) == file_stamp(filepath) is not None):
+            if players:
+                if changed_df is None:
+                    changed_df = counters_to_dataframe({
+                        player_key: counters for player_key, counters in player_counters.items()
+                        if (player_key[0] if isinstance(player_key, tuple) else player_key) in players
+                    }).sort_index()
+                writer.update(changed_df, filepath, players)
+        else:
+            if df is None:
+                df = counters_to_dataframe(player_counters).sort_index()
+            writer.write(df, filepath)
+        filepaths.append(filepath)
+        file_stamps[filepath] = file_stamp(filepath)
+
+    if snapshot is not None:
+        snapshot.file_stamps = file_stamps
+        snapshot.player_counters = {player_key: counters.as_list() for player_key, counters in player_counters.items()}
+        snapshot.save()
+    return filepaths
+
+
+def calculate_overall_stats(csv_directory, json_directory, big_blind=None, workers=1, cache_directory=None,
+                            vectorized=False, aliases=None, report=None, profile_filepath=None, positional=False,
+                            formats=('csv',), intervals=False):
+    # Each session's PnL is counted in big blinds of the stakes read from its hand log; big_blind,
+    # as written in pokernow hand logs, is only used for hand logs that don't record one.
+    # Pass a RunReport to record the time spent in each stage and session. With profile_filepath
+    # a cProfile dump of the run is written there too; it only covers this process, so profile
+    # with workers=1 to see inside the stat code. With positional set every stat is broken down
+    # by (player, position) and written to overall_player_position_stats.csv. The table is written in
+    # each of formats (see WRITERS); with a cache_directory only the rows of players whose stats
+    # changed since the last run are rewritten. With intervals set the sample size and confidence
+    # interval of every rate and BB/100 are also written, to the same name with _intervals.csv.
+    if profile_filepath:
+        profiler = cProfile.Profile()
+        overall_stats_df = profiler.runcall(calculate_overall_stats, csv_directory, json_directory, big_blind,
+                                            workers, cache_directory, vectorized, aliases, report, None, positional,
+                                            formats, intervals)
+        profiler.dump_stats(profile_filepath)
+        return overall_stats_df
+
+    player_counters = calculate_overall_counters(csv_directory, json_directory, big_blind, workers, cache_directory,
+                                                 vectorized, aliases, report, positional)
+    with report_stage(report, 'dataframe'):
+        overall_stats_df = counters_to_dataframe(player_counters).sort_index()
+
+    # Export the DataFrame in each format
+    with report_stage(report, 'export'):
+        name = 'overall_player_position_stats' if positional else 'overall_player_stats'
+        snapshot = ReportSnapshot(os.path.join(cache_directory, name + '.snapshot')) if cache_directory else None
+        write_report(player_counters, os.path.join('Poker Hands/CSV Output', name), formats, snapshot, overall_stats_df)
+        if intervals:
+            intervals_df = intervals_dataframe({player_key: counters_to_intervals(counters)
+                                                for player_key, counters in player_counters.items()})
+            CSVWriter().write(intervals_df, os.path.join('Poker Hands/CSV Output', name + '_intervals.csv'))
 
     return overall_stats_df
 
-def calculate_fold_to_three_bet(data):
-    player_stats = {}
-
-    for hand in data['hands']:
-        flop_seen = False
-        raise_count = 0
-        pre_flop_raiser = None
-        three_bet_occurred = False
-        players_in_hand = set()  # Players who've played in this hand
-
-        # Create a mapping of seat numbers to player names for this hand
-        seat_to_name = {player['seat']: player['name'].lower() for player in hand['players']}
-
-        for event in hand['events']:
-            payload = event['payload']
-            action_type = payload['type']
-            player_seat = payload.get('seat', None)
-
-            # Mark the flop event
-            if 'turn' in payload and payload['turn'] == 1:  # Flop
-                flop_seen = True
-
-            # Initialize player stats if player_seat exists
-            if player_seat:
-                player_name = seat_to_name[player_seat]
-
-                if player_name not in player_stats:
-                    player_stats[player_name] = {
-                        'fold_to_3bet_count': 0, 'raise_count': 0, 'hands_played': 0
-                    }
-
-                # Track the pre-flop raiser
-                if not flop_seen and action_type == 8 and raise_count == 0:  # First raise before flop
-                    pre_flop_raiser = player_name
-                    player_stats[player_name]['raise_count'] += 1
-                    raise_count += 1
-
-                # Track 3-bet
-                if not flop_seen and action_type == 8 and raise_count == 1 and player_name != pre_flop_raiser:  # Second raise (3-bet) before flop by a different player
-                    three_bet_occurred = True
-                    raise_count += 1
-
-                # Track fold to 3-bet
-                if not flop_seen and action_type == 11 and player_name == pre_flop_raiser and three_bet_occurred:  # Fold after 3-bet
-                    player_stats[player_name]['fold_to_3bet_count'] += 1
-
-                players_in_hand.add(player_name)
-
-        # Increment the hands played for the players involved
-        for player in players_in_hand:
-            player_stats[player]['hands_played'] += 1
 
-    # Calculating final fold to 3-bet percentage
-    for player_name, stats in player_stats.items():
-        if stats['raise_count'] > 0:  # Avoid division by zero
-            stats['Fold_to_3bet'] = round(stats['fold_to_3bet_count'] / stats['raise_count'] * 100, 2)
+def aliases_digest(aliases):
+    return hashlib.sha256(json.dumps(aliases or {}, sort_keys=True).encode()).hexdigest()
+
+
+def calculate_overall_counters(csv_directory, json_directory, big_blind=None, workers=1, cache_directory=None,
+                               vectorized=False, aliases=None, report=None, positional=False):
+    # The summed PlayerCounters of every player over the archive, keyed by player name (see
+    # calculate_overall_stats for the arguments). Needs neither pandas nor NumPy unless a
+    # session has to be read from a binary store or vectorized is set.
+    with report_stage(report, 'catalog'):
+        catalog = SessionCatalog(os.path.join(cache_directory, 'sessions.catalog') if cache_directory else None)
+        sessions = list_sessions(csv_directory, json_directory, catalog)
+        big_blinds = [catalog.files[json_filepath]['big_blind'] or big_blind for json_filepath, _ in sessions]
+
+    # Reuse the cached stats of sessions that haven't changed since they were last computed
+    session_stats_list = []
+    cache = StatsCache(cache_directory) if cache_directory else None
+    if cache:
+        with report_stage(report, 'cache lookup'):
+            cache_keys = [cache.session_key(catalog.digest(json_filepath), catalog.digest(csv_filepath),
+                                            aliases_digest(aliases),
+                                            positional, session_big_blind)
+                          for (json_filepath, csv_filepath), session_big_blind in zip(sessions, big_blinds)]
+            cached_stats = [cache.get(key) for key in cache_keys]
+            session_stats_list = [stats for stats in cached_stats if stats is not None]
+            missing = [i for i, stats in enumerate(cached_stats) if stats is None]
+    else:
+        missing = list(range(len(sessions)))
+
+    # Calculate the stats for each new session, in a pool of worker processes if requested
+    if report is not None:
+        session_function = partial(instrumented_session_stats, vectorized=vectorized, aliases=aliases,
+                                   positional=positional, trace_memory=report.trace_memory)
+    else:
+        session_function = partial(calculate_session_stats, vectorized=vectorized, aliases=aliases,
+                                   positional=positional)
+    with report_stage(report, 'sessions'):
+        if len(missing) > 1 and (workers is None or workers > 1):
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(session_function, *sessions[i], big_blind=big_blinds[i]) for i in missing]
+                new_stats_list = [future.result() for future in futures]
         else:
-            stats['Fold_to_3bet'] = 0.0
-        del stats['fold_to_3bet_count']  # Remove the count after calculating the percentage
-        del stats['raise_count']  # Remove the count after calculating the percentage
-
-    return player_stats
-
-
-def calculate_fold_to_c_bet(data):
-    player_stats = {}
-
-    for hand in data['hands']:
-        flop_seen = False
-        pre_flop_raiser = None
-        c_bet_made = False
-        players_in_hand = set()  # Players who've played in this hand
-
-        # Create a mapping of seat numbers to player names for this hand
-        seat_to_name = {player['seat']: player['name'].lower() for player in hand['players']}
-
-        for event in hand['events']:
-            payload = event['payload']
-            action_type = payload['type']
-            player_seat = payload.get('seat', None)
-
-            # Mark the flop event
-            if 'turn' in payload and payload['turn'] == 1:  # Flop
-                flop_seen = True
-
-            # Initialize player stats if player_seat exists
-            if player_seat:
-                player_name = seat_to_name[player_seat]
-
-                if player_name not in player_stats:
-                    player_stats[player_name] = {
-                        'fold_to_c_bet_count': 0, 'called_preflop_raise_count': 0, 'hands_played': 0
-                    }
+            new_stats_list = [session_function(*sessions[i], big_blind=big_blinds[i]) for i in missing]
+    if report is not None:
+        for _, session_rows in new_stats_list:
+            report.rows.extend(session_rows)
+        new_stats_list = [player_counters for player_counters, _ in new_stats_list]
+    session_stats_list.extend(new_stats_list)
+
+    if cache:
+        with report_stage(report, 'cache store'):
+            for i, session_stats in zip(missing, new_stats_list):
+                cache.put(cache_keys[i], session_stats)
+            cache.evict()
+            catalog.save()
+
+    # Calculate the overall stats from the summed counters
+    with report_stage(report, 'merge'):
+        return merge_session_stats(session_stats_list)
+
+HAND_DATABASE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id INTEGER PRIMARY KEY,
+    game_id TEXT NOT NULL,
+    json_filepath TEXT NOT NULL,
+    csv_filepath TEXT NOT NULL,
+    digest TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS players (
+    player_id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS hands (
+    hand_id INTEGER PRIMARY KEY,
+    session_id INTEGER NOT NULL REFERENCES sessions,
+    hand_key TEXT,
+    number INTEGER,
+    started_at REAL,
+    small_blind REAL,
+    big_blind REAL,
+    seat_count INTEGER NOT NULL,
+    dealer_seat INTEGER
+);
+CREATE TABLE IF NOT EXISTS hand_players (
+    hand_id INTEGER NOT NULL REFERENCES hands,
+    player_id INTEGER NOT NULL REFERENCES players,
+    seat INTEGER NOT NULL,
+    position INTEGER,
+    PRIMARY KEY (hand_id, seat)
+);
+CREATE TABLE IF NOT EXISTS events (
+    hand_id INTEGER NOT NULL REFERENCES hands,
+    event_index INTEGER NOT NULL,
+    seat INTEGER NOT NULL,
+    player_id INTEGER NOT NULL,
+    action INTEGER NOT NULL,
+    street INTEGER NOT NULL,
+    amount REAL NOT NULL,
+    PRIMARY KEY (hand_id, event_index)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS ledger (
+    session_id INTEGER NOT NULL REFERENCES sessions,
+    player_id INTEGER NOT NULL REFERENCES players,
+    net REAL NOT NULL,
+    PRIMARY KEY (session_id, player_id)
+);
+CREATE INDEX IF NOT EXISTS hands_session ON hands (session_id);
+CREATE INDEX IF NOT EXISTS hands_started_at ON hands (started_at);
+CREATE INDEX IF NOT EXISTS hands_big_blind ON hands (big_blind);
+CREATE INDEX IF NOT EXISTS hands_seat_count ON hands (seat_count);
+CREATE INDEX IF NOT EXISTS hand_players_player ON hand_players (player_id, hand_id);
+"""
+
+
+class HandDatabase:
+    # Local SQLite index of every ingested hand, its players and events, and the ledger nets, so
+    # stats for a filtered subset of the archive (player, date range, stakes, seat count) can be
+    # computed without rescanning the hand logs. Names are stored lowercased as written; aliases
+    # are applied when querying.
+    def __init__(self, db_filepath):
+        self.connection = sqlite3.connect(db_filepath)
+        self.connection.executescript(HAND_DATABASE_SCHEMA)
+        self.player_ids = dict(self.connection.execute('SELECT name, player_id FROM players'))
+        self.add_positions()
+
+    def add_positions(self):
+        # Databases created before positions were tracked get the column, filled from each hand's dealer seat
+        columns = [row[1] for row in self.connection.execute('PRAGMA table_info(hand_players)')]
+        if 'position' in columns:
+            return
+        with self.connection:
+            self.connection.execute('ALTER TABLE hand_players ADD COLUMN position INTEGER')
+            hands = {}
+            for hand_id, dealer_seat, seat in self.connection.execute(
+                    'SELECT hand_id, dealer_seat, seat FROM hands JOIN hand_players USING (hand_id)'):
+                hands.setdefault(hand_id, {'dealerSeat': dealer_seat, 'players': []})['players'].append({'seat': seat})
+            self.connection.executemany(
+                'UPDATE hand_players SET position = ? WHERE hand_id = ? AND seat = ?',
+                [(position, hand_id, seat) for hand_id, hand in hands.items()
+                 for seat, position in hand_positions(hand).items()])
+
+    def close(self):
+        self.connection.close()
+
+    def player_id(self, name):
+        name = name.lower()
+        player_id = self.player_ids.get(name)
+        if player_id is None:
+            player_id = self.connection.execute('INSERT INTO players (name) VALUES (?)', (name,)).lastrowid
+            self.player_ids[name] = player_id
+        return player_id
+
+    def ingest(self, csv_directory, json_directory, catalog=None):
+        # Add every session not ingested yet. Returns the number of sessions added.
+        catalog = catalog or SessionCatalog()
+        sessions, unmatched = catalog.scan(csv_directory, json_directory)
+        for filepath in unmatched:
+            print(f'Skipping {filepath}: no matching hand log or ledger', file=sys.stderr)
+
+        new_sessions = []
+        for game_id, json_filepath, csv_filepath in sessions:
+            digest = f'{catalog.digest(json_filepath)}:{catalog.digest(csv_filepath)}'
+            if not self.connection.execute('SELECT 1 FROM sessions WHERE digest = ?', (digest,)).fetchone():
+                new_sessions.append((game_id, json_filepath, csv_filepath, digest))
+
+        ledgers = calculate_pnl_batch([csv_filepath for _, _, csv_filepath, _ in new_sessions])
+        for game_id, json_filepath, csv_filepath, digest in new_sessions:
+            self.ingest_session(game_id, json_filepath, csv_filepath, digest, ledgers[csv_filepath])
+        return len(new_sessions)
+
+    def ingest_session(self, game_id, json_filepath, csv_filepath, digest, pnl_stats=None):
+        with self.connection:
+            # A session whose files changed replaces what was ingested from them before
+            for (old_session_id,) in self.connection.execute(
+                    'SELECT session_id FROM sessions WHERE json_filepath = ?', (json_filepath,)).fetchall():
+                self.delete_session(old_session_id)
+
+            session_id = self.connection.execute(
+                'INSERT INTO sessions (game_id, json_filepath, csv_filepath, digest) VALUES (?, ?, ?, ?)',
+                (game_id, json_filepath, csv_filepath, digest)).lastrowid
+
+            for hand in iter_hands(json_filepath):
+                seat_to_player = {player['seat']: self.player_id(player['name']) for player in hand['players']}
+                hand_id = self.connection.execute(
+                    'INSERT INTO hands (session_id, hand_key, number, started_at, small_blind, big_blind, seat_count,'
+                    ' dealer_seat) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    (session_id, hand.get('id'), hand.get('number'), parse_timestamp(hand.get('startedAt')),
+                     hand.get('smallBlind'), hand.get('bigBlind'), len(seat_to_player), hand.get('dealerSeat'))
+                ).lastrowid
+                positions = hand_positions(hand)
+                self.connection.executemany(
+                    'INSERT INTO hand_players (hand_id, player_id, seat, position) VALUES (?, ?, ?, ?)',
+                    [(hand_id, player_id, seat, positions.get(seat)) for seat, player_id in seat_to_player.items()])
+
+                events = []
+                street = 0
+                for event_index, event in enumerate(hand['events']):
+                    payload = event['payload']
+                    if 'turn' in payload and payload['turn'] > street:
+                        street = payload['turn']
+                    seat = payload.get('seat', None) or 0
+                    events.append((hand_id, event_index, seat, seat_to_player[seat] if seat else -1, payload['type'],
+                                   street, payload.get('value', 0) or 0))
+                self.connection.executemany('INSERT INTO events VALUES (?, ?, ?, ?, ?, ?, ?)', events)
+
+            if pnl_stats is None:
+                pnl_stats = calculate_pnl(csv_filepath)
+            self.connection.executemany(
+                'INSERT INTO ledger (session_id, player_id, net) VALUES (?, ?, ?)',
+                [(session_id, self.player_id(player_name), net) for player_name, net in pnl_stats.items()])
+
+    def delete_session(self, session_id):
+        hands = 'SELECT hand_id FROM hands WHERE session_id = ?'
+        self.connection.execute(f'DELETE FROM events WHERE hand_id IN ({hands})', (session_id,))
+        self.connection.execute(f'DELETE FROM hand_players WHERE hand_id IN ({hands})', (session_id,))
+        self.connection.execute('DELETE FROM hands WHERE session_id = ?', (session_id,))
+        self.connection.execute('DELETE FROM ledger WHERE session_id = ?', (session_id,))
+        self.connection.execute('DELETE FROM sessions WHERE session_id = ?', (session_id,))
+
+    def hand_filter(self, registry, player=None, start=None, end=None, stakes=None, seat_count=None):
+        # SQL condition on the hands table (and its parameters) for the given filters. start and
+        # end are datetimes or epoch seconds, stakes is the big blind of the hands and player
+        # matches every name aliased to it.
+        conditions, params = [], []
+        if player is not None:
+            player_name = registry.names[registry.intern(player)]
+            player_ids = [player_id for name, player_id in self.player_ids.items()
+                          if registry.names[registry.intern(name)] == player_name]
+            conditions.append(f'hand_id IN (SELECT hand_id FROM hand_players WHERE player_id IN '
+                              f'({", ".join("?" * len(player_ids)) or "NULL"}))')
+            params += player_ids
+        if start is not None:
+            conditions.append('started_at >= ?')
+            params.append(start.timestamp() if isinstance(start, datetime) else start)
+        if end is not None:
+            conditions.append('started_at < ?')
+            params.append(end.timestamp() if isinstance(end, datetime) else end)
+        if stakes is not None:
+            conditions.append('big_blind = ?')
+            params.append(stakes)
+        if seat_count is not None:
+            conditions.append('seat_count = ?')
+            params.append(seat_count)
+        return ' AND '.join(conditions) or '1', params
+
+    def player_counters(self, aliases=None, positional=False, **filters):
+        # PlayerCounters, keyed by player name, over the hands matching filters (see hand_filter).
+        # PnL comes from the ledgers of the sessions that have at least one matching hand, and is
+        # put in big blinds with the big blind of each session's first hand. With
+        # positional set they're keyed by (player name, position) instead and carry no PnL, since
+        # the ledger only has a session total.
+        registry = PlayerRegistry(aliases)
+        condition, params = self.hand_filter(registry, **filters)
+        hand_rows = self.connection.execute(
+            f'SELECT hand_id, hand_key FROM hands WHERE {condition} ORDER BY hand_id', params).fetchall()
+
+        # Load the matching events as columns and compute the counters with the vectorized engine
+        rows = self.connection.execute(
+            f'SELECT hand_id, event_index, seat, events.player_id, action, street, '
+            f'COALESCE(position, {UNKNOWN_POSITION}), amount FROM events LEFT JOIN hand_players USING (hand_id, seat) '
+            f'WHERE hand_id IN (SELECT hand_id FROM hands WHERE {condition}) ORDER BY hand_id, event_index',
+            params).fetchall()
+        columns = np.array(rows, dtype=np.float64).reshape(-1, 8).T
+        hand_index = np.searchsorted(np.array([hand_id for hand_id, _ in hand_rows], dtype=np.int64),
+                                     columns[0].astype(np.int64))
+        lookup = np.full(max(self.player_ids.values(), default=0) + 2, -1, dtype=np.int32)
+        for name, player_id in self.player_ids.items():
+            lookup[player_id] = registry.intern(name)
+        table = EventTable(hand_index.astype(np.int32), columns[1].astype(np.int32), columns[2].astype(np.int16),
+                           lookup[columns[3].astype(np.int64)], columns[4].astype(np.int16),
+                           columns[5].astype(np.int8), columns[6].astype(np.int8), columns[7], registry.names,
+                           [hand_key for _, hand_key in hand_rows])
+        player_counters = calculate_counters_vectorized(table, positional)
+        if positional:
+            player_counters = registry.named_positions(player_counters)
+            if filters.get('player') is not None:
+                player_name = registry.names[registry.intern(filters['player'])]
+                player_counters = {key: counters for key, counters in player_counters.items() if key[0] == player_name}
+            return player_counters
+
+        # Summed per session first, as pnl_bb_sq squares each session's result
+        session_pnl = {}
+        for name, session_id, net, net_bb in self.connection.execute(
+                f'SELECT players.name, session_id, SUM(ledger.net), SUM(ledger.net * 100 / session_blinds.big_blind) '
+                f'FROM ledger JOIN players USING (player_id) LEFT JOIN (SELECT session_id, big_blind FROM hands '
+                f'WHERE hand_id IN (SELECT MIN(hand_id) FROM hands GROUP BY session_id)) AS session_blinds '
+                f'USING (session_id) WHERE session_id IN (SELECT DISTINCT session_id FROM hands WHERE {condition}) '
+                f'GROUP BY players.name, session_id', params):
+            key = registry.intern(name), session_id
+            previous_net, previous_net_bb = session_pnl.get(key, (0.0, 0.0))
+            session_pnl[key] = previous_net + net, previous_net_bb + (net_bb or 0)
+        for (player_id, _), (net, net_bb) in session_pnl.items():
+            if player_id not in player_counters:
+                player_counters[player_id] = PlayerCounters()
+            player_counters[player_id].pnl += net
+            player_counters[player_id].pnl_bb += net_bb
+            player_counters[player_id].pnl_bb_sq += net_bb * net_bb
+
+        player_counters = registry.named(player_counters)
+        if filters.get('player') is not None:
+            player_name = registry.names[registry.intern(filters['player'])]
+            player_counters = {player_name: player_counters.get(player_name, PlayerCounters())}
+        return player_counters
+
+    def stats(self, aliases=None, positional=False, **filters):
+        # Displayed stats table over the hands matching filters
+        return counters_to_dataframe(self.player_counters(aliases, positional, **filters)).sort_index()
+
+
+class StatsWatcher:
+    # Keeps the counters of every session in memory and, on each refresh, only folds in the
+    # hands it hasn't seen yet (by hand id) and ledgers that changed, then updates the rows of the
+    # players whose stats changed in the output files, output_basepath plus each format's extension
+    def __init__(self, csv_directory, json_directory, output_basepath, aliases=None, big_blind=None, formats=('csv',)):
+        self.csv_directory = csv_directory
+        self.json_directory = json_directory
+        self.big_blind = big_blind  # For hand logs that don't record one
+        self.output_basepath = output_basepath
+        self.formats = formats
+        self.snapshot = ReportSnapshot()
+        self.accumulators = default_accumulators()
+        self.registry = PlayerRegistry(aliases)
+        self.catalog = SessionCatalog()
+        self.reported_unmatched = set()
+        self.file_stamps = {}  # Path -> (size, mtime) when it was last read
+        self.hand_counters = {}  # Hand log path -> PlayerCounters of the hands seen so far, by player id
+        self.seen_hands = {}  # Hand log path -> ids of the hands already counted
+        self.ledger_counters = {}  # Ledger path -> PlayerCounters holding the PnL, by player id
+
+    def changed(self, filepath):
+        stat = os.stat(filepath)
+        stamp = (stat.st_size, stat.st_mtime_ns)
+        if self.file_stamps.get(filepath) == stamp:
+            return False
+        self.file_stamps[filepath] = stamp
+        return True
+
+    def new_hands(self, json_filepath):
+        seen_hands = self.seen_hands.setdefault(json_filepath, set())
+        for hand in iter_hands(json_filepath):
+            hand_id = hand.get('id', hand.get('number'))
+            if hand_id not in seen_hands:
+                seen_hands.add(hand_id)
+                yield hand
+
+    def refresh(self):
+        # Update the counters from new hands and ledgers. Returns True if anything changed. The
+        # hands of a game still being played are counted before its ledger is downloaded, and its
+        # PnL is added once the ledger turns up and is paired with the hand log.
+        updated = False
+        sessions, unmatched = self.catalog.scan(self.csv_directory, self.json_directory)
+        pending_hand_logs = [filepath for filepath in unmatched if filepath.endswith('.json')]
+        for filepath in set(unmatched) - self.reported_unmatched:
+            if filepath in pending_hand_logs:
+                print(f'No ledger for {filepath} yet, counting its hands without PnL', file=sys.stderr)
+            else:
+                print(f'Skipping {filepath}: no matching hand log', file=sys.stderr)
+        self.reported_unmatched = set(unmatched)
+
+        changed_ledgers = {}
+        pairs = [(session.json_filepath, session.csv_filepath) for session in sessions]
+        for json_filepath, csv_filepath in pairs + [(json_filepath, None) for json_filepath in pending_hand_logs]:
+            if self.changed(json_filepath):
+                run_stats(self.new_hands(json_filepath), self.accumulators, self.registry,
+                          self.hand_counters.setdefault(json_filepath, {}))
+                updated = True
+            if csv_filepath is not None and self.changed(csv_filepath):
+                changed_ledgers[csv_filepath] = self.catalog.files[json_filepath]['big_blind'] or self.big_blind
+
+        for csv_filepath, pnl_stats in calculate_pnl_batch(changed_ledgers).items():
+            self.ledger_counters[csv_filepath] = add_ledger_pnl({}, self.registry, pnl_stats,
+                                                                changed_ledgers[csv_filepath])
+            updated = True
+        return updated
+
+    def overall_counters(self):
+        session_stats_list = list(self.hand_counters.values()) + list(self.ledger_counters.values())
+        return self.registry.named(merge_session_stats(session_stats_list))
+
+    def overall_stats(self):
+        return counters_to_dataframe(self.overall_counters()).sort_index()
+
+    def write(self):
+        return write_report(self.overall_counters(), self.output_basepath, self.formats, self.snapshot)
+
+    def run(self, interval=5.0):
+        # Refresh every interval seconds until interrupted
+        try:
+            while True:
+                if self.refresh():
+                    print(f'Updated {", ".join(self.write())} at {time.strftime("%H:%M:%S")}')
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            pass
+
+
+# Columns of the rolling window tables. Windows over hands have no BB/100, as PnL only comes per session.
+ROLLING_COLUMNS = ['hands_played', 'VPIP', 'PFR', 'Agg', 'BB/100 Hands']
+ROLLING_HAND_COLUMNS = ['hands_played', 'VPIP', 'PFR', 'Agg']
+
+
+def week_label(timestamp):
+    # ISO week of an epoch timestamp, e.g. '2023-W32'
+    if timestamp is None:
+        return 'unknown'
+    year, week, _ = datetime.fromtimestamp(timestamp, timezone.utc).isocalendar()
+    return f'{year}-W{week:02d}'
+
+
+class RingCounters:
+    # Running total of the last size PlayerCounters pushed. Each push drops the oldest entry from
+    # the total, so keeping a window up to date costs the same however many have been pushed.
+    def __init__(self, size):
+        self.entries = deque(maxlen=size)
+        self.total = PlayerCounters()
+
+    def push(self, counters):
+        if len(self.entries) == self.entries.maxlen:
+            self.total -= self.entries[0]
+        self.entries.append(counters)
+        self.total += counters
+
+
+class RollingStats:
+    # Per-player stats over their last hands_window hands and last sessions_window sessions, plus
+    # totals per week. Sessions are applied once each, in the order they started; save() and
+    # load() keep the state between runs so only new sessions have to be read.
+    def __init__(self, hands_window=100, sessions_window=10, aliases=None):
+        if hands_window < 1 or sessions_window < 1:
+            raise ValueError('Rolling windows have to hold at least one hand and one session')
+        self.hands_window = hands_window
+        self.sessions_window = sessions_window
+        self.aliases = aliases or {}
+        self.registry = PlayerRegistry(aliases)
+        self.accumulators = default_accumulators()
+        self.hands = {}  # Player name -> RingCounters of their last hands
+        self.sessions = {}  # Player name -> RingCounters of their last sessions
+        self.weeks = {}  # (player name, week) -> PlayerCounters
+        self.applied = {}  # Hand log path -> digest of the session when it was applied
+        self.latest = None  # Start time of the newest session applied
+
+    def settings(self):
+        return {'hands_window': self.hands_window, 'sessions_window': self.sessions_window, 'aliases': self.aliases}
+
+    @staticmethod
+    def push(rings, player_name, size, counters):
+        ring = rings.get(player_name)
+        if ring is None:
+            ring = rings[player_name] = RingCounters(size)
+        ring.push(counters)
+
+    def add_session(self, json_filepath, csv_filepath, started_at=None, big_blind=None, digest=None):
+        # Per-hand counters of every player, pushed in the order the hands were played
+        hand_counters = [(parse_timestamp(hand.get('startedAt')) or 0,
+                          self.registry.named(run_stats([hand], self.accumulators, self.registry)))
+                         for hand in iter_hands(json_filepath)]
+        hand_counters.sort(key=lambda item: item[0])
+
+        session_stats = [player_counters for _, player_counters in hand_counters]
+        for player_counters in session_stats:
+            for player_name, counters in player_counters.items():
+                self.push(self.hands, player_name, self.hands_window, counters)
+        if big_blind is None:
+            big_blind = hand_log_big_blind(json_filepath)
+        session_stats.append(self.registry.named(add_ledger_pnl({}, self.registry, calculate_pnl(csv_filepath),
+                                                                big_blind)))
+
+        week = week_label(started_at)
+        for player_name, counters in merge_session_stats(session_stats).items():
+            self.push(self.sessions, player_name, self.sessions_window, counters)
+            if (player_name, week) in self.weeks:
+                self.weeks[player_name, week] += counters
+            else:
+                self.weeks[player_name, week] = PlayerCounters(counters.as_list())
+
+        self.applied[json_filepath] = digest
+        if started_at is not None and (self.latest is None or started_at > self.latest):
+            self.latest = started_at
+
+    def last_hands(self):
+        rows = counters_to_rows({player_name: ring.total for player_name, ring in self.hands.items()})
+        return pd.DataFrame.from_dict(rows, orient='index', columns=ROLLING_HAND_COLUMNS).sort_index()
+
+    def last_sessions(self):
+        rows = counters_to_rows({player_name: ring.total for player_name, ring in self.sessions.items()})
+        return pd.DataFrame.from_dict(rows, orient='index', columns=ROLLING_COLUMNS).sort_index()
+
+    def weekly(self):
+        df = pd.DataFrame.from_dict(counters_to_rows(self.weeks), orient='index', columns=ROLLING_COLUMNS)
+        if len(df):
+            df.index.names = ['player', 'week']
+        return df.sort_index()
+
+    def save(self, filepath):
+        state = {
+            'settings': self.settings(), 'applied': self.applied, 'latest': self.latest,
+            'hands': {player_name: [counters.as_list() for counters in ring.entries]
+                      for player_name, ring in self.hands.items()},
+            'sessions': {player_name: [counters.as_list() for counters in ring.entries]
+                         for player_name, ring in self.sessions.items()},
+            'weeks': [[player_name, week, counters.as_list()] for (player_name, week), counters in self.weeks.items()],
+            'version': STATS_VERSION,
+        }
+        tmp_filepath = filepath + '.tmp'
+        with open(tmp_filepath, 'w') as file:
+            json.dump(state, file)
+        os.replace(tmp_filepath, filepath)
+
+    @classmethod
+    def load(cls, filepath, hands_window=100, sessions_window=10, aliases=None):
+        # The saved state, or an empty one if there is none or it was kept with other settings
+        rolling = cls(hands_window, sessions_window, aliases)
+        try:
+            with open(filepath, 'r') as file:
+                state = json.load(file)
+        except (OSError, ValueError):
+            return rolling
+        if state.get('version') != STATS_VERSION or state['settings'] != rolling.settings():
+            return rolling
+
+        for rings, size, key in ((rolling.hands, hands_window, 'hands'), (rolling.sessions, sessions_window, 'sessions')):
+            for player_name, entries in state[key].items():
+                for values in entries:
+                    cls.push(rings, player_name, size, PlayerCounters(values))
+        rolling.weeks = {(player_name, week): PlayerCounters(values) for player_name, week, values in state['weeks']}
+        rolling.applied = state['applied']
+        rolling.latest = state['latest']
+        return rolling
+
+
+def update_rolling_stats(csv_directory, json_directory, cache_directory=None, hands_window=100, sessions_window=10,
+                         aliases=None, big_blind=None):
+    # Bring the rolling stats saved in cache_directory up to date, applying only the sessions added
+    # since. They're rebuilt from every session if one that was applied has changed or gone, or a
+    # new one started before the newest applied, as the windows would be out of order. With the
+    # session catalog cached too, only files that changed since the last run are hashed.
+    state_filepath = os.path.join(cache_directory, 'rolling.json') if cache_directory else None
+    rolling = RollingStats(hands_window, sessions_window, aliases)
+    if state_filepath:
+        os.makedirs(cache_directory, exist_ok=True)
+        rolling = RollingStats.load(state_filepath, hands_window, sessions_window, aliases)
+
+    catalog = SessionCatalog(os.path.join(cache_directory, 'sessions.catalog') if cache_directory else None)
+    sessions = list_sessions(csv_directory, json_directory, catalog)
+    sessions.sort(key=lambda session: catalog.files[session[0]]['started_at'] or 0)
+    digests = {json_filepath: f'{catalog.digest(json_filepath)}:{catalog.digest(csv_filepath)}'
+               for json_filepath, csv_filepath in sessions}
+
+    new_sessions = [session for session in sessions if rolling.applied.get(session[0]) != digests[session[0]]]
+    if (set(rolling.applied) - set(digests) or any(
+            json_filepath in rolling.applied
+            or (catalog.files[json_filepath]['started_at'] or 0) < (rolling.latest or 0)
+            for json_filepath, _ in new_sessions)):
+        rolling = RollingStats(hands_window, sessions_window, aliases)
+        new_sessions = sessions
+
+    for json_filepath, csv_filepath in new_sessions:
+        info = catalog.files[json_filepath]
+        rolling.add_session(json_filepath, csv_filepath, info['started_at'], info['big_blind'] or big_blind,
+                            digests[json_filepath])
+
+    if state_filepath:
+        rolling.save(state_filepath)
+    catalog.save()
+    return rolling
+
+
+class HandSample:
+    # Uniform sample of size hands out of every hand in the archive (reservoir sampling, seeded),
+    # kept as each sampled hand's PlayerCounters by player name. Estimates from it take a fraction
+    # of the time of an exact run, with confidence intervals for the sampling error. Sessions are
+    # added once each, and save() and load() keep the sample between runs like RollingStats.
+    def __init__(self, size=5000, seed=0, aliases=None):
+        self.size = size
+        self.seed = seed
+        self.aliases = aliases or {}
+        self.registry = PlayerRegistry(aliases)
+        self.accumulators = default_accumulators()
+        self.rng = random.Random(seed)
+        self.hands = []  # Per sampled hand, player name -> PlayerCounters
+        self.seen = 0  # Hands the sample was drawn from
+        self.applied = {}  # Hand log path -> digest of the hand log when it was added
+
+    def settings(self):
+        return {'size': self.size, 'seed': self.seed, 'aliases': self.aliases}
+
+    def add_session(self, json_filepath, digest=None):
+        # Only the hands that make it into the sample are run through the stats
+        for hand in iter_hands(json_filepath):
+            self.seen += 1
+            slot = len(self.hands)
+            if slot >= self.size:
+                slot = self.rng.randrange(self.seen)
+                if slot >= self.size:
+                    continue
+            hand_counters = self.registry.named(run_stats([hand], self.accumulators, self.registry))
+            if slot == len(self.hands):
+                self.hands.append(hand_counters)
+            else:
+                self.hands[slot] = hand_counters
+        self.applied[json_filepath] = digest
+
+    def estimates(self, z=CONFIDENCE_Z):
+        # {player name: {column: (estimate, sampled count, low, high)}}, the rates as in
+        # counters_to_intervals and hands_played scaled up to the whole archive. PnL comes from
+        # the ledger, per session, so there is no BB/100 estimate.
+        player_estimates = {}
+        n_sampled = len(self.hands)
+        for player_name, counters in merge_session_stats(self.hands).items():
+            estimates = counters_to_intervals(counters, z)
+            del estimates['BB/100 Hands']
+            low, high = wilson_interval(counters.hands_played, n_sampled, z)
+            estimates['hands_played'] = (round(counters.hands_played / n_sampled * self.seen), counters.hands_played,
+                                         round(low / 100 * self.seen), round(high / 100 * self.seen))
+            player_estimates[player_name] = estimates
+        return player_estimates
+
+    def save(self, filepath):
+        version, internal_state, gauss_next = self.rng.getstate()
+        state = {
+            'settings': self.settings(), 'applied': self.applied, 'seen': self.seen,
+            'rng': [version, list(internal_state), gauss_next],
+            'hands': [[[player_name, counters.as_list()] for player_name, counters in hand_counters.items()]
+                      for hand_counters in self.hands],
+            'version': STATS_VERSION,
+        }
+        tmp_filepath = filepath + '.tmp'
+        with open(tmp_filepath, 'w') as file:
+            json.dump(state, file)
+        os.replace(tmp_filepath, filepath)
+
+    @classmethod
+    def load(cls, filepath, size=5000, seed=0, aliases=None):
+        # The saved sample, or an empty one if there is none or it was drawn with other settings
+        sample = cls(size, seed, aliases)
+        try:
+            with open(filepath, 'r') as file:
+                state = json.load(file)
+        except (OSError, ValueError):
+            return sample
+        if state.get('version') != STATS_VERSION or state['settings'] != sample.settings():
+            return sample
+
+        version, internal_state, gauss_next = state['rng']
+        sample.rng.setstate((version, tuple(internal_state), gauss_next))
+        sample.hands = [{player_name: PlayerCounters(values) for player_name, values in hand_counters}
+                        for hand_counters in state['hands']]
+        sample.seen = state['seen']
+        sample.applied = state['applied']
+        return sample
+
+
+def update_hand_sample(csv_directory, json_directory, cache_directory=None, size=5000, seed=0, aliases=None):
+    # Bring the sample saved in cache_directory up to date with the sessions added since. Hands
+    # can't be taken back out of a sample, so it is drawn again from every session if one that
+    # was added has changed or gone. With the session catalog cached too, an up to date sample
+    # is loaded without reading any hand log.
+    state_filepath = os.path.join(cache_directory, 'hand_sample.json') if cache_directory else None
+    sample = HandSample(size, seed, aliases)
+    if state_filepath:
+        os.makedirs(cache_directory, exist_ok=True)
+        sample = HandSample.load(state_filepath, size, seed, aliases)
+
+    catalog = SessionCatalog(os.path.join(cache_directory, 'sessions.catalog') if cache_directory else None)
+    json_filepaths = [json_filepath for json_filepath, _ in list_sessions(csv_directory, json_directory, catalog)]
+    digests = {json_filepath: catalog.digest(json_filepath) for json_filepath in json_filepaths}
+    if any(digests.get(json_filepath) != digest for json_filepath, digest in sample.applied.items()):
+        sample = HandSample(size, seed, aliases)
+
+    new_filepaths = [json_filepath for json_filepath in json_filepaths if json_filepath not in sample.applied]
+    for json_filepath in new_filepaths:
+        sample.add_session(json_filepath, digests[json_filepath])
+    if state_filepath and new_filepaths:
+        sample.save(state_filepath)
+    catalog.save()
+    return sample
 
-                # Track the pre-flop raiser
-                if not flop_seen and action_type == 8:  # Raise before flop
-                    pre_flop_raiser = player_name
 
-                # Track players who called the pre-flop raise
-                if not flop_seen and action_type == 7:  # Call before flop
-                    player_stats[player_name]['called_preflop_raise_count'] += 1
-
-                # Track C-bet
-                if flop_seen and action_type == 8 and player_name == pre_flop_raiser:  # Bet after flop by pre-flop raiser
-                    c_bet_made = True
-
-                # Track fold to C-bet
-                if flop_seen and action_type == 11 and c_bet_made:  # Fold after C-bet
-                    player_stats[player_name]['fold_to_c_bet_count'] += 1
-
-                players_in_hand.add(player_name)
-
-        # Increment the hands played for the players involved
-        for player in players_in_hand:
-            player_stats[player]['hands_played'] += 1
+def calculate_fold_to_three_bet(data):
+    return calculate_stat(data, FoldToThreeBetStat())
 
-    # Calculating final fold to C-bet percentage
-    for player_name, stats in player_stats.items():
-        if stats['called_preflop_raise_count'] > 0:  # Avoid division by zero
-            stats['Fold_to_C_bet'] = round(stats['fold_to_c_bet_count'] / stats['called_preflop_raise_count'] * 100, 2)
-        else:
-            stats['Fold_to_C_bet'] = 0.0
-        del stats['fold_to_c_bet_count']  # Remove the count after calculating the percentage
-        del stats['called_preflop_raise_count']  # Remove the count after calculating the percentage
 
-    return player_stats
+def calculate_fold_to_c_bet(data):
+    return calculate_stat(data, FoldToCBetStat())
 
 def merge_players_stats(df, player1, player2):
     # Check if both players exist in the DataFrame
@@ -487,145 +2591,856 @@ def merge_players_stats(df, player1, player2):
 
 
 def calculate_three_bet(data):
-    player_stats = {}
-
-    for hand in data['hands']:
-        flop_seen = False
-        raise_count = 0
-        players_in_hand = set()  # Players who've played in this hand
-
-        # Create a mapping of seat numbers to player names for this hand
-        seat_to_name = {player['seat']: player['name'].lower() for player in hand['players']}
-
-        for event in hand['events']:
-            payload = event['payload']
-            action_type = payload['type']
-            player_seat = payload.get('seat', None)
-
-            # Mark the flop event
-            if 'turn' in payload and payload['turn'] == 1:  # Flop
-                flop_seen = True
-
-            # Initialize player stats if player_seat exists
-            if player_seat:
-                player_name = seat_to_name[player_seat]
-
-                if player_name not in player_stats:
-                    player_stats[player_name] = {
-                        '3bet_count': 0, 'hands_played': 0
-                    }
-
-                # Track 3-bet
-                if not flop_seen and action_type == 8:  # Raise before flop
-                    raise_count += 1
-
-                if raise_count == 2:  # Second raise is a 3-bet
-                    player_stats[player_name]['3bet_count'] += 1
-                    raise_count = 0  # Reset raise count for next hand
-
-                players_in_hand.add(player_name)
-
-        # Increment the hands played for the players involved
-        for player in players_in_hand:
-            player_stats[player]['hands_played'] += 1
-
-    # Calculating final 3-bet percentage
-    for player_name, stats in player_stats.items():
-        stats['3bet'] = round(stats['3bet_count'] / stats['hands_played'] * 100, 2)
-        del stats['3bet_count']  # Remove the count after calculating the percentage
-
-    return player_stats
+    return calculate_stat(data, ThreeBetStat())
 
 
 def calculate_four_bet(data):
-    player_stats = {}
+    return calculate_stat(data, FourBetStat())
+
+
+def add_ledger_pnl(player_counters, registry, pnl_stats, big_blind):
+    # Add a session's ledger PnL (see calculate_pnl) to counters keyed by player id, also in big
+    # blinds of the session's stakes. calculate_pnl scales the ledger down by 100, which is undone
+    # to compare it with the big blind as written in the hand log.
+    session_pnl = {}
+    for player_name, pnl in pnl_stats.items():
+        player_id = registry.intern(player_name)
+        session_pnl[player_id] = session_pnl.get(player_id, 0.0) + pnl
+    for player_id, pnl in session_pnl.items():
+        if player_id not in player_counters:
+            player_counters[player_id] = PlayerCounters()
+        counters = player_counters[player_id]
+        counters.pnl += pnl
+        if big_blind:
+            pnl_bb = pnl * 100 / big_blind
+            counters.pnl_bb += pnl_bb
+            counters.pnl_bb_sq += pnl_bb * pnl_bb
+    return player_counters
+
+
+def hand_log_big_blind(json_filepath):
+    # Big blind of the first hand of a hand log, or None if it doesn't record one
+    return SessionCatalog().read_hand_log_info(json_filepath)[2]
+
+
+def calculate_session_stats(json_filepath, csv_filepath, vectorized=False, aliases=None, report=None,
+                            positional=False, big_blind=None, matrix=None):
+    # Raw PlayerCounters for one session keyed by player name, cheap to send back from a worker
+    # process. Every stat is computed in a single walk over the hands, streamed from the hand log,
+    # or with array operations over the session's EventTable when vectorized is set. An up to date
+    # binary store of the hand log (see write_session_store) is always preferred over the JSON.
+    # With positional set the counters are keyed by (player name, position) and have no PnL, as
+    # the ledger only records a total per session. big_blind is the session's big blind as
+    # written in the hand log, read from its first hand if not given. Pass an OpponentMatrix as
+    # matrix to also add the session's head-to-head counters to it, keyed by player name, from
+    # the same walk over the hands; the hands are then always streamed, and positional can't be set.
+    registry = PlayerRegistry(aliases)
+    session = os.path.basename(json_filepath)
+
+    with report_stage(report, 'store', session) as store_row:
+        table = load_session_store(json_filepath, registry) if matrix is None else None
+        if table is not None:
+            player_counters = calculate_counters_vectorized(table, positional)
+            store_row['hands'] = len(table.hand_ids)
+            store_row['events'] = len(table)
+
+    if table is None:
+        hands = iter_hands(json_filepath)
+        if report is not None:
+            hands = TimedHands(hands)
+
+        with report_stage(report, 'stats', session) as stats_row:
+            if vectorized and matrix is None:
+                player_counters = calculate_counters_vectorized(load_event_table(hands, registry), positional)
+            elif matrix is not None:
+                session_matrix = OpponentMatrix()
+                player_counters = run_stats(hands, default_accumulators() + [OpponentMatrixStat(session_matrix)],
+                                            registry)
+                matrix += session_matrix.named(registry)
+            else:
+                player_counters = run_stats(hands, default_accumulators(), registry, positional=positional)
+        if report is not None:
+            report.add_parse_stage(hands, stats_row)
+
+    if positional:
+        return registry.named_positions(player_counters)
+
+    with report_stage(report, 'ledger', session):
+        if big_blind is None:
+            big_blind = hand_log_big_blind(json_filepath)
+        add_ledger_pnl(player_counters, registry, calculate_pnl(csv_filepath), big_blind)
+
+    return registry.named(player_counters)
+
+
+def instrumented_session_stats(json_filepath, csv_filepath, vectorized=False, aliases=None, positional=False,
+                               big_blind=None, trace_memory=False):
+    # calculate_session_stats with a RunReport, returning its rows so the parent process can collect them
+    report = RunReport(trace_memory)
+    try:
+        player_counters = calculate_session_stats(json_filepath, csv_filepath, vectorized, aliases, report,
+                                                  positional, big_blind)
+    finally:
+        report.close()
+    return player_counters, report.rows
+
+
+def calculate_session_opponents(json_filepath, csv_filepath, aliases=None, big_blind=None):
+    # A session's counters and OpponentMatrix keyed by player name, to send back from a worker process
+    matrix = OpponentMatrix()
+    player_counters = calculate_session_stats(json_filepath, csv_filepath, aliases=aliases, big_blind=big_blind,
+                                              matrix=matrix)
+    return player_counters, matrix
+
+
+def calculate_overall_opponents(csv_directory, json_directory, big_blind=None, workers=1, aliases=None,
+                                cache_directory=None):
+    # The summed PlayerCounters and OpponentMatrix of every player over the archive, keyed by
+    # player name. With a cache_directory each session's matrix is cached next to its counters,
+    # so only new or changed hand logs are read.
+    catalog = SessionCatalog(os.path.join(cache_directory, 'sessions.catalog') if cache_directory else None)
+    sessions = list_sessions(csv_directory, json_directory, catalog)
+    big_blinds = [catalog.files[json_filepath]['big_blind'] or big_blind for json_filepath, _ in sessions]
+
+    session_results = [None] * len(sessions)
+    cache = StatsCache(cache_directory) if cache_directory else None
+    if cache:
+        cache_keys = [cache.session_key(catalog.digest(json_filepath), catalog.digest(csv_filepath),
+                                        aliases_digest(aliases), big_blind=session_big_blind, opponents=True)
+                      for (json_filepath, csv_filepath), session_big_blind in zip(sessions, big_blinds)]
+        session_results = [cache.get_opponents(key) for key in cache_keys]
+    missing = [i for i, result in enumerate(session_results) if result is None]
+
+    session_function = partial(calculate_session_opponents, aliases=aliases)
+    if len(missing) > 1 and (workers is None or workers > 1):
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(session_function, *sessions[i], big_blind=big_blinds[i]) for i in missing]
+            new_results = [future.result() for future in futures]
+    else:
+        new_results = [session_function(*sessions[i], big_blind=big_blinds[i]) for i in missing]
+    for i, result in zip(missing, new_results):
+        session_results[i] = result
+
+    if cache:
+        for i, (player_counters, session_matrix) in zip(missing, new_results):
+            cache.put(cache_keys[i], player_counters, session_matrix)
+        cache.evict()
+        catalog.save()
+
+    matrix = OpponentMatrix()
+    for _, session_matrix in session_results:
+        matrix += session_matrix
+    return merge_session_stats([player_counters for player_counters, _ in session_results]), matrix
+
+
+def opponents_dataframe(matrix):
+    # One row per (player, opponent) pair that played together
+    rows = {}
+    for player_name, opponent_name, values in matrix.as_list():
+        hands_together, won, won_bb, three_bet, three_bet_chance = values
+        rows[player_name, opponent_name] = {
+            'hands_together': hands_together,
+            'Won': round(won, 2),
+            'BB Won': round(won_bb, 2),
+            '3bet': round(three_bet / three_bet_chance * 100, 2) if three_bet_chance else 0.0,
+            '3bet_chances': three_bet_chance,
+        }
+    # The index is built explicitly so an empty matrix still gives a (player, opponent) index
+    index = pd.MultiIndex.from_tuples(list(rows), names=['player', 'opponent'])
+    df = pd.DataFrame(list(rows.values()), index=index,
+                      columns=['hands_together', 'Won', 'BB Won', '3bet', '3bet_chances'])
+    return df.sort_index()
+
+
+def main(json_filepath, csv_filepath, aliases=None):
+    return counters_to_dataframe(calculate_session_stats(json_filepath, csv_filepath, aliases=aliases))
+
+# All-in EV. Cards are numbered rank * 4 + suit, ranks as in CARD_RANKS. A hand value is an int
+# that is higher for better hands: the category (HIGH_CARD .. STRAIGHT_FLUSH) in the top bits,
+# then the ranks that break ties, 4 bits each.
+CARD_RANKS = '23456789TJQKA'
+CARD_SUITS = 'cdhs'
+HIGH_CARD, PAIR, TWO_PAIR, TRIPS, STRAIGHT, FLUSH, FULL_HOUSE, QUADS, STRAIGHT_FLUSH = range(9)
+RANK_KEYS = [5 ** (card >> 2) for card in range(52)]  # Summed, a base-5 count of each rank
+
+_hand_tables = None
+
+
+def parse_card(card):
+    # 'Th' -> card number
+    return CARD_RANKS.index(card[0].upper()) * 4 + CARD_SUITS.index(card[1].lower())
+
+
+def straight_high(rank_mask):
+    # Highest rank of a straight in a 13-bit mask of ranks, or -1. The wheel counts as 5 high.
+    for high in range(12, 3, -1):
+        if rank_mask >> (high - 4) & 0b11111 == 0b11111:
+            return high
+    if rank_mask & 0b1000000001111 == 0b1000000001111:
+        return 3
+    return -1
+
+
+def pack_value(category, ranks):
+    value = category
+    for rank in ranks[:5]:
+        value = value << 4 | rank
+    return value << 4 * (5 - min(len(ranks), 5))
+
+
+def rank_counts_value(counts):
+    # Value of the best non-flush five cards out of cards with these rank counts
+    ranks_by_count = sorted(((count, rank) for rank, count in enumerate(counts) if count), reverse=True)
+    ranks = [rank for _, rank in ranks_by_count]
+    high = straight_high(sum(1 << rank for rank in ranks))
+    top_count = ranks_by_count[0][0]
+    second_count = ranks_by_count[1][0] if len(ranks_by_count) > 1 else 0
+    if top_count == 4:
+        return pack_value(QUADS, [ranks[0], max(ranks[1:])])
+    if top_count == 3 and second_count >= 2:
+        return pack_value(FULL_HOUSE, ranks[:2])
+    if high >= 0:
+        return pack_value(STRAIGHT, [high])
+    if top_count == 3:
+        return pack_value(TRIPS, ranks[:1] + sorted(ranks[1:], reverse=True)[:2])
+    if top_count == 2 and second_count == 2:
+        pairs = [rank for count, rank in ranks_by_count if count == 2]
+        return pack_value(TWO_PAIR, pairs[:2] + [max(ranks[2:])])
+    if top_count == 2:
+        return pack_value(PAIR, ranks[:1] + ranks[1:4])
+    return pack_value(HIGH_CARD, ranks[:5])
+
+
+def hand_tables():
+    # Lookup tables for seven-card hands, built once per process:
+    # - rank_key_values, the non-flush value of every multiset of 7 ranks keyed by the sum of its RANK_KEYS
+    # - flush_values, the value of every mask of 5 to 7 ranks of one suit
+    # Seven cards holding a flush can't also make a full house or quads, so a flush settles the hand.
+    global _hand_tables
+    if _hand_tables is None:
+        rank_key_values = {}
+        counts = [0] * 13
+
+        def add_ranks(rank, remaining):
+            if rank == 13:
+                if not remaining:
+                    rank_key_values[sum(count * 5 ** r for r, count in enumerate(counts))] = rank_counts_value(counts)
+                return
+            for count in range(min(4, remaining) + 1):
+                counts[rank] = count
+                add_ranks(rank + 1, remaining - count)
+            counts[rank] = 0
+
+        add_ranks(0, 7)
+        flush_values = {}
+        for rank_mask in range(1 << 13):
+            if bin(rank_mask).count('1') >= 5:
+                high = straight_high(rank_mask)
+                if high >= 0:
+                    flush_values[rank_mask] = pack_value(STRAIGHT_FLUSH, [high])
+                else:
+                    flush_values[rank_mask] = pack_value(FLUSH, [rank for rank in range(12, -1, -1)
+                                                                 if rank_mask >> rank & 1][:5])
+        _hand_tables = rank_key_values, flush_values
+    return _hand_tables
+
+
+def hand_value(cards):
+    # Value of the best five of seven cards
+    rank_key_values, flush_values = hand_tables()
+    suit_masks = [0, 0, 0, 0]
+    for card in cards:
+        suit_masks[card & 3] |= 1 << (card >> 2)
+    for suit_mask in suit_masks:
+        if suit_mask in flush_values:
+            return flush_values[suit_mask]
+    return rank_key_values[sum(RANK_KEYS[card] for card in cards)]
+
+
+def expected_winnings(hole_cards, board, pots, rng=None, max_runouts=5000, samples=5000):
+    # Each player's expected share of the pots given their hole cards and the board dealt so far.
+    # pots is a list of (amount, indexes of the players who can win it). Every runout of the
+    # board is dealt when there are at most max_runouts of them, otherwise samples random runouts
+    # are drawn from rng, a random.Random. Ties split the pot.
+    rank_key_values, flush_values = hand_tables()
+    dealt = set(board).union(*hole_cards)
+    deck = [card for card in range(52) if card not in dealt]
+    missing = 5 - len(board)
+    if comb(len(deck), missing) <= max_runouts:
+        runouts = combinations(deck, missing)
+    else:
+        rng = rng or random.Random(0)
+        runouts = (rng.sample(deck, missing) for _ in range(samples))
+
+    hole_keys = [sum(RANK_KEYS[card] for card in cards) for cards in hole_cards]
+    hole_masks = [[sum(1 << (card >> 2) for card in cards if card & 3 == suit) for suit in range(4)]
+                  for cards in hole_cards]
+    players = range(len(hole_cards))
+    winnings = [0.0] * len(hole_cards)
+    n_runouts = 0
+    for runout in runouts:
+        n_runouts += 1
+        full_board = board + list(runout)
+        board_key = sum(RANK_KEYS[card] for card in full_board)
+        board_masks = [0, 0, 0, 0]
+        for card in full_board:
+            board_masks[card & 3] |= 1 << (card >> 2)
+        flush_suits = [suit for suit in range(4) if bin(board_masks[suit]).count('1') >= 3]
+
+        values = [rank_key_values[hole_keys[player] + board_key] for player in players]
+        for suit in flush_suits:
+            for player in players:
+                flush_value = flush_values.get(board_masks[suit] | hole_masks[player][suit])
+                if flush_value is not None:
+                    values[player] = flush_value
+
+        for amount, eligible in pots:
+            best = max(values[player] for player in eligible)
+            winners = [player for player in eligible if values[player] == best]
+            for player in winners:
+                winnings[player] += amount / len(winners)
+    return [total / n_runouts for total in winnings]
+
+
+def matched_contributions(contributions):
+    # What each player put in once chips nobody matched are returned, so no one puts in more
+    # than the second biggest contribution
+    matched = sorted(contributions.values())[-2] if len(contributions) > 1 else 0
+    return {player: min(amount, matched) for player, amount in contributions.items()}
+
+
+def all_in_pots(contributions, live_players):
+    # Split what each player put in into the main pot and side pots, as (amount, live players who
+    # can win it), also returning the matched contributions
+    contributions = matched_contributions(contributions)
+    pots = []
+    previous_level = 0
+    for level in sorted({contributions[player] for player in live_players}):
+        amount = sum(min(contribution, level) - min(contribution, previous_level)
+                     for contribution in contributions.values())
+        eligible = [player for player in live_players if contributions[player] >= level]
+        if amount:
+            pots.append((amount, eligible))
+        previous_level = level
+    return pots, contributions
+
+
+def score_all_in_hand(hand, registry, rng=None, max_runouts=5000, samples=5000):
+    # For a hold'em hand where the money went in before the river and every player left showed
+    # their cards, return {player id: (chips won, expected chips won, chips put in)} for those
+    # players. None for any other hand, or one run more than once.
+    if hand.get('gameType', 'th') != 'th':
+        return None
+    seat_to_player = {player['seat']: registry.intern(player['name']) for player in hand['players']}
+    street = 0
+    last_action_street = 0
+    board = {}
+    street_bets = {}
+    contributions = {}
+    folded = set()
+    shown = {}
+    won = {}
+    for event in hand['events']:
+        payload = event['payload']
+        action_type = payload['type']
+        player_id = seat_to_player.get(payload.get('seat'))
+        if action_type == BOARD:
+            if payload.get('run', 1) != 1:
+                return None
+            for player, amount in street_bets.items():
+                contributions[player] = contributions.get(player, 0) + amount
+            street_bets = {}
+            street = payload['turn']
+            board[street] = [parse_card(card) for card in payload['cards']]
+        elif player_id is None:
+            continue
+        elif action_type in (CALL, RAISE, SMALL_BLIND, BIG_BLIND):
+            # Bets and blinds carry the player's total for the street
+            street_bets[player_id] = max(street_bets.get(player_id, 0), payload['value'])
+            if action_type in (CALL, RAISE):
+                last_action_street = street
+        elif action_type in (CHECK, FOLD):
+            if action_type == FOLD:
+                folded.add(player_id)
+            last_action_street = street
+        elif action_type == POT_WINNER:
+            won[player_id] = won.get(player_id, 0) + payload['value']
+        elif action_type in (WIN, SHOWDOWN) and payload.get('cards'):
+            shown[player_id] = [parse_card(card) for card in payload['cards']]
+    for player, amount in street_bets.items():
+        contributions[player] = contributions.get(player, 0) + amount
+
+    live_players = [player for player in contributions if player not in folded]
+    if (street != 3 or last_action_street == 3 or len(live_players) < 2
+            or any(len(shown.get(player, ())) != 2 for player in live_players)):
+        return None
+
+    pots, contributions = all_in_pots(contributions, live_players)
+    # Antes and rake only show in what was paid out; they go to or come out of the main pot
+    difference = sum(won.values()) - sum(amount for amount, _ in pots)
+    pots[0] = (pots[0][0] + difference, pots[0][1])
+    known_board = [card for turn in sorted(board) if turn <= last_action_street for card in board[turn]]
+    eligible_pots = [(amount, [live_players.index(player) for player in eligible]) for amount, eligible in pots]
+    expected = expected_winnings([shown[player] for player in live_players], known_board, eligible_pots, rng,
+                                 max_runouts, samples)
+    return {player: (won.get(player, 0), expected[i], contributions[player]) for i, player in enumerate(live_players)}
+
+
+# Per-player all-in EV counters: the all-in hands scored, and what the player netted in them,
+# actually and in expectation, in the ledger's PnL units and in big blinds
+ALL_IN_FIELDS = ('all_in_hands', 'net', 'ev_net', 'net_bb', 'ev_net_bb')
+
+
+def calculate_session_all_in_ev(json_filepath, aliases=None, seed=0, big_blind=None, max_runouts=5000,
+                                samples=5000):
+    # All-in EV counters of one session keyed by player name. Each hand draws its sampled runouts
+    # from a generator seeded with seed and the hand id, so results don't depend on how sessions
+    # are spread over worker processes.
+    registry = PlayerRegistry(aliases)
+    results = {}
+    for hand in iter_hands(json_filepath):
+        hand_id = hand.get('id', hand.get('number'))
+        scores = score_all_in_hand(hand, registry, random.Random(f'{seed}:{hand_id}'), max_runouts, samples)
+        if scores is None:
+            continue
+        hand_big_blind = hand.get('bigBlind') or big_blind
+        for player_id, (chips_won, expected_won, put_in) in scores.items():
+            counters = results.setdefault(player_id, [0] * len(ALL_IN_FIELDS))
+            counters[0] += 1
+            # Same scale as calculate_pnl, which divides the ledger by 100
+            counters[1] += (chips_won - put_in) / 100
+            counters[2] += (expected_won - put_in) / 100
+            if hand_big_blind:
+                counters[3] += (chips_won - put_in) / hand_big_blind
+                counters[4] += (expected_won - put_in) / hand_big_blind
+    return registry.named(results)
+
+
+def calculate_all_in_ev(csv_directory, json_directory, workers=1, aliases=None, seed=0, big_blind=None,
+                        max_runouts=5000, samples=5000):
+    # All-in EV counters over the archive keyed by player name, scored a session per worker process
+    json_filepaths = [json_filepath for json_filepath, _ in list_sessions(csv_directory, json_directory)]
+    session_function = partial(calculate_session_all_in_ev, aliases=aliases, seed=seed, big_blind=big_blind,
+                               max_runouts=max_runouts, samples=samples)
+    if len(json_filepaths) > 1 and (workers is None or workers > 1):
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            session_results = list(executor.map(session_function, json_filepaths))
+    else:
+        session_results = [session_function(json_filepath) for json_filepath in json_filepaths]
+
+    results = {}
+    for session_result in session_results:
+        for player_name, counters in session_result.items():
+            totals = results.setdefault(player_name, [0] * len(ALL_IN_FIELDS))
+            for i, value in enumerate(counters):
+                totals[i] += value
+    return results
+
+
+def all_in_ev_dataframe(all_in_results, player_counters):
+    # Ledger results next to the all-in EV adjusted ones: EV PnL swaps what each player actually
+    # won in all-in hands for what they were expected to win when the money went in
+    rows = {}
+    for player_name, counters in player_counters.items():
+        all_in_hands, net, ev_net, net_bb, ev_net_bb = all_in_results.get(player_name, [0] * len(ALL_IN_FIELDS))
+        hands_played = counters.hands_played or 1  # Avoid division by zero
+        rows[player_name] = {
+            'hands_played': counters.hands_played,
+            'all_in_hands': all_in_hands,
+            'All-in Net': round(net, 2),
+            'All-in EV Net': round(ev_net, 2),
+            'PnL': round(counters.pnl, 2),
+            'EV PnL': round(counters.pnl - net + ev_net, 2),
+            'BB/100 Hands': round(counters.pnl_bb / hands_played * 100, 2),
+            'EV BB/100': round((counters.pnl_bb - net_bb + ev_net_bb) / hands_played * 100, 2),
+        }
+    return pd.DataFrame.from_dict(rows, orient='index').sort_index()
+
+
+GAME_ID_PATTERN = re.compile(r'[A-Za-z0-9_-]+')
+MAX_UPLOAD_BYTES = 256 * 2 ** 20
+
+
+class StatsService:
+    # Warm state of the stats server: the overall counters by player name, loaded once through the
+    # stats cache and kept up to date as sessions are uploaded, with the displayed rows derived from
+    # them. Updates swap in a new (counters, rows) pair, so queries read it without locking.
+    def __init__(self, csv_directory, json_directory, cache_directory=None, aliases=None, big_blind=None, workers=1):
+        self.csv_directory = csv_directory
+        self.json_directory = json_directory
+        self.cache_directory = cache_directory
+        self.aliases = aliases or {}
+        self.big_blind = big_blind  # For hand logs that don't record one
+        self.workers = workers
+        self.update_lock = threading.Lock()
+        self.state = ({}, {})
+        self.reload()
+
+    def set_counters(self, player_counters):
+        self.state = (player_counters, counters_to_rows(player_counters))
+
+    def reload(self):
+        # Pick up every change to the archive; only sessions missing from the stats cache are read
+        with self.update_lock:
+            self.set_counters(calculate_overall_counters(self.csv_directory, self.json_directory, self.big_blind,
+                                                         self.workers, self.cache_directory, aliases=self.aliases))
+
+    def player_name(self, name):
+        player_name = name.lower()
+        return self.aliases.get(player_name, player_name)
+
+    def players(self):
+        player_counters, _ = self.state
+        return sorted(player_counters)
+
+    def player(self, name):
+        # Displayed stats of one player, with their sample sizes and confidence intervals, or None
+        player_counters, rows = self.state
+        player_name = self.player_name(name)
+        if player_name not in player_counters:
+            return None
+        intervals = counters_to_intervals(player_counters[player_name])
+        return {'player': player_name, 'stats': rows[player_name],
+                'intervals': {column: dict(zip(INTERVAL_COLUMNS, values)) for column, values in intervals.items()}}
+
+    def leaderboard(self, stat='BB/100 Hands', limit=20, min_hands=0, ascending=False):
+        # The players with the highest (or lowest) value of a SESSION_COLUMNS stat
+        if stat not in SESSION_COLUMNS:
+            raise ValueError(f'Unknown stat {stat!r}')
+        _, rows = self.state
+        ranked = sorted((row for row in rows.items() if row[1]['hands_played'] >= min_hands),
+                        key=lambda row: row[1][stat], reverse=not ascending)
+        return [{'player': player_name, stat: row[stat], 'hands_played': row['hands_played']}
+                for player_name, row in ranked[:limit]]
+
+    def add_session(self, hand_log, ledger, game_id=None):
+        # Save an uploaded hand log (a pokernow export) and ledger (its CSV text) into the archive
+        # and add the session to the counters. Nothing reaches the archive unless every hand passes
+        # validate_hand, the ledger parses and the session's stats can be computed from the files;
+        # a bad upload would otherwise break every later scan. A new session is added on top of
+        # the counters in memory; one that replaces a session already there goes through reload().
+        game_id = game_id or (hand_log.get('gameId') if isinstance(hand_log, dict) else None)
+        if not isinstance(game_id, str) or not GAME_ID_PATTERN.fullmatch(game_id):
+            raise ValueError('A game id of letters, digits, - and _ is needed, in game_id or the hand log gameId')
+        if not isinstance(hand_log, dict) or not isinstance(hand_log.get('hands'), list):
+            raise ValueError('hand_log has to be a pokernow hand log export with a hands list')
+        if not isinstance(ledger, str):
+            raise ValueError('ledger has to be the text of the ledger CSV')
+        for index, hand in enumerate(hand_log['hands']):
+            problem = validate_hand(hand)
+            if problem is not None:
+                raise ValueError(f'Hand {index} of the hand log: {problem}')
+        try:
+            read_pnl(io.StringIO(ledger, newline=''))
+        except (ValueError, csv.Error) as error:
+            raise ValueError(f'Unreadable ledger: {error}')
+
+        json_filepath = os.path.join(self.json_directory, f'poker_now_log_{game_id}.json')
+        csv_filepath = os.path.join(self.csv_directory, f'ledger_{game_id}.csv')
+        tmp_json_filepath, tmp_csv_filepath = json_filepath + '.tmp', csv_filepath + '.tmp'
+        with self.update_lock:
+            replacing = os.path.exists(json_filepath) or os.path.exists(csv_filepath)
+            try:
+                with open(tmp_json_filepath, 'w') as file:
+                    json.dump(hand_log, file)
+                with open(tmp_csv_filepath, 'w', newline='') as file:
+                    file.write(ledger)
+                session_stats = calculate_session_stats(
+                    tmp_json_filepath, tmp_csv_filepath, aliases=self.aliases,
+                    big_blind=hand_log_big_blind(tmp_json_filepath) or self.big_blind)
+                os.replace(tmp_json_filepath, json_filepath)
+                os.replace(tmp_csv_filepath, csv_filepath)
+            finally:
+                for tmp_filepath in (tmp_json_filepath, tmp_csv_filepath):
+                    if os.path.exists(tmp_filepath):
+                        os.remove(tmp_filepath)
+
+            if not replacing:
+                player_counters, _ = self.state
+                self.set_counters(merge_session_stats([player_counters, session_stats]))
+        if replacing:
+            self.reload()
+        return {'game_id': game_id, 'hands': len(hand_log['hands']), 'replaced': replacing}
+
+
+class StatsRequestHandler(BaseHTTPRequestHandler):
+    # JSON API over the server's StatsService:
+    #   GET /players                 names of every player
+    #   GET /players/<name>          stats of one player
+    #   GET /leaderboard?stat=VPIP&limit=20&min_hands=100&order=asc
+    #   POST /sessions               {"hand_log": <pokernow export>, "ledger": "<ledger CSV>", "game_id": "..."}
+    #   POST /reload                 pick up files put in the archive directories by other means
+    server_version = 'getStats'
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def route(self):
+        url = urlsplit(self.path)
+        return [unquote(part) for part in url.path.strip('/').split('/')], parse_qs(url.query)
+
+    def do_GET(self):
+        service = self.server.service
+        parts, query = self.route()
+        try:
+            if parts == ['players']:
+                self.send_json(200, service.players())
+            elif len(parts) == 2 and parts[0] == 'players':
+                player = service.player(parts[1])
+                if player is None:
+                    self.send_json(404, {'error': f'No hands or ledger entries for {parts[1]}'})
+                else:
+                    self.send_json(200, player)
+            elif parts == ['leaderboard']:
+                self.send_json(200, service.leaderboard(query.get('stat', ['BB/100 Hands'])[0],
+                                                        int(query.get('limit', ['20'])[0]),
+                                                        int(query.get('min_hands', ['0'])[0]),
+                                                        query.get('order', ['desc'])[0] == 'asc'))
+            else:
+                self.send_json(404, {'error': f'Unknown path {self.path}'})
+        except ValueError as error:
+            self.send_json(400, {'error': str(error)})
+        except Exception as error:
+            self.send_json(500, {'error': f'{type(error).__name__}: {error}'})
+
+    def do_POST(self):
+        service = self.server.service
+        parts, _ = self.route()
+        try:
+            if parts == ['reload']:
+                service.reload()
+                self.send_json(200, {'players': len(service.players())})
+            elif parts == ['sessions']:
+                length = int(self.headers.get('Content-Length') or 0)
+                if length > MAX_UPLOAD_BYTES:
+                    self.send_json(413, {'error': f'Uploads are limited to {MAX_UPLOAD_BYTES} bytes'})
+                    return
+                body = json.loads(self.rfile.read(length) or b'{}')
+                if not isinstance(body, dict):
+                    raise ValueError('Expected a JSON object')
+                self.send_json(201, service.add_session(body.get('hand_log'), body.get('ledger'),
+                                                        body.get('game_id')))
+            else:
+                self.send_json(404, {'error': f'Unknown path {self.path}'})
+        except ValueError as error:  # Includes JSONDecodeError
+            self.send_json(400, {'error': str(error)})
+        except Exception as error:
+            self.send_json(500, {'error': f'{type(error).__name__}: {error}'})
+
+
+def serve(service, host='127.0.0.1', port=8765):
+    # Answer StatsRequestHandler queries from service until interrupted, a thread per request
+    server = ThreadingHTTPServer((host, port), StatsRequestHandler)
+    server.service = service
+    print(f'Serving stats on http://{host}:{server.server_port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f'{value} is not a whole number of at least 1')
+    return number
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Player stats from pokernow hand logs and ledgers')
+    parser.add_argument('--csv-dir', default='Poker Hands/CSV Data', help='directory of the ledgers')
+    parser.add_argument('--json-dir', default='Poker Hands/JSON Data', help='directory of the hand logs')
+    parser.add_argument('--cache-dir', default='Poker Hands/Stats Cache', help='where session stats are cached')
+    parser.add_argument('--aliases', default='Poker Hands/aliases.json', help='players who play under several names')
+    parser.add_argument('--big-blind', type=float, help="big blind for hand logs that don't record one")
+    parser.set_defaults(command='report', positions=False, profile=False, profile_memory=False, workers=os.cpu_count(), formats=None,
+                        intervals=False, approximate=False, sample_size=5000)
+    commands = parser.add_subparsers(dest='command')
+
+    report = commands.add_parser('report', help='stats of every player, also written to CSV Output (the default)')
+    report.add_argument('--positions', action='store_true', help='break every stat down by table position')
+    report.add_argument('--workers', type=int, default=os.cpu_count(), help='worker processes for new sessions')
+    report.add_argument('--profile', action='store_true', help='also write a timing report and a cProfile dump')
+    report.add_argument('--profile-memory', action='store_true',
+                        help='with --profile, also trace the memory each stage allocates (slows the run down)')
+    report.add_argument('--intervals', action='store_true',
+                        help='also write the sample size and 95%% confidence interval of each stat')
+    report.add_argument('--approximate', action='store_true',
+                        help='estimate the stats from a sample of hands instead, with their error bounds')
+    report.add_argument('--sample-size', type=int, default=5000, help='hands in the sample for --approximate')
+    report.add_argument('--format', dest='formats', action='append', choices=sorted(WRITERS),
+                        help='output format, can be repeated (default csv)')
+
+    player = commands.add_parser('player', help="one player's stats, without building the full table")
+    player.add_argument('name')
+    player.add_argument('--approximate', action='store_true', help='estimate from a sample of hands, see report')
+    player.add_argument('--sample-size', type=int, default=5000, help='hands in the sample for --approximate')
+
+    ingest = commands.add_parser('ingest', help='load new sessions into the SQLite hand index')
+    ingest.add_argument('--database', default='Poker Hands/hands.sqlite')
+
+    rolling = commands.add_parser('rolling', help="stats over each player's last hands and sessions, and per week")
+    rolling.add_argument('--hands', type=positive_int, default=100, help='hands in the hand window')
+    rolling.add_argument('--sessions', type=positive_int, default=10, help='sessions in the session window')
+
+    all_in = commands.add_parser('allin', help='PnL with all-in hands scored by equity instead of the runout')
+    all_in.add_argument('--workers', type=int, default=os.cpu_count(), help='worker processes')
+    all_in.add_argument('--seed', type=int, default=0, help='seed of the sampled runouts')
+    all_in.add_argument('--samples', type=int, default=5000,
+                        help='runouts sampled when there are too many to deal them all, e.g. all in preflop')
+
+    opponents = commands.add_parser('opponents', help='head-to-head results and 3-bets between every pair of players')
+    opponents.add_argument('--player', help="only show this player's opponents")
+    opponents.add_argument('--workers', type=int, default=os.cpu_count(), help='worker processes')
+
+    serve_parser = commands.add_parser('serve', help='answer player and leaderboard queries as JSON over HTTP')
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=8765)
+    serve_parser.add_argument('--workers', type=int, default=os.cpu_count(), help='worker processes for the first load')
+
+    watch = commands.add_parser('watch', help='keep the output CSV up to date as new hands are downloaded')
+    watch.add_argument('--interval', type=float, default=5.0, help='seconds between checks')
+    watch.add_argument('--format', dest='formats', action='append', choices=sorted(WRITERS),
+                       help='output format, can be repeated (default csv)')
+
+    commands.add_parser('quarantine', help='list the hands set aside because they failed validation')
+    commands.add_parser('convert', help='write a binary store next to each hand log for faster reloads')
+    commands.add_parser('invalidate-cache', help='clear the cached session stats')
+    return parser.parse_args(argv)
+
+
+def cli(argv=None):
+    args = parse_args(argv)
+    aliases = load_aliases(args.aliases)
+    formats = args.formats or ['csv']
+
+    if args.command == 'invalidate-cache':
+        print(f'Removed {StatsCache(args.cache_dir).invalidate()} cached sessions')
+
+    elif args.command == 'ingest':
+        database = HandDatabase(args.database)
+        print(f'Ingested {database.ingest(args.csv_dir, args.json_dir)} new sessions')
+        database.close()
+
+    elif args.command == 'quarantine':
+        rows = quarantine_report(args.json_dir)
+        with open('Poker Hands/CSV Output/quarantine_report.csv', 'w', newline='') as file:
+            writer = csv.DictWriter(file, fieldnames=['file', 'index', 'id', 'reason'])
+            writer.writeheader()
+            writer.writerows(rows)
+        for row in rows:
+            print(f"{row['file']} hand {row['index']} ({row['id']}): {row['reason']}")
+        print(f'{len(rows)} quarantined hands')
+
+    elif args.command == 'convert':
+        for json_filepath, _ in list_sessions(args.csv_dir, args.json_dir):
+            print(f'Wrote {write_session_store(json_filepath)}')
+
+    elif args.command == 'serve':
+        serve(StatsService(args.csv_dir, args.json_dir, args.cache_dir, aliases, args.big_blind, args.workers),
+              args.host, args.port)
+
+    elif args.command == 'watch':
+        StatsWatcher(args.csv_dir, args.json_dir, 'Poker Hands/CSV Output/overall_player_stats',
+                     aliases=aliases, big_blind=args.big_blind, formats=formats).run(args.interval)
+
+    elif args.command == 'rolling':
+        rolling = update_rolling_stats(args.csv_dir, args.json_dir, args.cache_dir, args.hands, args.sessions,
+                                       aliases, args.big_blind)
+        for title, df, filepath in ((f'Last {args.hands} hands', rolling.last_hands(), 'rolling_hands_stats.csv'),
+                                    (f'Last {args.sessions} sessions', rolling.last_sessions(),
+                                     'rolling_sessions_stats.csv'),
+                                    ('Per week', rolling.weekly(), 'weekly_player_stats.csv')):
+            CSVWriter().write(df, os.path.join('Poker Hands/CSV Output', filepath))
+            print(title)
+            print(df)
+
+    elif args.command == 'allin':
+        all_in_results = calculate_all_in_ev(args.csv_dir, args.json_dir, args.workers, aliases, args.seed,
+                                             args.big_blind, samples=args.samples)
+        player_counters = calculate_overall_counters(args.csv_dir, args.json_dir, args.big_blind, args.workers,
+                                                     args.cache_dir, aliases=aliases)
+        df = all_in_ev_dataframe(all_in_results, player_counters)
+        CSVWriter().write(df, 'Poker Hands/CSV Output/all_in_ev_stats.csv')
+        print(df.to_string())
+
+    elif args.command == 'opponents':
+        _, matrix = calculate_overall_opponents(args.csv_dir, args.json_dir, args.big_blind, args.workers, aliases,
+                                                args.cache_dir)
+        df = opponents_dataframe(matrix)
+        CSVWriter().write(df, 'Poker Hands/CSV Output/opponent_stats.csv')
+        if args.player:
+            player_name = args.player.lower()
+            player_name = aliases.get(player_name, player_name)
+            df = df.loc[[player_name]] if matrix.opponents(player_name) else df.iloc[:0]
+        print(df.to_string())
+        print(f'{len(matrix)} player/opponent pairs')
+
+    elif args.command == 'player' and args.approximate:
+        sample = update_hand_sample(args.csv_dir, args.json_dir, args.cache_dir, args.sample_size, aliases=aliases)
+        player_name = args.name.lower()
+        player_name = aliases.get(player_name, player_name)
+        estimates = sample.estimates().get(player_name)
+        if estimates is None:
+            print(f'No hands for {args.name} in a sample of {len(sample.hands)} hands', file=sys.stderr)
+            return 1
+        print(f'{player_name}, estimated from {len(sample.hands)} of {sample.seen} hands')
+        for column in SESSION_COLUMNS:
+            if column in estimates:
+                value, n, low, high = estimates[column]
+                print(f'  {column:<16}{value}  (n={n}, 95% CI {low} to {high})')
+
+    elif args.command == 'player':
+        # Straight from the cached counters, without loading pandas
+        player_counters = calculate_overall_counters(args.csv_dir, args.json_dir, args.big_blind, os.cpu_count(),
+                                                     args.cache_dir, aliases=aliases)
+        player_name = args.name.lower()
+        player_name = aliases.get(player_name, player_name)
+        if player_name not in player_counters:
+            print(f'No hands or ledger entries for {args.name}', file=sys.stderr)
+            return 1
+        row = counters_to_rows({player_name: player_counters[player_name]})[player_name]
+        intervals = counters_to_intervals(player_counters[player_name])
+        print(player_name)
+        for column in SESSION_COLUMNS:
+            if column in intervals:
+                _, n, low, high = intervals[column]
+                print(f'  {column:<16}{row[column]}  (n={n}, 95% CI {low} to {high})')
+            else:
+                print(f'  {column:<16}{row[column]}')
+
+    elif args.approximate:
+        sample = update_hand_sample(args.csv_dir, args.json_dir, args.cache_dir, args.sample_size, aliases=aliases)
+        df = intervals_dataframe(sample.estimates())
+        CSVWriter().write(df, 'Poker Hands/CSV Output/approximate_player_stats.csv')
+        print(f'Estimated from {len(sample.hands)} of {sample.seen} hands')
+        print(df.to_string())
+
+    elif args.profile:
+        report = RunReport(args.profile_memory)
+        try:
+            calculate_overall_stats(args.csv_dir, args.json_dir, args.big_blind, cache_directory=args.cache_dir,
+                                    aliases=aliases, report=report,
+                                    profile_filepath='Poker Hands/CSV Output/getStats.prof', positional=args.positions,
+                                    formats=formats, intervals=args.intervals)
+        finally:
+            report.close()
+        report.write('Poker Hands/CSV Output/run_report.csv')
+        print(pd.DataFrame(report.rows).to_string(index=False))
+
+    else:
+        print(calculate_overall_stats(args.csv_dir, args.json_dir, args.big_blind, workers=args.workers,
+                                      cache_directory=args.cache_dir, aliases=aliases, positional=args.positions,
+                                      formats=formats, intervals=args.intervals))
+    return 0
 
-    for hand in data['hands']:
-        flop_seen = False
-        raise_count = 0
-        players_in_hand = set()  # Players who've played in this hand
-
-        # Create a mapping of seat numbers to player names for this hand
-        seat_to_name = {player['seat']: player['name'].lower() for player in hand['players']}
-
-        for event in hand['events']:
-            payload = event['payload']
-            action_type = payload['type']
-            player_seat = payload.get('seat', None)
-
-            # Mark the flop event
-            if 'turn' in payload and payload['turn'] == 1:  # Flop
-                flop_seen = True
-
-            # Initialize player stats if player_seat exists
-            if player_seat:
-                player_name = seat_to_name[player_seat]
-
-                if player_name not in player_stats:
-                    player_stats[player_name] = {
-                        '4bet_count': 0, 'hands_played': 0
-                    }
-
-                # Track 4-bet
-                if not flop_seen and action_type == 8:  # Raise before flop
-                    raise_count += 1
-
-                if raise_count == 3:  # Third raise is a 4-bet
-                    player_stats[player_name]['4bet_count'] += 1
-                    raise_count = 0  # Reset raise count for next hand
-
-                players_in_hand.add(player_name)
-
-        # Increment the hands played for the players involved
-        for player in players_in_hand:
-            player_stats[player]['hands_played'] += 1
-
-    # Calculating final 4-bet percentage
-    for player_name, stats in player_stats.items():
-        stats['4bet'] = round(stats['4bet_count'] / stats['hands_played'] * 100, 2)
-        del stats['4bet_count']  # Remove the count after calculating the percentage
-
-    return player_stats
-
-
-def main(json_filepath, csv_filepath):
-    with open(json_filepath, 'r') as file:
-        data = json.load(file)
-        vpip_stats = calculate_vpip(data)
-        pfr_stats = calculate_pfr(data)
-        agg_stats = calculate_agg(data)
-        pnl_stats = calculate_pnl(csv_filepath)
-        hands_played_stats = {player_name: stats['hands_played'] for player_name, stats in vpip_stats.items()}
-        bb_per_100_hands_stats = calculate_bb_per_100_hands(pnl_stats, hands_played_stats, 0.5)
-        three_bet_stats = calculate_three_bet(data)
-        four_bet_stats = calculate_four_bet(data) 
-        c_bet_stats = calculate_c_bet(data)
-        fold_to_3_bet_stats = calculate_fold_to_three_bet(data)
-        fold_to_c_bet_stats = calculate_fold_to_c_bet(data)
-        showdown_stats = calculate_showdown_stats(data)
-
-        # Convert each stats dictionary to a DataFrame
-        vpip_df = pd.DataFrame.from_dict(vpip_stats, orient='index')
-        pfr_df = pd.DataFrame.from_dict(pfr_stats, orient='index').drop(columns=['hands_played'])
-        agg_df = pd.DataFrame.from_dict(agg_stats, orient='index').drop(columns=['hands_played'])
-        pnl_df = pd.DataFrame.from_dict(pnl_stats, orient='index').rename(columns={0: 'PnL'})
-        three_bet_df = pd.DataFrame.from_dict(three_bet_stats, orient='index').drop(columns=['hands_played'])
-        four_bet_df = pd.DataFrame.from_dict(four_bet_stats, orient='index').drop(columns=['hands_played'])
-        c_bet_df = pd.DataFrame.from_dict(c_bet_stats, orient='index').drop(columns=['hands_played'])
-        fold_to_3_bet_df = pd.DataFrame.from_dict(fold_to_3_bet_stats, orient='index').drop(columns=['hands_played'])
-        fold_to_c_bet_df = pd.DataFrame.from_dict(fold_to_c_bet_stats, orient='index').drop(columns=['hands_played'])
-        showdown_df = pd.DataFrame.from_dict(showdown_stats, orient='index').drop(columns=['hands_played'])  # Add this line
-
-        bb_per_100_hands_df = pd.DataFrame.from_dict(bb_per_100_hands_stats, orient='index').rename(columns={0: 'BB/100 Hands'})
-
-        # Merge the DataFrames on the index (player name)
-        df = pd.concat([vpip_df, pfr_df, agg_df, c_bet_df, three_bet_df, four_bet_df, fold_to_3_bet_df, fold_to_c_bet_df, pnl_df, bb_per_100_hands_df, showdown_df], axis=1)  # Add showdown_df here
-
-        return df
 
 if __name__ == '__main__':
-    csv_directory = 'Poker Hands/CSV Data'  # Replace with the path to your CSV files directory
-    json_directory = 'Poker Hands/JSON Data'  # Replace with the path to your JSON files directory
-    overall_stats_df = calculate_overall_stats(csv_directory, json_directory, 0.5)
-    overall_stats_df = merge_players_stats(overall_stats_df, 'levels', 'norm')  # Replace 'player1' and 'player2' with the names of the players to merge
-    print(overall_stats_df)
\ No newline at end of file
+    sys.exit(cli())
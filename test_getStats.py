@@ -0,0 +1,515 @@
+import io
+import json
+import os
+import random
+import threading
+import tracemalloc
+import urllib.error
+import urllib.request
+from datetime import datetime, timezone
+from itertools import combinations
+
+import pytest
+
+import benchmark
+import getStats
+
+
+def random_hands(seed, n_hands=300):
+    # Event sequences that needn't make sense as poker: random seated actions, boards dealt at
+    # any point and showdowns with and without a seat, so both engines see every edge case
+    rng = random.Random(seed)
+    hands = []
+    for hand_number in range(n_hands):
+        seats = rng.sample(range(1, 10), rng.randint(2, 6))
+        players = [{'seat': seat, 'name': f'Player{rng.randint(0, 7)}-{seat}', 'id': str(seat)} for seat in seats]
+        events = []
+        street = 0
+        for _ in range(rng.randint(0, 25)):
+            roll = rng.random()
+            if roll < 0.1 and street < 3:
+                street += 1
+                events.append({'payload': {'type': getStats.BOARD, 'turn': street}})
+            elif roll < 0.15:
+                events.append({'payload': {'type': getStats.SHOWDOWN}})
+            else:
+                action_type = rng.choice([getStats.CHECK, getStats.CALL, getStats.RAISE, getStats.RAISE,
+                                          getStats.FOLD, getStats.WIN, getStats.SHOWDOWN, getStats.BIG_BLIND,
+                                          getStats.SMALL_BLIND])
+                events.append({'payload': {'type': action_type, 'seat': rng.choice(seats),
+                                           'value': rng.randint(1, 50)}})
+        hand = {'id': f'hand{hand_number}', 'players': players, 'events': events}
+        if rng.random() < 0.9:
+            hand['dealerSeat'] = rng.choice(seats + [rng.randint(1, 9)])
+        hands.append(hand)
+    return hands
+
+
+@pytest.fixture
+def session(tmp_path):
+    json_filepath = str(tmp_path / 'poker_now_log_test.json')
+    csv_filepath = str(tmp_path / 'ledger_test.csv')
+    benchmark.generate_session(json_filepath, csv_filepath, hands=300, players=9, table_size=9, seed=1)
+    return json_filepath, csv_filepath
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_vectorized_matches_run_stats(seed):
+    pytest.importorskip('numpy')
+    hands = random_hands(seed)
+    registry = getStats.PlayerRegistry()
+    expected = getStats.run_stats(hands, getStats.default_accumulators(), registry)
+    assert getStats.calculate_counters_vectorized(getStats.load_event_table(hands, registry)) == expected
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_vectorized_matches_run_stats_by_position(seed):
+    pytest.importorskip('numpy')
+    hands = random_hands(seed)
+    registry = getStats.PlayerRegistry()
+    expected = getStats.run_stats(hands, getStats.default_accumulators(), registry, positional=True)
+    table = getStats.load_event_table(hands, registry)
+    assert getStats.calculate_counters_vectorized(table, positional=True) == expected
+
+
+def test_positional_counters_add_up_to_player_counters():
+    hands = random_hands(0)
+    registry = getStats.PlayerRegistry()
+    by_position = getStats.run_stats(hands, getStats.default_accumulators(), registry, positional=True)
+    summed = {}
+    for player_key, counters in by_position.items():
+        summed.setdefault(player_key // getStats.N_POSITIONS, getStats.PlayerCounters())
+        summed[player_key // getStats.N_POSITIONS] += counters
+    assert summed == getStats.run_stats(hands, getStats.default_accumulators(), registry)
+
+
+def test_hand_positions():
+    def labels(dealer_seat, seats):
+        positions = getStats.hand_positions({'dealerSeat': dealer_seat, 'players': [{'seat': seat} for seat in seats]})
+        return {seat: getStats.POSITIONS[position] for seat, position in positions.items()}
+
+    assert labels(4, (1, 3, 4, 7, 9)) == {4: 'BTN', 7: 'SB', 9: 'BB', 1: 'UTG', 3: 'CO'}
+    # An empty dealer seat passes the button back to the closest seat before it
+    assert labels(5, (1, 3, 4, 7, 9)) == labels(4, (1, 3, 4, 7, 9))
+    # Heads up the button is the small blind, so there are only BTN and BB
+    assert labels(1, (3, 7)) == {7: 'BTN', 3: 'BB'}
+
+
+def test_vectorized_matches_run_stats_on_generated_session(session):
+    pytest.importorskip('numpy')
+    hands = list(getStats.iter_hands(session[0]))
+    registry = getStats.PlayerRegistry()
+    expected = getStats.run_stats(hands, getStats.default_accumulators(), registry)
+    assert getStats.calculate_counters_vectorized(getStats.load_event_table(hands, registry)) == expected
+    assert any(counters.showdown_count for counters in expected.values())
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 7, 16, 64, 1 << 16])
+def test_hand_log_reader_chunk_boundaries(chunk_size):
+    # Numbers, literals and escapes cut at every possible offset must decode the same as json.loads
+    hand_log = {
+        'generatedAt': '2023-08-01T20:00:00Z', 'playerId': 'id-é', 'gameId': 'game', 'cents': False,
+        'hands': [{'id': f'h{i}', 'number': i, 'value': 1234567.25 * i, 'flag': i % 2 == 0, 'none': None,
+                   'name': 'quote " and \\ back\nslash', 'events': [{'payload': {'type': 8, 'value': 10 ** i}}]}
+                  for i in range(12)],
+        'trailing': [1, 2, 3],
+    }
+    text = json.dumps(hand_log, indent=1)
+    reader = getStats.HandLogReader(io.StringIO(text), chunk_size=chunk_size)
+    assert list(reader.iter_key('hands')) == hand_log['hands']
+
+
+def test_hand_log_reader_empty_hands():
+    reader = getStats.HandLogReader(io.StringIO('{"gameId": "x", "hands": [ ]}'), chunk_size=3)
+    assert list(reader.iter_key('hands')) == []
+
+
+def test_session_store_round_trip(session):
+    pytest.importorskip('numpy')
+    json_filepath, csv_filepath = session
+    getStats.write_session_store(json_filepath)
+    registry = getStats.PlayerRegistry()
+    table = getStats.load_session_store(json_filepath, registry)
+    expected = getStats.load_event_table(getStats.iter_hands(json_filepath), getStats.PlayerRegistry())
+    for field, _ in getStats.STORE_RECORD:
+        assert getattr(table, field).tolist() == getattr(expected, field).tolist()
+    assert table.hand_ids == expected.hand_ids
+
+    # calculate_session_stats reads the store and gives the same stats as the JSON
+    from_store = getStats.calculate_session_stats(json_filepath, csv_filepath)
+    stale = getStats.session_store_path(json_filepath)
+    with open(json_filepath, 'a') as file:
+        file.write(' ')  # A changed hand log makes the store stale
+    assert getStats.load_session_store(json_filepath, store_filepath=stale) is None
+    assert getStats.calculate_session_stats(json_filepath, csv_filepath) == from_store
+
+
+def brute_force_value(cards):
+    # Best five of seven as a comparable tuple: (category, ranks in the order they break ties)
+    best = None
+    for five in combinations(cards, 5):
+        ranks = sorted((card >> 2 for card in five), reverse=True)
+        counts = {rank: ranks.count(rank) for rank in ranks}
+        grouped = sorted(counts, key=lambda rank: (counts[rank], rank), reverse=True)
+        shape = sorted(counts.values(), reverse=True)
+        flush = len({card & 3 for card in five}) == 1
+        straight = None
+        if len(counts) == 5:
+            if ranks[0] - ranks[4] == 4:
+                straight = ranks[0]
+            elif ranks == [12, 3, 2, 1, 0]:  # Wheel, the ace plays low
+                straight = 3
+        if straight is not None and flush:
+            value = (8, straight)
+        elif shape == [4, 1]:
+            value = (7, *grouped)
+        elif shape == [3, 2]:
+            value = (6, *grouped)
+        elif flush:
+            value = (5, *ranks)
+        elif straight is not None:
+            value = (4, straight)
+        elif shape == [3, 1, 1]:
+            value = (3, *grouped)
+        elif shape == [2, 2, 1]:
+            value = (2, *grouped)
+        elif shape == [2, 1, 1, 1]:
+            value = (1, *grouped)
+        else:
+            value = (0, *ranks)
+        best = value if best is None or value > best else best
+    return best
+
+
+def test_hand_value_matches_brute_force():
+    rng = random.Random(7)
+    hands = [rng.sample(range(52), 7) for _ in range(1500)]
+    # Hands made on purpose to hit the rarer categories and the wheel
+    for ranks, suits in (('AKQJT92', 'ssssshd'), ('A2345KK', 'shdcsss'), ('5432AJ9', 'hhhhhcd'),
+                         ('KKKK2QQ', 'shdcsdh'), ('QQQJJ22', 'shdcsdh'), ('7766552', 'shdcsdh')):
+        hands.append([getStats.parse_card(rank + suit) for rank, suit in zip(ranks, suits)])
+    values = [getStats.hand_value(cards) for cards in hands]
+    expected = [brute_force_value(cards) for cards in hands]
+    for i in range(len(hands) - 1):
+        assert (values[i] > values[i + 1]) == (expected[i] > expected[i + 1])
+        assert (values[i] == values[i + 1]) == (expected[i] == expected[i + 1])
+    assert sorted(range(len(hands)), key=values.__getitem__) == sorted(range(len(hands)), key=expected.__getitem__)
+
+
+def test_stats_cache_keys(tmp_path):
+    cache_key = getStats.StatsCache(str(tmp_path)).session_key
+    key = cache_key('json', 'csv', 'aliases', False, 20)
+    assert key == cache_key('json', 'csv', 'aliases', False, 20)
+    # Any change to the files, aliases, breakdown or stakes gives another entry
+    assert len({key, cache_key('json2', 'csv', 'aliases', False, 20),
+                cache_key('json', 'csv2', 'aliases', False, 20),
+                cache_key('json', 'csv', 'aliases2', False, 20),
+                cache_key('json', 'csv', 'aliases', True, 20),
+                cache_key('json', 'csv', 'aliases', False, 40),
+                cache_key('json', 'csv', 'aliases', False, 20, opponents=True)}) == 7
+
+
+def test_stats_cache_round_trip_and_eviction(tmp_path):
+    cache = getStats.StatsCache(str(tmp_path), max_entries=2)
+    stats = {'alice': getStats.PlayerCounters(list(range(len(getStats.COUNTER_FIELDS)))),
+             ('bob', 'BTN'): getStats.PlayerCounters()}
+    for number, key in enumerate('abc'):
+        cache.put(key, stats)
+        os.utime(cache.entry_path(key), (number, number))
+    assert cache.get('a') == stats
+    assert cache.get('missing') is None
+
+    # Reading 'a' made it the most recently used, so 'b' goes first
+    assert cache.evict() == 1
+    assert cache.get('b') is None and cache.get('a') == stats and cache.get('c') == stats
+
+    # Entries from another STATS_VERSION are ignored
+    with open(cache.entry_path('old'), 'w') as file:
+        json.dump({'version': getStats.STATS_VERSION - 1, 'stats': []}, file)
+    assert cache.get('old') is None
+
+    # Other state in the directory is left alone
+    (tmp_path / 'rolling.json').write_text('{}')
+    assert cache.invalidate() == 3
+    assert os.listdir(tmp_path) == ['rolling.json']
+
+
+def test_overall_counters_reuse_the_cache(tmp_path, monkeypatch):
+    benchmark.generate_archive(str(tmp_path), sessions=3, hands=50, players=6, table_size=6)
+    csv_directory = str(tmp_path / 'Poker Hands' / 'CSV Data')
+    json_directory = str(tmp_path / 'Poker Hands' / 'JSON Data')
+    cache_directory = str(tmp_path / 'cache')
+    expected = getStats.calculate_overall_counters(csv_directory, json_directory)
+    assert getStats.calculate_overall_counters(csv_directory, json_directory,
+                                               cache_directory=cache_directory) == expected
+
+    def fail(*args, **kwargs):
+        raise AssertionError('a cached session was computed again')
+
+    monkeypatch.setattr(getStats, 'calculate_session_stats', fail)
+    assert getStats.calculate_overall_counters(csv_directory, json_directory,
+                                               cache_directory=cache_directory) == expected
+
+
+def write_session_files(tmp_path, json_name, csv_name, game_id, started_at, ledger_started_at=None):
+    # A one-hand hand log starting at started_at, epoch seconds, and a ledger starting then too
+    # unless ledger_started_at is given
+    for directory in ('json', 'csv'):
+        (tmp_path / directory).mkdir(exist_ok=True)
+    hand = {'id': 'h1', 'startedAt': started_at * 1000, 'bigBlind': 20, 'dealerSeat': 1,
+            'players': [{'seat': 1, 'name': 'alice'}, {'seat': 2, 'name': 'bob'}], 'events': []}
+    (tmp_path / 'json' / json_name).write_text(json.dumps({'gameId': game_id, 'hands': [hand]}))
+    session_start = datetime.fromtimestamp(ledger_started_at or started_at, timezone.utc).isoformat().replace('+00:00', 'Z')
+    (tmp_path / 'csv' / csv_name).write_text(f'player_nickname,session_start_at,net\nalice,{session_start},100\n')
+
+
+def test_session_catalog_pairing(tmp_path):
+    day = 24 * 60 * 60
+    write_session_files(tmp_path, 'poker_now_log_a.json', 'ledger_a.csv', 'a', 0)  # Same file name game id
+    write_session_files(tmp_path, 'export.json', 'ledger_b.csv', 'b', 10 * day)  # gameId inside the export
+    # No game id in common, paired by start times an hour apart, and left alone two days apart
+    write_session_files(tmp_path, 'renamed.json', 'sunday.csv', None, 20 * day, 20 * day + 3600)
+    write_session_files(tmp_path, 'lonely.json', 'far.csv', None, 30 * day, 32 * day)
+
+    catalog = getStats.SessionCatalog(str(tmp_path / 'sessions.catalog'))
+    sessions, unmatched = catalog.scan(str(tmp_path / 'csv'), str(tmp_path / 'json'))
+    pairs = {os.path.basename(session.json_filepath): os.path.basename(session.csv_filepath) for session in sessions}
+    assert pairs == {'poker_now_log_a.json': 'ledger_a.csv', 'export.json': 'ledger_b.csv',
+                     'renamed.json': 'sunday.csv'}
+    assert sorted(map(os.path.basename, unmatched)) == ['far.csv', 'lonely.json']
+    assert catalog.files[str(tmp_path / 'json' / 'export.json')]['big_blind'] == 20
+    catalog.save()
+
+    # A saved catalog pairs unchanged files without opening them again
+    catalog = getStats.SessionCatalog(str(tmp_path / 'sessions.catalog'))
+    catalog.read_hand_log_info = catalog.read_ledger_start = None
+    assert catalog.scan(str(tmp_path / 'csv'), str(tmp_path / 'json'))[0] == sessions
+
+
+def test_incremental_report_matches_full_write(tmp_path):
+    pytest.importorskip('pandas')
+    snapshot_filepath = str(tmp_path / 'report.snapshot')  # Reloaded each time, as between runs
+    basepath = str(tmp_path / 'stats')
+    hands = random_hands(0, n_hands=600)
+
+    def counters_after(n_hands):
+        registry = getStats.PlayerRegistry()
+        return registry.named(getStats.run_stats(hands[:n_hands], getStats.default_accumulators(), registry))
+
+    def full_write(player_counters, report_format):
+        filepath = str(tmp_path / f'full.{report_format}')
+        getStats.WRITERS[report_format]().write(getStats.counters_to_dataframe(player_counters).sort_index(), filepath)
+        with open(filepath) as file:
+            return file.read()
+
+    # Formats written in turns, so each file is sometimes left out of a write while the stats move on
+    for n_hands, formats in ((200, ['csv']), (300, ['jsonl']), (400, ['jsonl']), (500, ['csv']),
+                             (550, ['csv', 'jsonl']), (600, ['jsonl', 'csv'])):
+        player_counters = counters_after(n_hands)
+        getStats.write_report(player_counters, basepath, formats, getStats.ReportSnapshot(snapshot_filepath))
+        for report_format in formats:
+            with open(f'{basepath}.{report_format}') as file:
+                assert file.read() == full_write(player_counters, report_format), (n_hands, report_format)
+
+
+def valid_hand(**changes):
+    hand = {'id': 'h1', 'dealerSeat': 1, 'bigBlind': 20,
+            'players': [{'seat': 1, 'name': 'alice'}, {'seat': 2, 'name': 'bob'}],
+            'events': [{'payload': {'type': getStats.SMALL_BLIND, 'seat': 1, 'value': 10}},
+                       {'payload': {'type': getStats.BIG_BLIND, 'seat': 2, 'value': 20}},
+                       {'payload': {'type': getStats.BOARD, 'turn': 1, 'cards': ['Ah', 'Td', '2c']}},
+                       {'payload': {'type': getStats.SHOWDOWN}}]}
+    hand.update(changes)
+    return hand
+
+
+def with_event(payload):
+    return valid_hand(events=valid_hand()['events'] + [{'payload': payload}])
+
+
+@pytest.mark.parametrize('hand, reason', [
+    ([1], 'hand is not an object'),
+    (valid_hand(players=None), 'no players or events'),
+    (valid_hand(players=[{'seat': 1}]), 'player without a name'),
+    (valid_hand(players=[{'seat': '1', 'name': 'alice'}]), "player 'alice' has no seat"),
+    (valid_hand(players=[{'seat': 1, 'name': 'alice'}, {'seat': 1, 'name': 'bob'}]), 'seat 1 taken twice'),
+    (valid_hand(dealerSeat=[1]), 'dealer seat [1] is not a number'),
+    (valid_hand(bigBlind='20'), "big blind '20' is not a number"),
+    (valid_hand(events=[1]), 'event 0 has no payload'),
+    (with_event({'type': 99}), 'event 4 has unknown type 99'),
+    (with_event({'type': [7], 'seat': 1}), 'event 4 has unknown type [7]'),
+    (with_event({'type': {'call': 7}, 'seat': 1}), "event 4 has unknown type {'call': 7}"),
+    (with_event({'type': getStats.CALL, 'seat': 5, 'value': 20}), 'event 4 is for seat 5, which nobody sits in'),
+    (with_event({'type': getStats.CALL, 'seat': [1], 'value': 20}),
+     'event 4 is for seat [1], which nobody sits in'),
+    (with_event({'type': getStats.FOLD}), 'event 4 of type 11 has no seat'),
+    (with_event({'type': getStats.CALL, 'seat': 1, 'value': '20'}), 'event 4 of type 7 has no chip value'),
+    (with_event({'type': getStats.BOARD, 'turn': 4}), 'event 4 deals unknown street 4'),
+    (with_event({'type': getStats.WIN, 'seat': 1, 'cards': ['1x']}), "event 4 has unreadable cards ['1x']"),
+])
+def test_validate_hand(hand, reason):
+    assert getStats.validate_hand(valid_hand()) is None
+    assert getStats.validate_hand(hand) == reason
+
+
+def test_iter_hands_quarantines_bad_hands(tmp_path):
+    json_filepath = tmp_path / 'poker_now_log_q.json'
+    hands = [valid_hand(id='good1'), valid_hand(id='bad', bigBlind='20'), [1], valid_hand(id='good2'),
+             with_event({'type': [7], 'seat': 1})]
+    text = json.dumps({'gameId': 'q', 'hands': hands})
+    json_filepath.write_text(text[:-30])  # Cut short in the last hand, like an interrupted download
+
+    assert [hand['id'] for hand in getStats.iter_hands(str(json_filepath))] == ['good1', 'good2']
+    rows = getStats.quarantine_report(str(tmp_path))
+    assert [(row['index'], row['id']) for row in rows] == [(1, 'bad'), (2, None), (4, None)]
+    assert rows[2]['reason'].startswith('hand log cut short')
+    # The catalog reads the start and stakes of the first hand that passes
+    json_filepath.write_text(json.dumps({'gameId': 'q', 'hands': hands[1:]}))
+    assert getStats.SessionCatalog().read_hand_log_info(str(json_filepath))[2] == 20
+
+    # Reading the hand log cleanly again removes its quarantine file
+    json_filepath.write_text(json.dumps({'gameId': 'q', 'hands': hands[:1]}))
+    assert len(list(getStats.iter_hands(str(json_filepath)))) == 1
+    assert getStats.quarantine_report(str(tmp_path)) == []
+
+
+@pytest.fixture
+def stats_server(tmp_path):
+    # A StatsService over a two-session archive, with a third session held back to upload
+    benchmark.generate_archive(str(tmp_path), sessions=3, hands=60, players=6, table_size=6)
+    csv_directory = str(tmp_path / 'Poker Hands' / 'CSV Data')
+    json_directory = str(tmp_path / 'Poker Hands' / 'JSON Data')
+    upload = {}
+    for key, filepath in (('hand_log', os.path.join(json_directory, 'poker_now_log_bench0002.json')),
+                          ('ledger', os.path.join(csv_directory, 'ledger_bench0002.csv'))):
+        with open(filepath) as file:
+            upload[key] = json.load(file) if key == 'hand_log' else file.read()
+        os.remove(filepath)
+
+    service = getStats.StatsService(csv_directory, json_directory, str(tmp_path / 'cache'))
+    server = getStats.ThreadingHTTPServer(('127.0.0.1', 0), getStats.StatsRequestHandler)
+    server.service = service
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    def request(path, body=None):
+        data = None if body is None else json.dumps(body).encode()
+        try:
+            with urllib.request.urlopen(f'http://127.0.0.1:{server.server_port}{path}', data) as response:
+                return response.status, json.loads(response.read())
+        except urllib.error.HTTPError as error:
+            return error.code, json.loads(error.read())
+
+    yield service, request, upload, csv_directory, json_directory
+    server.shutdown()
+    server.server_close()
+
+
+def archive_files(*directories):
+    return sorted(name for directory in directories for name in os.listdir(directory))
+
+
+def test_stats_server_queries(stats_server):
+    service, request, _, _, _ = stats_server
+    status, players = request('/players')
+    assert status == 200 and players == sorted(service.state[0])
+    status, player = request('/players/PLAYER1')
+    assert status == 200 and player['player'] == 'player1'
+    assert player['stats']['hands_played'] == player['intervals']['VPIP']['n']
+    status, leaders = request('/leaderboard?stat=VPIP&limit=3&order=asc')
+    assert status == 200 and len(leaders) == 3
+    assert [leader['VPIP'] for leader in leaders] == sorted(leader['VPIP'] for leader in leaders)
+    assert request('/players/nobody')[0] == 404
+    assert request('/leaderboard?stat=nope')[0] == 400
+    assert request('/leaderboard?limit=many')[0] == 400
+    assert request('/nothing')[0] == 404
+
+
+def test_stats_server_uploads(stats_server):
+    service, request, upload, csv_directory, json_directory = stats_server
+    status, result = request('/sessions', upload)
+    assert status == 201 and result == {'game_id': 'bench0002', 'hands': 60, 'replaced': False}
+    expected = getStats.calculate_overall_counters(csv_directory, json_directory)
+    assert service.state[0] == expected
+
+    # Uploading it again replaces the session instead of counting it twice
+    status, result = request('/sessions', upload)
+    assert status == 201 and result['replaced']
+    assert service.state[0] == expected
+
+
+@pytest.mark.parametrize('change, status', [
+    ({'ledger': 'player_nickname,net\nalice,abc\n'}, 400),
+    ({'hand_log': {'gameId': 'bench0002', 'hands': [1, 2]}}, 400),
+    ({'hand_log': {'gameId': 'bench0002', 'hands': [with_event({'type': [7], 'seat': 1})]}}, 400),
+    ({'game_id': '../escape'}, 400),
+    ({'ledger': None}, 400),
+])
+def test_stats_server_rejects_bad_uploads(stats_server, change, status):
+    service, request, upload, csv_directory, json_directory = stats_server
+    files = archive_files(csv_directory, json_directory)
+    counters = service.state[0]
+    assert request('/sessions', dict(upload, **change))[0] == status
+    # Nothing reaches the archive, which still reloads
+    assert archive_files(csv_directory, json_directory) == files
+    assert request('/reload', {})[0] == 200
+    assert service.state[0] == counters
+
+
+def test_stats_server_answers_unexpected_errors(stats_server, monkeypatch):
+    service, request, upload, csv_directory, json_directory = stats_server
+    files = archive_files(csv_directory, json_directory)
+
+    def fail(*args, **kwargs):
+        raise RuntimeError('boom')
+
+    monkeypatch.setattr(getStats, 'calculate_session_stats', fail)
+    assert request('/sessions', upload) == (500, {'error': 'RuntimeError: boom'})
+    assert archive_files(csv_directory, json_directory) == files
+
+
+def test_run_report_memory_tracing(session):
+    json_filepath, csv_filepath = session
+    report = getStats.RunReport()
+    getStats.calculate_session_stats(json_filepath, csv_filepath, report=report)
+    assert not tracemalloc.is_tracing()
+    assert {row['stage'] for row in report.rows} == {'store', 'stats', 'parse', 'ledger'}
+    assert all(row['peak_mib'] is None for row in report.rows)
+
+    report = getStats.RunReport(trace_memory=True)
+    with report.stage('outer'):
+        inner_rows = getStats.instrumented_session_stats(json_filepath, csv_filepath, trace_memory=True)[1]
+        held = [bytearray(1 << 20) for _ in range(4)]
+    report.close()
+    assert not tracemalloc.is_tracing()
+    stats_row = next(row for row in inner_rows if row['stage'] == 'stats')
+    # The outer stage saw its own allocations and those of the stages run inside it
+    assert report.rows[0]['peak_mib'] >= max(4, stats_row['peak_mib']) and len(held) == 4
+
+
+def test_opponents_dataframe():
+    pytest.importorskip('pandas')
+    df = getStats.opponents_dataframe(getStats.OpponentMatrix())
+    assert len(df) == 0 and list(df.index.names) == ['player', 'opponent']
+
+    matrix = getStats.OpponentMatrix()
+    matrix.add('alice', 'bob', 0, 10)
+    matrix.add('alice', 'bob', 3, 1)
+    matrix.add('alice', 'bob', 4, 4)
+    matrix.add('bob', 'alice', 0, 10)
+    df = getStats.opponents_dataframe(matrix)
+    assert list(df.index) == [('alice', 'bob'), ('bob', 'alice')]
+    assert df.loc[('alice', 'bob'), '3bet'] == 25.0 and df.loc[('bob', 'alice'), '3bet'] == 0.0
+    assert getStats.OpponentMatrix.from_list(matrix.as_list()) == matrix
+
+
+def test_bb_per_100_divides_by_each_sessions_big_blind():
+    registry = getStats.PlayerRegistry()
+    player_counters = {}
+    # The ledger is scaled down by 100 (see calculate_pnl): 5.0 is 500 chips, 10 big blinds at 50
+    getStats.add_ledger_pnl(player_counters, registry, {'alice': 5.0}, 50)
+    getStats.add_ledger_pnl(player_counters, registry, {'alice': -2.0}, 100)
+    alice = player_counters[registry.intern('alice')]
+    assert alice.pnl == 3.0 and alice.pnl_bb == 8.0
+    stats = getStats.calculate_bb_per_100_hands({'alice': alice.pnl_bb}, {'alice': 200})
+    assert stats['alice'] == 4.0